@@ -1,8 +1,11 @@
-import os
 import time
+_import_start = time.perf_counter()
+
+import os
 import json
-import re
-from flask import Flask, request, jsonify, session
+import uuid
+import threading
+from flask import Flask, request, jsonify, session, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv 
@@ -13,6 +16,15 @@ import llm
 import rag 
 import validate 
 import telemetry 
+import jobs
+import ollama_client
+import response_cache
+import prompt
+import sessions
+import generation
+import stream_json
+import uploads
+import pregen
 
 # configs for flask app
 UPLOAD_FOLDER = 'uploads'
@@ -21,9 +33,40 @@ load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = 'super_secret_dev_key_change_in_prod'
-CORS(app, supports_credentials=True, origins=["http://localhost:9000", "http://localhost:8080", "http://localhost:5173", "http://localhost:3000"])
+CORS_ORIGINS = ["http://localhost:9000", "http://localhost:8080", "http://localhost:5173", "http://localhost:3000"]
+CORS(app, supports_credentials=True, origins=CORS_ORIGINS)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Heavy resources (embedding model, Chroma, Ollama client) load lazily on first use.
+# Set WARMUP_ON_START=1 in production to load them in the background right after startup.
+startup_report = {"import_sec": round(time.perf_counter() - _import_start, 3), "warmup_sec": None}
+print(f"Backend app ready in {startup_report['import_sec']}s")
+
+def warm_up():
+    start_time = time.perf_counter()
+    rag.warm_up()
+    llm.warm_up()
+    startup_report["warmup_sec"] = round(time.perf_counter() - start_time, 3)
+    print(f"Warm-up finished in {startup_report['warmup_sec']}s")
+
+if os.getenv("WARMUP_ON_START", "0") == "1":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+# Seconds a stopping server waits for queued/running ingestion jobs (see gunicorn.conf.py)
+SHUTDOWN_DRAIN_SEC = float(os.getenv("SHUTDOWN_DRAIN_SEC", "30"))
+
+def shutdown():
+    """
+    Graceful drain, run by the server once in-flight requests are done: new uploads are
+    refused and ingestion jobs get SHUTDOWN_DRAIN_SEC to finish.
+    """
+    pregen.shutdown()
+    unfinished = jobs.shutdown(SHUTDOWN_DRAIN_SEC)
+    if unfinished:
+        print(f"Shutdown: {unfinished} ingestion job(s) did not finish and must be re-uploaded")
+    telemetry.flush()
+    print("Shutdown complete")
+
 @app.route('/')
 def test():
     return "Hello, World!"
@@ -43,122 +86,469 @@ def upload():
     
     if file:
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
-        # Save file temporarily before processing
-        file.save(filepath)
+        # Hold the file in memory (or an anonymous spool file if large) until the job reads it;
+        # it is only written under a name if a page needs OCR
+        upload = uploads.SpooledPDF(app.config['UPLOAD_FOLDER']).write_from(file.stream)
         
-        # Call RAG module to process
-        success, msg = rag.ingest_file(filepath, filename)
+        # Hand extraction/chunking/embedding to the background ingestion pool
+        job = jobs.submit(filename, _ingest_upload, upload, filename, "/upload")
+        if job is None:
+            upload.close()
+            return jsonify({"error": "Too many uploads in progress. Please try again shortly."}), 429
         
-        # Clean up the file after processing 
-        os.remove(filepath)
-        
-        if success:
-            return jsonify({"message": msg, "filename": filename}), 200
-        else:
-            return jsonify({"error": msg}), 500
+        return jsonify({"message": "File queued for processing", "filename": filename, "job_id": job.id}), 202
 
-@app.route('/chat', methods=['POST'])
-def chat():
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    """
+    Many PDFs in one request: any number of "files" parts, each a PDF or a zip of a course
+    folder. Every PDF becomes its own ingestion job and they run in parallel on the ingestion
+    pool. Returns the batch id and, per file, its job id or why it was rejected; per-file
+    results are then at /upload_batch/<batch_id>.
+    """
+    parts = request.files.getlist('files') + request.files.getlist('file')
+    if not parts:
+        return jsonify({"error": "No file part"}), 400
+
+    batch = uploads.Batch(app.config['UPLOAD_FOLDER'])
+    for part in parts:
+        batch.add_part(part)
+    if not batch.files:
+        return jsonify({"error": "No PDF files in the upload", "rejected": batch.rejected}), 400
+
+    submitted = jobs.submit_batch([(filename, _ingest_upload, (upload, filename, "/upload_batch"))
+                                   for filename, upload in batch.files])
+    if submitted is None:
+        batch.close()
+        return jsonify({"error": "Too many uploads in progress. Please try again shortly."}), 429
+
+    batch_id, batch_jobs = submitted
+    return jsonify({
+        "message": f"{len(batch_jobs)} file(s) queued for processing",
+        "batch_id": batch_id,
+        "files": [{"filename": job.filename, "job_id": job.id} for job in batch_jobs],
+        "rejected": batch.rejected,
+    }), 202
+
+@app.route('/upload_batch/<batch_id>', methods=['GET'])
+def upload_batch_status(batch_id):
+    batch_jobs = jobs.get_batch(batch_id)
+    if batch_jobs is None:
+        return jsonify({"error": "Unknown batch id"}), 404
+    files = [job.to_dict() for job in batch_jobs]
+    statuses = [f["status"] for f in files]
+    return jsonify({
+        "batch_id": batch_id,
+        "status": "done" if all(status in ("done", "failed") for status in statuses) else "running",
+        "done": statuses.count("done"),
+        "failed": statuses.count("failed"),
+        "pending": len(statuses) - statuses.count("done") - statuses.count("failed"),
+        "files": files,
+    }), 200
+
+def _ingest_upload(upload, filename, endpoint, progress):
+    """
+    Runs on an ingestion worker: processes the upload, then releases its memory / spool file.
+    """
     start_time = time.perf_counter()
-    data = request.json
-    query = data.get('query', '')
+    success = False
+    try:
+        success, msg = rag.ingest_file(upload, filename, progress)
+    finally:
+        upload.close()
+        telemetry.log("ingest", endpoint, upload.size, 0, time.perf_counter() - start_time, success=success)
+    if success:
+        # flashcard/quiz decks for it are generated whenever Ollama is idle
+        pregen.source_ingested(filename)
+    return success, msg
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job.to_dict()), 200
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        "startup": startup_report,
+        "ingestion": jobs.stats(),
+        "extraction": rag.extraction_stats(),
+        "embeddings": rag.embedder.stats(),
+        "retrieval": rag.get_retrieval_stats(),
+        "ollama": ollama_client.stats(),
+        "response_cache": response_cache.cache.stats(),
+        "sessions": sessions.store.stats(),
+        "generation": generation.stats(),
+        "pregen": pregen.stats(),
+        "telemetry": telemetry.stats(),
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Latency percentiles (p50/p95/p99) per endpoint and pathway, with time to first token
+    and per-stage breakdowns where recorded.
+    """
+    return jsonify(telemetry.metrics()), 200
+
+# The steps around the model call are plain functions shared by these Flask routes and the
+# async routes in asgi.py; only the LLM call itself differs between the two.
+
+NO_SOURCES_REPLY = "I couldn't find any sources. Please ensure you have uploaded at least one pdf or make sure the file is not corrupted."
+
+def prepare_chat(session_id, query, endpoint, start_time):
+    """
+    Everything a chat request does before calling the model: validation, retrieval,
+    the response cache lookup and prompt assembly.
+    Returns (turn, None), or (None, (body, status)) when the request is answered here.
+    """
+    stages = telemetry.Stages(start_time)
     is_safe, msg = validate.validate_query(query)
+    stages.mark("validate")
 
     # input query validation/safety check
     if not is_safe:
-        telemetry.log("blocked", "/chat", len(query), 0, time.perf_counter() - start_time, success=False)
-        return jsonify({"response": msg}), 400
+        telemetry.log("blocked", endpoint, len(query), 0, time.perf_counter() - start_time, success=False,
+                      stages=stages.timings)
+        return None, ({"response": msg}, 400)
     
     # RAG retrival logic
     context, sources = rag.retrieve_context(query)
 
     if not context:
-        resp = "I couldn't find any sources. Please ensure you have uploaded at least one pdf or make sure the file is not corrupted."
-        telemetry.log("rag_no_context", "/chat", len(query), 0, time.time() - start_time)
-        return jsonify({"response":resp, "sources":[]})
+        stages.mark("retrieve")
+        telemetry.log("rag_no_context", endpoint, len(query), 0, time.perf_counter() - start_time,
+                      stages=stages.timings)
+        return None, ({"response": NO_SOURCES_REPLY, "sources": []}, 200)
+    
+    # Retrieve chat history from the session store (defaults to empty list)
+    chat_history = sessions.store.history(session_id, limit=MAX_HISTORY_MESSAGES)
     
-    # Retrieve chat history from session (defaults to empty list)
-    chat_history = session.get('chat_history', [])
+    # the model is only called if this question wasn't already answered from these chunks
+    cached, query_embedding = _cached_chat_answer(query, sources)
+    stages.mark("retrieve")
+    turn = {
+        "session_id": session_id, "query": query, "sources": sources, "endpoint": endpoint,
+        "start_time": start_time, "stages": stages, "cached": cached, "query_embedding": query_embedding,
+        "chat_history": chat_history, "messages": None, "prompt_report": {},
+    }
+    if cached is None:
+        turn["messages"], turn["chat_history"], turn["prompt_report"] = _build_chat_prompt(
+            session_id, query, sources, chat_history
+        )
+        stages.mark("prompt")
+    return turn, None
+
+def finish_chat(turn, resp, ttft=None, failed=False):
+    """
+    Caches the answer, stores the turn in the session and logs telemetry.
+    failed marks a streamed answer that broke off (it may end in LLM_ERROR after partial
+    tokens); like LLM_ERROR itself, it is neither cached nor stored in the session.
+    """
+    # everything since prepare_chat returned was the model call (or sending the cached answer)
+    turn["stages"].mark("llm")
+    failed = failed or resp == llm.LLM_ERROR
+    if turn["cached"] is None and not failed and resp.strip():
+        response_cache.cache.put("chat", llm.MODEL_NAME, turn["sources"], resp, turn["query"], turn["query_embedding"])
+
+    if not failed:
+        # Store the response AND the sources used for this specific answer
+        _remember_turn(turn["session_id"], turn["chat_history"], turn["query"], resp, turn["sources"])
+
+    pathway = "rag_cached" if turn["cached"] is not None else "rag"
+    telemetry.log(pathway, turn["endpoint"], len(turn["query"]), len(resp),
+                  time.perf_counter() - turn["start_time"], success=not failed, ttft=ttft,
+                  stages=turn["stages"].timings, **turn["prompt_report"])
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    start_time = time.perf_counter()
+    data = request.json
+    query = data.get('query', '')
+
+    turn, early = prepare_chat(_session_id(), query, "/chat", start_time)
+    if early:
+        return jsonify(early[0]), early[1]
+
+    resp = turn["cached"] if turn["cached"] is not None else llm.chat_messages(turn["messages"])
+    finish_chat(turn, resp)
+
+    return jsonify({"response": resp, "sources": turn["sources"]}), 200
+
+def _cached_chat_answer(query, sources):
+    """
+    Looks up a cached answer for this question (or a near-identical one) over the same chunks.
+    Returns (answer or None, query embedding); the embedding comes from the embedder's query cache.
+    """
+    query_embedding = rag.embedder.embed_query([query])[0]
+    return response_cache.cache.get("chat", llm.MODEL_NAME, sources, query, query_embedding), query_embedding
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+def _session_id():
+    """
+    The session cookie only carries this id; history and other per-session state live in sessions.store.
+    """
+    session_id = session.get('sid')
+    if session_id is None:
+        session_id = session['sid'] = new_session_id()
+    return session_id
+
+# Turns beyond this are folded into the session's running summary
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+
+def _build_chat_prompt(session_id, query, sources, chat_history):
+    """
+    Assembles the token-budgeted prompt for this turn. Turns that no longer fit are folded
+    into the session summary and dropped from the stored and returned history.
+    Returns (messages, history, telemetry fields).
+    """
+    summary = sessions.store.get(session_id, 'chat_summary', '')
+    history_ids = [chunk_id for msg in chat_history for chunk_id in msg.get("sources", [])]
+    chunk_texts = rag.get_chunks(list(dict.fromkeys(sources + history_ids)))
+    messages, summary, compacted, report = prompt.build_chat_prompt(
+        llm.CHAT_SYSTEM_PROMPT, chat_history, summary, sources, chunk_texts, query
+    )
+    if compacted:
+        chat_history = chat_history[2 * compacted:]
+        sessions.store.drop_oldest(session_id, 2 * compacted)
+        sessions.store.set(session_id, 'chat_summary', summary)
+    return messages, chat_history, {
+        "prompt_tokens": report["prompt_tokens"],
+        "compacted_turns": report["compacted_turns"],
+        "repeated_chunks": report["repeated_chunks"],
+    }
 
-    llm_history = [
-        {"role": msg["role"], "content": msg["content"]} 
-        for msg in chat_history
+def _remember_turn(session_id, chat_history, query, resp, sources):
+    """
+    Appends the turn to the session store (only the two new messages are written).
+    """
+    turn = [
+        {"role": "user", "content": query},
+        {"role": "assistant", "content": resp, "sources": sources},
     ]
-    
-    # call model to generate response
-    resp = llm.chat(context, query, llm_history)
+    sessions.store.append(session_id, turn)
+    summary = sessions.store.get(session_id, 'chat_summary', '')
+    kept, summary = prompt.compact_history(chat_history + turn, summary, MAX_HISTORY_MESSAGES)
+    dropped = len(chat_history) + len(turn) - len(kept)
+    if dropped:
+        sessions.store.drop_oldest(session_id, dropped)
+        sessions.store.set(session_id, 'chat_summary', summary)
+
+def sse(data, event=None):
+    msg = f"event: {event}\n" if event else ""
+    return msg + f"data: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Same as /chat, but streams the answer as Server-Sent Events:
+    a "sources" event first, then one message per token, then a "done" event.
+    """
+    start_time = time.perf_counter()
+    data = request.json
+    query = data.get('query', '')
+
+    turn, early = prepare_chat(_session_id(), query, "/chat/stream", start_time)
+    if early:
+        return jsonify(early[0]), early[1]
+
+    def generate():
+        yield sse({"sources": turn["sources"]}, event="sources")
+        tokens = []
+        ttft = None
+        finished = False
+        try:
+            # a cached answer is sent as a single token
+            for token in ([turn["cached"]] if turn["cached"] is not None else llm.chat_messages(turn["messages"], stream=True)):
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                tokens.append(token)
+                yield sse({"token": token})
+            finished = True
+        finally:
+            # the store is server-side, so the turn can be saved after the response headers went out;
+            # a stream that ended in LLM_ERROR or was closed early (client gone) failed
+            failed = not finished or tokens[-1:] == [llm.LLM_ERROR]
+            resp = "".join(tokens)
+            finish_chat(turn, resp, ttft=ttft, failed=failed)
+        yield sse({"response_length": len(resp)}, event="done")
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+# chunk ids remembered per session so repeated "generate" clicks cover new material
+MAX_RECENT_CHUNKS = 25
 
-    chat_history.append({"role": "user", "content": query})
-    # Store the response AND the sources used for this specific answer
-    chat_history.append({"role": "assistant", "content": resp, "sources": sources})
+def _sample_generation_context(session_id, data, n=6):
+    """
+    Samples flashcard/quiz context for the request body's optional "source" (one PDF) and
+    "prefer_unseen" (default true: skip chunks this session already generated from).
+    Returns (chunk texts, chunk ids, error message or None).
+    """
+    source = data.get('source')
+    if source is not None and source not in rag.list_sources():
+        return [], [], f"Unknown source: {source}"
 
-    # Limit to last 6 messages (3 turns) to prevent exceeding 4KB cookie limit
-    session['chat_history'] = chat_history[-6:]
+    recent = sessions.store.get(session_id, 'recent_chunks', [])
+    exclude = recent if data.get('prefer_unseen', True) else ()
+    chunks = rag.get_random_chunks(n=n, source=source, exclude=exclude)
+    chunk_ids = [chunk_id for chunk_id, _ in chunks]
+    _remember_chunks(session_id, recent, chunk_ids)
+    return [text for _, text in chunks], chunk_ids, None
+
+def _remember_chunks(session_id, recent, chunk_ids):
+    if chunk_ids:
+        sessions.store.set(session_id, 'recent_chunks', ([i for i in recent if i not in chunk_ids] + chunk_ids)[-MAX_RECENT_CHUNKS:])
+
+def _take_pregenerated(session_id, data, template):
+    """
+    A deck generated ahead of time for the request's "source" (see pregen.py), skipping decks
+    built on chunks this session already saw unless "prefer_unseen" is false. None if there is none.
+    """
+    recent = sessions.store.get(session_id, 'recent_chunks', [])
+    exclude = recent if data.get('prefer_unseen', True) else ()
+    deck = pregen.take(template, data.get('source'), exclude)
+    if deck is not None:
+        _remember_chunks(session_id, recent, deck["chunk_ids"])
+    return deck
+
+@app.route('/sources', methods=['GET'])
+def sources():
+    return jsonify({"sources": rag.list_sources()}), 200
+
+# template -> (endpoint, message when there is nothing to generate from, what to return if the output can't be parsed)
+GENERATION_KINDS = {
+    "flashcards": ("/generate_flashcards", "No documents uploaded to generate cards from",
+                   [{"front": "Error parsing LLM output", "back": "Please try again"}]),
+    "quiz": ("/generate_quiz", "No documents uploaded", []),
+}
+
+def prepare_generation(session_id, data, template, start_time, endpoint=None):
+    """
+    Takes a pre-generated deck, or samples context and looks up cached output, for a
+    flashcard/quiz request. Returns (job, None), or (None, (body, status)) when there is
+    nothing to generate from.
+    """
+    stages = telemetry.Stages(start_time)
+    endpoint = endpoint or GENERATION_KINDS[template][0]
+    deck = _take_pregenerated(session_id, data, template)
+    if deck is not None:
+        stages.mark("retrieve")
+        return {"template": template, "endpoint": endpoint, "chunks": [], "chunk_ids": deck["chunk_ids"],
+                "cached": deck["response"], "pregen": True, "start_time": start_time, "stages": stages}, None
+
+    chunks, chunk_ids, error = _sample_generation_context(session_id, data)
     
-    telemetry.log("rag", "/chat", len(query), len(resp), time.perf_counter() - start_time)
+    if not chunks:
+        return None, ({"error": error or GENERATION_KINDS[template][1]}, 400)
+    
+    # the model is only called if these exact chunks weren't already turned into this template
+    cached = response_cache.cache.get(template, llm.MODEL_NAME, chunk_ids)
+    stages.mark("retrieve")
+    return {"template": template, "endpoint": endpoint, "chunks": chunks,
+            "chunk_ids": chunk_ids, "cached": cached, "start_time": start_time, "stages": stages}, None
 
-    return jsonify({"response": resp, "sources": sources}), 200
+def finish_generation(job, response, generation_stats=None, ttft=None):
+    """
+    Extracts the JSON items from the model output, caches them if usable and logs telemetry.
+    Returns the response body.
+    """
+    job["stages"].mark("llm")
+    template = job["template"]
+    fallback = GENERATION_KINDS[template][2]
+    if job.get("pregen"):
+        pathway = "pregen"
+    else:
+        pathway = "rag_cached" if job["cached"] is not None else "rag"
+    
+    # Parse JSON item by item, so text around it or one broken object doesn't lose the rest
+    items, malformed = stream_json.parse_items(response)
+    if not items and malformed:
+        items = fallback
+    elif items and pathway == "rag":
+        response_cache.cache.put(template, llm.MODEL_NAME, job["chunk_ids"], response)
+    job["stages"].mark("parse")
 
-@app.route('/generate_flashcards', methods=['POST'])
-def generate_flashcards():
+    telemetry.log(pathway, job["endpoint"], 0, len(response), time.perf_counter() - job["start_time"],
+                  ttft=ttft, stages=job["stages"].timings, **(generation_stats or {}))
+    return {template: items}
+
+def _generate(template):
     start_time = time.perf_counter()
     
     # Get context from RAG
-    context = rag.get_random_context(n=5)
+    job, early = prepare_generation(_session_id(), request.get_json(silent=True) or {}, template, start_time)
+    if early:
+        return jsonify(early[0]), early[1]
     
-    if not context:
-        return jsonify({"error": "No documents uploaded to generate cards from"}), 400
-    
-    # Generate via LLM module
-    response = llm.generate_flashcards(context)
-    
-    # Attempt to parse JSON
-    try:
-        # regex to find the array part if LLM yaps
-        match = re.search(r'\[.*\]', response, re.DOTALL)
-        if match:
-            flashcards = json.loads(match.group())
-        else:
-            flashcards = []
-    except:
-        flashcards = [{"front": "Error parsing LLM output", "back": "Please try again"}]
-
-    telemetry.log("rag","/generate_flashcards", 0, len(response), time.perf_counter() - start_time)
-    return jsonify({"flashcards": flashcards})
+    # Generate via LLM module (fanned out over shards of the context), unless cached
+    if job["cached"] is not None:
+        return jsonify(finish_generation(job, job["cached"]))
+    response, generation_stats = ollama_client.run(generation.generate(template, job["chunks"]))
+    return jsonify(finish_generation(job, response, generation_stats))
+
+def stream_generation(job, items, generation_stats):
+    """
+    Wraps a (sync) iterable of generated items as SSE messages, one "item" per card or
+    question, then a "done" event once the output is cached and logged.
+    """
+    generated = []
+    ttft = None
+    for item in items:
+        if ttft is None:
+            ttft = time.perf_counter() - job["start_time"]
+        generated.append(item)
+        yield sse({"item": item})
+    response = json.dumps(generated) if generated else llm.LLM_ERROR
+    finish_generation(job, response, generation_stats, ttft=ttft)
+    yield sse({"count": len(generated)}, event="done")
+
+def _generate_stream(template):
+    start_time = time.perf_counter()
+
+    job, early = prepare_generation(_session_id(), request.get_json(silent=True) or {}, template, start_time,
+                                    GENERATION_KINDS[template][0] + "/stream")
+    if early:
+        return jsonify(early[0]), early[1]
+
+    generation_stats = {}
+    if job["cached"] is not None:
+        items, _ = stream_json.parse_items(job["cached"])
+    else:
+        items = ollama_client.iterate(generation.generate_stream(template, job["chunks"], generation_stats))
+    return Response(stream_generation(job, items, generation_stats), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+@app.route('/generate_flashcards', methods=['POST'])
+def generate_flashcards():
+    return _generate("flashcards")
 
 @app.route('/generate_quiz', methods=['POST'])
 def generate_quiz():
-    start_time = time.perf_counter()
-    
-    # Getting context from RAG
-    context = rag.get_random_context(n=5)
-    
-    if not context:
-        return jsonify({"error": "No documents uploaded"}), 400
-    
-    # generating quiz via llm
-    response = llm.generate_quiz(context)
-    
-    # extract json from response
-    try:
-        match = re.search(r'\[.*\]', response, re.DOTALL)
-        if match:
-            quiz = json.loads(match.group())
-        else:
-            quiz = []
-    except:
-        quiz = []
-        
-    telemetry.log("rag", "/generate_quiz", 0, len(response), time.perf_counter() - start_time)
-    return jsonify({"quiz": quiz})
+    return _generate("quiz")
+
+@app.route('/generate_flashcards/stream', methods=['POST'])
+def generate_flashcards_stream():
+    """
+    Same as /generate_flashcards, but streams each card as a Server-Sent Event as soon as
+    the model has finished writing it, then a "done" event.
+    """
+    return _generate_stream("flashcards")
+
+@app.route('/generate_quiz/stream', methods=['POST'])
+def generate_quiz_stream():
+    return _generate_stream("quiz")
 
 if __name__ == "__main__":
     print("---------------------------------------------------------")
     print("STARTING FLASK BACKEND")
     print("Ensure Ollama is running locally (http://localhost:11434)")
     print("and Llama3 model is pulled.")
+    print("Development server only; use `gunicorn -c gunicorn.conf.py wsgi:app` in production.")
     print("---------------------------------------------------------")
     app.run(debug=True, host="0.0.0.0", port=9000)
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+Async entry point: uvicorn asgi:app --host 0.0.0.0 --port 9000
+
+/chat, /generate_flashcards, /generate_quiz and their /stream variants run as coroutines on the event
+loop, so a request waiting on Ollama costs a suspended coroutine instead of a thread. The short
+blocking steps around the model call (retrieval, session store) run in the default thread pool.
+Every other route is the Flask app, served through asgiref's WSGI adapter on the same thread pool.
+"""
+import json
+import time
+import asyncio
+from http.cookies import SimpleCookie
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from itsdangerous import BadSignature
+from werkzeug.http import dump_cookie
+
+import app as flask_app
+import llm
+import generation
+import stream_json
+
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    """
+    asgiref runs every WSGI request on one shared "thread sensitive" thread, which
+    serializes the Flask routes and, with requests overlapping, fails them with
+    "CurrentThreadExecutor already quit or is broken". Flask is thread safe (it runs
+    under gunicorn's threads), so the app is run on the default thread pool instead.
+    """
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._run_wsgi_app, thread_sensitive=False)(body)
+
+    def _run_wsgi_app(self, body):
+        # runs in a pool thread; start_response is called here, and sync_send hops back to the loop
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            self.sync_send({"type": "http.response.start", "status": 400, "headers": [(b"content-type", b"text/plain")]})
+            self.sync_send({"type": "http.response.body", "body": b"Bad Request"})
+            return
+        output = self.wsgi_application(environ, self.start_response)
+        try:
+            bytes_sent = 0
+            for chunk in output:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # never send more than the Content-Length the app declared
+                if self.response_content_length is not None:
+                    chunk = chunk[:self.response_content_length - bytes_sent]
+                self.sync_send({"type": "http.response.body", "body": chunk, "more_body": True})
+                bytes_sent += len(chunk)
+                if bytes_sent == self.response_content_length:
+                    break
+        finally:
+            if hasattr(output, "close"):
+                output.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({"type": "http.response.body"})
+
+
+class _Wsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _WsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+_flask = _Wsgi(flask_app.app)
+_serializer = flask_app.app.session_interface.get_signing_serializer(flask_app.app)
+_cookie_name = flask_app.app.config["SESSION_COOKIE_NAME"]
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.body = body
+        self.set_cookie = None
+
+    def json(self):
+        try:
+            data = json.loads(self.body or b"null")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    def session_id(self):
+        """
+        Reads the id from Flask's signed session cookie, issuing a new one if there is none,
+        so sessions are shared with the Flask routes.
+        """
+        cookie = SimpleCookie(self.headers.get("cookie", "")).get(_cookie_name)
+        data = {}
+        if cookie is not None:
+            try:
+                data = _serializer.loads(cookie.value)
+            except BadSignature:
+                pass
+        if data.get("sid") is None:
+            data["sid"] = flask_app.new_session_id()
+            config = flask_app.app.config
+            self.set_cookie = dump_cookie(
+                _cookie_name, _serializer.dumps(data),
+                path=config["SESSION_COOKIE_PATH"] or "/",
+                httponly=config["SESSION_COOKIE_HTTPONLY"],
+                secure=config["SESSION_COOKIE_SECURE"],
+                samesite=config["SESSION_COOKIE_SAMESITE"],
+            )
+        return data["sid"]
+
+    def response_headers(self, content_type, extra=None):
+        headers = [(b"content-type", content_type.encode())]
+        # mirror flask_cors for the routes handled here
+        origin = self.headers.get("origin")
+        if origin in flask_app.CORS_ORIGINS:
+            headers += [
+                (b"access-control-allow-origin", origin.encode("latin-1")),
+                (b"access-control-allow-credentials", b"true"),
+                (b"vary", b"Origin"),
+            ]
+        if self.set_cookie:
+            headers.append((b"set-cookie", self.set_cookie.encode("latin-1")))
+        for key, value in (extra or {}).items():
+            headers.append((key.lower().encode(), value.encode()))
+        return headers
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(request, send, data, status=200):
+    await send({"type": "http.response.start", "status": status,
+                "headers": request.response_headers("application/json")})
+    await send({"type": "http.response.body", "body": json.dumps(data).encode()})
+
+
+async def chat(request, send):
+    start_time = time.perf_counter()
+    data = request.json() or {}
+    query = data.get('query', '')
+
+    session_id = request.session_id()
+    turn, early = await asyncio.to_thread(flask_app.prepare_chat, session_id, query, "/chat", start_time)
+    if early:
+        return await _send_json(request, send, *early)
+
+    resp = turn["cached"] if turn["cached"] is not None else await llm.achat_messages(turn["messages"])
+    await asyncio.to_thread(flask_app.finish_chat, turn, resp)
+    await _send_json(request, send, {"response": resp, "sources": turn["sources"]})
+
+
+async def chat_stream(request, send):
+    start_time = time.perf_counter()
+    data = request.json() or {}
+    query = data.get('query', '')
+
+    session_id = request.session_id()
+    turn, early = await asyncio.to_thread(flask_app.prepare_chat, session_id, query, "/chat/stream", start_time)
+    if early:
+        return await _send_json(request, send, *early)
+
+    await send({"type": "http.response.start", "status": 200,
+                "headers": request.response_headers("text/event-stream", flask_app.SSE_HEADERS)})
+
+    async def event(data, event=None):
+        await send({"type": "http.response.body", "body": flask_app.sse(data, event).encode(), "more_body": True})
+
+    await event({"sources": turn["sources"]}, event="sources")
+    tokens = []
+    ttft = None
+    finished = False
+    if turn["cached"] is not None:
+        stream = None
+        token_source = _once(turn["cached"])
+    else:
+        stream = token_source = llm.achat_messages_stream(turn["messages"])
+    try:
+        async for token in token_source:
+            if ttft is None:
+                ttft = time.perf_counter() - start_time
+            tokens.append(token)
+            await event({"token": token})
+        finished = True
+    finally:
+        if stream is not None:
+            await stream.aclose()
+        # as in flask_app.chat_stream: ended in LLM_ERROR, or the client went away
+        failed = not finished or tokens[-1:] == [llm.LLM_ERROR]
+        resp = "".join(tokens)
+        await asyncio.to_thread(flask_app.finish_chat, turn, resp, ttft, failed)
+    await event({"response_length": len(resp)}, event="done")
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _once(value):
+    yield value
+
+
+def _generation_route(template):
+    async def route(request, send):
+        start_time = time.perf_counter()
+        session_id = request.session_id()
+        job, early = await asyncio.to_thread(
+            flask_app.prepare_generation, session_id, request.json() or {}, template, start_time
+        )
+        if early:
+            return await _send_json(request, send, *early)
+
+        if job["cached"] is not None:
+            return await _send_json(request, send, await asyncio.to_thread(flask_app.finish_generation, job, job["cached"]))
+        response, generation_stats = await generation.generate(template, job["chunks"])
+        # session writes and cache work, like finish_chat
+        await _send_json(request, send, await asyncio.to_thread(flask_app.finish_generation, job, response, generation_stats))
+    return route
+
+
+def _generation_stream_route(template):
+    async def route(request, send):
+        start_time = time.perf_counter()
+        session_id = request.session_id()
+        job, early = await asyncio.to_thread(
+            flask_app.prepare_generation, session_id, request.json() or {}, template, start_time,
+            flask_app.GENERATION_KINDS[template][0] + "/stream"
+        )
+        if early:
+            return await _send_json(request, send, *early)
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": request.response_headers("text/event-stream", flask_app.SSE_HEADERS)})
+        generation_stats = {}
+        if job["cached"] is not None:
+            stream = None
+            items = _once_each(stream_json.parse_items(job["cached"])[0])
+        else:
+            stream = items = generation.generate_stream(template, job["chunks"], generation_stats)
+        generated = []
+        ttft = None
+        try:
+            async for item in items:
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                generated.append(item)
+                await send({"type": "http.response.body", "body": flask_app.sse({"item": item}).encode(), "more_body": True})
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
+        response = json.dumps(generated) if generated else llm.LLM_ERROR
+        await asyncio.to_thread(flask_app.finish_generation, job, response, generation_stats, ttft)
+        await send({"type": "http.response.body", "body": flask_app.sse({"count": len(generated)}, event="done").encode()})
+    return route
+
+
+async def _once_each(values):
+    for value in values:
+        yield value
+
+
+ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/chat/stream"): chat_stream,
+    ("POST", "/generate_flashcards"): _generation_route("flashcards"),
+    ("POST", "/generate_quiz"): _generation_route("quiz"),
+    ("POST", "/generate_flashcards/stream"): _generation_stream_route("flashcards"),
+    ("POST", "/generate_quiz/stream"): _generation_stream_route("quiz"),
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # same drain as under gunicorn: stop taking uploads, let ingestion jobs finish
+            await asyncio.to_thread(flask_app.shutdown)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    route = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if route is None:
+        return await _flask(scope, receive, send)
+    request = Request(scope, await _read_body(receive))
+    await route(request, send)
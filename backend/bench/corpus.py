@@ -0,0 +1,158 @@
+"""
+Synthetic lecture-note PDFs for benchmarks, so runs don't depend on real course material.
+
+    python bench/corpus.py out_dir --pages 20 --scanned-pages 5
+
+"text" PDFs have a real text layer (the PyPDF2 path). "scanned" PDFs are one image per
+page with no text layer, so ingestion has to OCR them. Content is generated from a fixed
+seed and a small topic vocabulary, so two runs ingest the same text and chat queries
+built with query() find matching chunks.
+"""
+import os
+import sys
+import random
+import argparse
+
+from PIL import Image, ImageDraw, ImageFont
+
+TOPICS = {
+    "photosynthesis": ["chlorophyll", "light reactions", "Calvin cycle", "stomata", "glucose", "thylakoid"],
+    "cell respiration": ["mitochondria", "glycolysis", "Krebs cycle", "ATP synthase", "electron transport", "pyruvate"],
+    "genetics": ["alleles", "meiosis", "dominant traits", "Punnett squares", "mutations", "chromosomes"],
+    "databases": ["normalization", "indexes", "transactions", "query planner", "foreign keys", "isolation levels"],
+    "networking": ["TCP handshake", "congestion control", "routing tables", "DNS resolution", "packet loss", "latency"],
+    "algorithms": ["dynamic programming", "binary search", "graph traversal", "hash tables", "heaps", "amortized cost"],
+}
+
+VERBS = ["depends on", "is explained by", "is limited by", "regulates", "produces", "is measured through", "interacts with"]
+
+LINES_PER_PAGE = 40
+CHARS_PER_LINE = 90
+
+
+def _sentence(rng, topic):
+    a, b = rng.sample(TOPICS[topic], 2)
+    return f"In {topic}, {a} {rng.choice(VERBS)} {b}, which matters for exam question {rng.randint(1, 400)}."
+
+
+def page_lines(rng, page_number):
+    """
+    One page of notes: a heading and a few paragraphs on one or two topics, wrapped to lines.
+    """
+    topics = rng.sample(sorted(TOPICS), 2)
+    lines = [f"Lecture notes, page {page_number}: {topics[0]} and {topics[1]}", ""]
+    while len(lines) < LINES_PER_PAGE:
+        text = " ".join(_sentence(rng, rng.choice(topics)) for _ in range(rng.randint(3, 6)))
+        while text and len(lines) < LINES_PER_PAGE:
+            cut = text.rfind(" ", 0, CHARS_PER_LINE) if len(text) > CHARS_PER_LINE else len(text)
+            lines.append(text[:cut])
+            text = text[cut:].strip()
+        lines.append("")
+    return lines[:LINES_PER_PAGE]
+
+
+def write_text_pdf(path, pages):
+    """
+    Minimal PDF 1.4 writer: one Helvetica text block per page, no dependencies.
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_ref = font + 2 * len(pages) + 1     # the Pages object comes after every page and its content
+    kids = []
+    for lines in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        content = ("BT /F1 10 Tf 50 770 Td 17 TL " + " ".join(f"({line}) '" for line in escaped) + " ET").encode("latin-1")
+        stream = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_ref, font, stream)))
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), len(kids)))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_ref)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_scanned_pdf(path, pages, dpi=150):
+    """
+    Renders each page to a grayscale image (letter size at `dpi`) and saves them as an image-only PDF.
+    """
+    font = ImageFont.load_default(size=dpi // 7)
+    images = []
+    for lines in pages:
+        image = Image.new("L", (int(8.5 * dpi), 11 * dpi), 255)
+        draw = ImageDraw.Draw(image)
+        y = dpi // 2
+        for line in lines:
+            draw.text((dpi // 2, y), line, fill=0, font=font)
+            y += int(dpi / 4.2)
+        images.append(image)
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+
+
+def build(directory, documents, seed=0):
+    """
+    Writes `documents` ([{"name", "pages", "kind": "text" | "scanned"}]) into directory.
+    Returns [{"path", "name", "pages", "kind", "bytes"}].
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    built = []
+    for doc in documents:
+        pages = [page_lines(rng, number) for number in range(1, doc["pages"] + 1)]
+        path = os.path.join(directory, f"{doc['name']}.pdf")
+        if doc.get("kind", "text") == "scanned":
+            write_scanned_pdf(path, pages)
+        else:
+            write_text_pdf(path, pages)
+        built.append({"path": path, "name": doc["name"], "pages": doc["pages"],
+                      "kind": doc.get("kind", "text"), "bytes": os.path.getsize(path)})
+    return built
+
+
+def query(rng):
+    """
+    A student question about the corpus vocabulary; varied, so the response cache doesn't answer it.
+    """
+    topic = rng.choice(sorted(TOPICS))
+    term = rng.choice(TOPICS[topic])
+    template = rng.choice([
+        "What is the role of {term} in {topic}?",
+        "How does {term} relate to {topic}?",
+        "Explain {term} as covered in the {topic} notes.",
+        "Why is {term} important for {topic}, with an example?",
+    ])
+    return template.format(term=term, topic=topic) + f" (question {rng.randint(1, 10 ** 6)})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic PDF corpus")
+    parser.add_argument("directory")
+    parser.add_argument("--pages", type=int, default=20, help="pages of the text PDF")
+    parser.add_argument("--scanned-pages", type=int, default=0, help="pages of the scanned PDF (0 for none)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    documents = [{"name": f"notes_{args.pages}p", "pages": args.pages, "kind": "text"}]
+    if args.scanned_pages:
+        documents.append({"name": f"scan_{args.scanned_pages}p", "pages": args.scanned_pages, "kind": "scanned"})
+    for doc in build(args.directory, documents, args.seed):
+        print(f"{doc['path']}: {doc['pages']} {doc['kind']} pages, {doc['bytes']} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
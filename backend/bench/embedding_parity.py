@@ -0,0 +1,198 @@
+"""
+Parity check for the embedding backends: how closely an ONNX (optionally int8) backend
+agrees with the sentence-transformers model on retrieval, and what it costs.
+
+    cd backend
+    python bench/embedding_parity.py                                # synthetic corpus, int8 at 1/2/4 threads
+    python bench/embedding_parity.py notes.pdf slides.pdf --quantize int8,none --threads 2,4 -k 5
+
+The documents are chunked the way ingestion does it. Every backend runs in its own process
+(so load time and peak RSS are its own) and embeds all chunks, in EMBED_BATCH_SIZE batches,
+and every query, one at a time like /chat. For each candidate it reports:
+- overlap@k: the share of the reference's top-k chunks per query that the candidate also
+  ranks in its top k;
+- top-1: how often both put the same chunk first;
+- mixed@k: overlap@k when the candidate's query embeddings search the reference's chunk
+  embeddings, i.e. what switching EMBEDDING_BACKEND does to a collection that is already
+  stored;
+- the mean and minimum cosine between the two embeddings of the same chunk.
+It exits with code 1 if any candidate's overlap@k or mixed@k is below --min-overlap.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import corpus
+import chunker
+import embeddings
+from telemetry import percentiles
+
+
+def load_texts(paths, pages, n_queries, seed):
+    """
+    Returns (chunks, queries). Without paths, a synthetic corpus is used and the queries are
+    student questions about it; with PDFs, queries are sentences taken from random chunks.
+    """
+    rng = random.Random(seed)
+    if paths:
+        import rag
+        chunks = [text for path in paths for text, _, _ in chunker.chunk_pages(rag.iter_pdf_pages(path))]
+        queries = [chunker._SENTENCE_RE.split(rng.choice(chunks))[0] for _ in range(n_queries)]
+    else:
+        texts = ("\n".join(corpus.page_lines(rng, number)) for number in range(1, pages + 1))
+        chunks = [text for text, _, _ in chunker.chunk_pages(enumerate(texts, 1))]
+        queries = [corpus.query(rng) for _ in range(n_queries)]
+    return chunks, queries
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            return next(round(int(line.split()[1]) / 1024, 1) for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        return None
+
+
+def worker(spec, texts_path, out_path):
+    """
+    Runs in a child process: loads one backend, embeds the chunks and queries, saves the
+    vectors to out_path and prints its timings as JSON.
+    """
+    import numpy as np
+
+    with open(texts_path) as f:
+        texts = json.load(f)
+    options = {key: value for key, value in spec.items() if key != "backend"}
+
+    start = time.perf_counter()
+    model = embeddings.load_backend(spec["backend"], **options)
+    model(["warm up"])
+    load_sec = time.perf_counter() - start
+
+    chunk_vectors = []
+    start = time.perf_counter()
+    for i in range(0, len(texts["chunks"]), embeddings.EMBED_BATCH_SIZE):
+        chunk_vectors.extend(model(texts["chunks"][i:i + embeddings.EMBED_BATCH_SIZE]))
+    embed_sec = time.perf_counter() - start
+
+    query_vectors, query_times = [], []
+    for query in texts["queries"]:
+        start = time.perf_counter()
+        query_vectors.extend(model([query]))
+        query_times.append(time.perf_counter() - start)
+
+    np.savez(out_path, chunks=np.asarray(chunk_vectors, dtype=np.float32),
+             queries=np.asarray(query_vectors, dtype=np.float32))
+    print(json.dumps({
+        "load_sec": round(load_sec, 3),
+        "chunks_per_sec": round(len(texts["chunks"]) / embed_sec, 2),
+        "query_ms_p50": round(percentiles(query_times)["p50"] * 1000, 2),
+        "peak_rss_mb": _peak_rss_mb(),
+    }))
+
+
+def run_backend(spec, texts_path, workdir):
+    out_path = os.path.join(workdir, f"{len(os.listdir(workdir))}.npz")
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", json.dumps(spec), texts_path, out_path],
+                            cwd=BACKEND_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{label(spec)} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), out_path
+
+
+def agreement(reference_path, candidate_path, k):
+    import numpy as np
+
+    reference, candidate = np.load(reference_path), np.load(candidate_path)
+    # embeddings are normalized, so dot products are cosine similarities
+    top_reference = np.argsort(-(reference["queries"] @ reference["chunks"].T), axis=1)[:, :k]
+    top_candidate = np.argsort(-(candidate["queries"] @ candidate["chunks"].T), axis=1)[:, :k]
+    # queries from the candidate against chunks stored by the reference
+    top_mixed = np.argsort(-(candidate["queries"] @ reference["chunks"].T), axis=1)[:, :k]
+    overlap = [len(set(a) & set(b)) / len(a) for a, b in zip(top_reference, top_candidate)]
+    mixed = [len(set(a) & set(b)) / len(a) for a, b in zip(top_reference, top_mixed)]
+    cosines = (reference["chunks"] * candidate["chunks"]).sum(axis=1)
+    return {
+        f"overlap_at_{k}": round(float(np.mean(overlap)), 4),
+        f"mixed_overlap_at_{k}": round(float(np.mean(mixed)), 4),
+        "top1_agreement": round(float(np.mean(top_reference[:, 0] == top_candidate[:, 0])), 4),
+        "cosine_mean": round(float(cosines.mean()), 4),
+        "cosine_min": round(float(cosines.min()), 4),
+    }
+
+
+def label(spec):
+    if spec["backend"] != "onnx":
+        return spec["backend"]
+    return f"onnx {spec['quantize']} x{spec['threads']}"
+
+
+def main(argv=None):
+    if argv is None and sys.argv[1:2] == ["--worker"]:
+        return worker(json.loads(sys.argv[2]), sys.argv[3], sys.argv[4])
+
+    parser = argparse.ArgumentParser(description="Retrieval parity and speed of the embedding backends")
+    parser.add_argument("pdfs", nargs="*", help="PDFs to chunk (default: a synthetic corpus)")
+    parser.add_argument("--pages", type=int, default=60, help="pages of synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--reference", default="sentence-transformers")
+    parser.add_argument("--quantize", default="int8", help="comma-separated: int8, none")
+    parser.add_argument("--threads", default="1,2,4", help="comma-separated ONNX intra-op thread counts")
+    parser.add_argument("--onnx-dir", default=embeddings.EMBEDDING_ONNX_DIR, help="ONNX model directory")
+    parser.add_argument("--min-overlap", type=float, default=0.9)
+    parser.add_argument("--out", help="write the results as JSON here")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    chunks, queries = load_texts(args.pdfs, args.pages, args.queries, args.seed)
+    print(f"{len(chunks)} chunks, {len(queries)} queries")
+    workdir = tempfile.mkdtemp(prefix="embedding-parity-")
+    texts_path = os.path.join(workdir, "texts.json")
+    with open(texts_path, "w") as f:
+        json.dump({"chunks": chunks, "queries": queries}, f)
+
+    reference = {"backend": args.reference}
+    if args.reference == "onnx":
+        reference.update(quantize="none", threads=embeddings.EMBEDDING_THREADS, model_dir=args.onnx_dir)
+    candidates = [{"backend": "onnx", "quantize": quantize, "threads": int(threads), "model_dir": args.onnx_dir}
+                  for quantize in args.quantize.split(",") for threads in args.threads.split(",")]
+
+    rows = []
+    reference_result, reference_vectors = run_backend(reference, texts_path, workdir)
+    rows.append((label(reference), reference_result))
+    for spec in candidates:
+        result, vectors = run_backend(spec, texts_path, workdir)
+        result.update(agreement(reference_vectors, vectors, args.k))
+        rows.append((label(spec), result))
+
+    overlap_key, mixed_key = f"overlap_at_{args.k}", f"mixed_overlap_at_{args.k}"
+    print(f"\n{'backend':<24}{'load s':>8}{'chunks/s':>10}{'query ms':>10}{'peak MB':>9}"
+          f"{'overlap@' + str(args.k):>11}{'mixed@' + str(args.k):>9}{'top-1':>7}{'cos mean':>10}{'cos min':>9}")
+    for name, r in rows:
+        agree = (f"{r[overlap_key]:>11}{r[mixed_key]:>9}{r['top1_agreement']:>7}{r['cosine_mean']:>10}{r['cosine_min']:>9}"
+                 if overlap_key in r else "")
+        print(f"{name:<24}{r['load_sec']:>8}{r['chunks_per_sec']:>10}{r['query_ms_p50']:>10}{str(r['peak_rss_mb']):>9}{agree}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"chunks": len(chunks), "queries": len(queries), "k": args.k,
+                       "results": {name: r for name, r in rows}}, f, indent=2)
+    failed = [name for name, r in rows if min(r.get(overlap_key, 1.0), r.get(mixed_key, 1.0)) < args.min_overlap]
+    if failed:
+        print(f"\nBelow {args.min_overlap} overlap@{args.k} or mixed@{args.k}: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Stand-in for Ollama, so the backend can be load-tested on a machine without a GPU.
+
+    python bench/mock_ollama.py --port 11500 --latency 0.3 --tokens-per-sec 40 --max-parallel 4
+
+Serves /api/tags, /api/generate and /api/chat (streamed as NDJSON or not). Answers are
+canned: flashcard and quiz prompts get a JSON array of the asked-for number of items, chat
+gets --answer-tokens words. Timing follows a real server: --latency before the first
+token, then --tokens-per-sec, and at most --max-parallel requests decode at once (the rest
+wait, like OLLAMA_NUM_PARALLEL). Failures can be injected: --fail-rate answers 503,
+--cut-rate stops the response halfway, --malformed-rate breaks one generated item.
+GET /mock/stats returns request counts.
+"""
+import re
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+TOKEN_CHARS = 4     # roughly one llama token per 4 characters of English
+
+WORDS = ("the cell membrane regulates transport while mitochondria produce energy through respiration "
+         "and chloroplasts capture light for photosynthesis in plants every organism depends on enzymes").split()
+
+
+class MockOllama:
+    def __init__(self, latency, tokens_per_sec, max_parallel, answer_tokens,
+                 fail_rate, cut_rate, malformed_rate, seed=0):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.fail_rate = fail_rate
+        self.cut_rate = cut_rate
+        self.malformed_rate = malformed_rate
+        self._slots = threading.BoundedSemaphore(max_parallel)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "failed": 0, "cut": 0, "malformed": 0, "tokens": 0, "max_waiting": 0}
+        self._waiting = 0
+
+    def roll(self, rate):
+        with self._lock:
+            return self._rng.random() < rate
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def answer(self, path, body):
+        """
+        Returns the full response text for a request.
+        """
+        if path == "/api/chat":
+            words = [WORDS[i % len(WORDS)] for i in range(self.answer_tokens)]
+            return " ".join(words).capitalize() + "."
+        prompt = body.get("prompt", "")
+        match = re.search(r"generate (\d+)", prompt, re.IGNORECASE)
+        count = int(match.group(1)) if match else 10
+        seed = zlib.crc32(prompt.encode()) & 0xffff
+        if "multiple choice" in prompt.lower():
+            items = [{"question": f"Which statement about topic {seed}-{i} is correct?",
+                      "options": [f"Option {c} for {seed}-{i}" for c in "ABCD"],
+                      "correct_answer": f"Option B for {seed}-{i}"} for i in range(count)]
+        else:
+            items = [{"front": f"What is concept {seed}-{i}?",
+                      "back": f"Concept {seed}-{i} is how {' '.join(WORDS[i % 7:i % 7 + 6])}."} for i in range(count)]
+        parts = [json.dumps(item) for item in items]
+        if parts and self.roll(self.malformed_rate):
+            self.count("malformed")
+            parts[len(parts) // 2] = parts[len(parts) // 2][:-12]
+        return "[" + ", ".join(parts) + "]"
+
+    def acquire(self):
+        with self._lock:
+            self._waiting += 1
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], self._waiting)
+        self._slots.acquire()
+        with self._lock:
+            self._waiting -= 1
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._json({"models": [{"name": "llama3.1:latest"}]})
+            elif self.path == "/mock/stats":
+                with mock._lock:
+                    self._json(dict(mock.stats))
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path not in ("/api/generate", "/api/chat"):
+                return self._json({"error": "not found"}, 404)
+            mock.count("requests")
+            if mock.roll(mock.fail_rate):
+                mock.count("failed")
+                return self._json({"error": "injected failure"}, 503)
+
+            text = mock.answer(self.path, body)
+            tokens = [text[i:i + TOKEN_CHARS] for i in range(0, len(text), TOKEN_CHARS)]
+            cut = mock.roll(mock.cut_rate)
+            if cut:
+                mock.count("cut")
+                tokens = tokens[:len(tokens) // 2]
+
+            mock.acquire()
+            try:
+                time.sleep(mock.latency)
+                if body.get("stream", True):
+                    self._stream(tokens, chat=self.path == "/api/chat", cut=cut)
+                else:
+                    time.sleep(len(tokens) / mock.tokens_per_sec)
+                    mock.count("tokens", len(tokens))
+                    if cut:
+                        # headers promise the full body, then the connection drops
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/json")
+                        self.send_header("Content-Length", "100000")
+                        self.end_headers()
+                        self.wfile.write(b'{"response": "')
+                        self.close_connection = True
+                        return
+                    content = "".join(tokens)
+                    self._json({"message": {"role": "assistant", "content": content}, "done": True}
+                               if self.path == "/api/chat" else {"response": content, "done": True})
+            finally:
+                mock._slots.release()
+
+        def _stream(self, tokens, chat, cut):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            delay = 1 / mock.tokens_per_sec
+            for token in tokens + ([] if cut else [""]):
+                time.sleep(delay)
+                done = token == ""
+                data = {"message": {"role": "assistant", "content": token}} if chat else {"response": token}
+                data["done"] = done
+                line = (json.dumps(data) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+            mock.count("tokens", len(tokens))
+            if cut:
+                self.close_connection = True
+                return
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _json(self, data, status=200):
+            out = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock Ollama server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--max-parallel", type=int, default=4, help="requests decoded at once")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="words in a chat answer")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--cut-rate", type=float, default=0.0, help="share of responses cut off halfway")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of generations with a broken item")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    mock = MockOllama(args.latency, args.tokens_per_sec, args.max_parallel, args.answer_tokens,
+                      args.fail_rate, args.cut_rate, args.malformed_rate, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(mock))
+    server.daemon_threads = True
+    print(f"Mock Ollama on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,608 @@
+"""
+Offline benchmark: drives the backend against bench/mock_ollama.py and a synthetic corpus,
+so throughput can be measured and regression-tested on a machine without a GPU.
+
+    cd backend
+    python bench/run.py --profile smoke                   # prints and saves bench/results/smoke-<time>.json
+    python bench/run.py --profile smoke --save-baseline   # ... and makes it bench/baselines/smoke.json
+    python bench/run.py --profile smoke --compare bench/baselines/smoke.json   # exit code 1 on a regression
+
+Each run starts the mock and the app (uvicorn asgi:app, or --server gunicorn) with Chroma,
+sessions and telemetry in a fresh temp dir, then runs the profile's scenarios in order:
+upload (ingestion pages/sec), chat, chat_stream, flashcards, flashcards_stream and quiz, each
+at a set concurrency, reporting throughput, p50/p95/p99 latency (and time to first token
+for streams) and the server's peak RSS. --url benchmarks a server that is already running
+against a mock you started (peak RSS is then not measured); give it a fresh Chroma dir,
+or uploads are deduplicated and repeated questions come from the response cache.
+
+The app runs with deck pre-generation off (PREGEN=0), so generation scenarios measure live
+generation. --pregen turns it on, lets the deck pool fill before each generation scenario
+(deck_fill_sec) and reports each scenario's deck hits and misses; those runs get their own
+results and baselines and are only compared with each other.
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import corpus
+from telemetry import percentiles
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+BASELINES_DIR = os.path.join(BENCH_DIR, "baselines")
+
+LLM_ERROR = "Error connecting to LLM."      # llm.LLM_ERROR, sent with status 200
+STARTUP_TIMEOUT_SEC = 300                   # includes loading the embedding model
+REQUEST_TIMEOUT_SEC = 600
+DECK_FILL_TIMEOUT_SEC = 300                 # --pregen: how long to wait for the deck pool to fill
+
+PROFILES = {
+    # a few minutes on a laptop; what CI compares against its baseline
+    "smoke": {
+        "corpus": [
+            {"name": "notes_10p", "pages": 10},
+            {"name": "notes_40p", "pages": 40},
+            {"name": "scan_3p", "pages": 3, "kind": "scanned"},
+        ],
+        "mock": {"latency": 0.1, "tokens_per_sec": 200, "max_parallel": 4},
+        "scenarios": [
+            {"name": "upload", "concurrency": 2},
+            {"name": "chat", "requests": 40, "concurrency": 8},
+            {"name": "chat_stream", "requests": 40, "concurrency": 8},
+            {"name": "flashcards", "requests": 8, "concurrency": 4},
+            {"name": "flashcards_stream", "requests": 8, "concurrency": 4},
+            {"name": "quiz", "requests": 8, "concurrency": 4},
+        ],
+    },
+    # bigger corpus and many concurrent students, at a realistic model speed
+    "load": {
+        "corpus": [
+            {"name": "notes_50p", "pages": 50},
+            {"name": "notes_200p", "pages": 200},
+            {"name": "notes_500p", "pages": 500},
+            {"name": "scan_20p", "pages": 20, "kind": "scanned"},
+        ],
+        "mock": {"latency": 0.5, "tokens_per_sec": 40, "max_parallel": 8},
+        "scenarios": [
+            {"name": "upload", "concurrency": 4},
+            {"name": "chat", "requests": 400, "concurrency": 100},
+            {"name": "chat_stream", "requests": 400, "concurrency": 100},
+            {"name": "flashcards", "requests": 40, "concurrency": 20},
+            {"name": "flashcards_stream", "requests": 40, "concurrency": 20},
+            {"name": "quiz", "requests": 40, "concurrency": 20},
+        ],
+    },
+    # Ollama misbehaving: errors, dropped connections and broken JSON
+    "faults": {
+        "corpus": [{"name": "notes_10p", "pages": 10}],
+        "mock": {"latency": 0.1, "tokens_per_sec": 200, "max_parallel": 4,
+                 "fail_rate": 0.1, "cut_rate": 0.05, "malformed_rate": 0.3},
+        "scenarios": [
+            {"name": "upload", "concurrency": 1},
+            {"name": "chat", "requests": 60, "concurrency": 10},
+            {"name": "chat_stream", "requests": 60, "concurrency": 10},
+            {"name": "flashcards", "requests": 20, "concurrency": 5},
+            {"name": "quiz", "requests": 20, "concurrency": 5},
+        ],
+    },
+}
+
+
+# --- processes ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(port, options, log_path):
+    args = [sys.executable, os.path.join(BENCH_DIR, "mock_ollama.py"), "--port", str(port)]
+    for key, value in options.items():
+        args += ["--" + key.replace("_", "-"), str(value)]
+    return subprocess.Popen(args, stdout=open(log_path, "w"), stderr=subprocess.STDOUT)
+
+
+def start_app(server, port, ollama_url, workdir, pregen=False):
+    env = dict(
+        os.environ,
+        OLLAMA_API_URL=ollama_url,
+        CHROMA_PATH=os.path.join(workdir, "chroma"),
+        SESSION_DB_PATH=os.path.join(workdir, "sessions.db"),
+        TELEMETRY_LOG_FILE=os.path.join(workdir, "telemetry_logs.jsonl"),
+        WARMUP_ON_START="1",
+        PREGEN="1" if pregen else "0",
+    )
+    if server == "gunicorn":
+        args = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "wsgi:app"]
+    else:
+        args = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                "--log-level", "warning"]
+    return subprocess.Popen(args, cwd=BACKEND_DIR, env=env,
+                            stdout=open(os.path.join(workdir, "app.log"), "w"), stderr=subprocess.STDOUT)
+
+
+def wait_ready(url, process=None, log_path=None):
+    """
+    Waits until the app answers and its warm-up (model load) is done.
+    """
+    tail = lambda: open(log_path).read()[-2000:] if log_path else ""
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SEC
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}:\n{tail()}")
+        try:
+            startup = httpx.get(url + "/stats", timeout=5).json()["startup"]
+            if process is None or startup["warmup_sec"] is not None:
+                return startup
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {STARTUP_TIMEOUT_SEC}s:\n{tail()}")
+
+
+def stop(process, timeout=90):
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+class RssSampler:
+    """
+    Samples the resident memory of a process and all its children (gunicorn workers,
+    OCR pool) from /proc every `interval` seconds. Linux only; reports None elsewhere.
+    """
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.scenario_peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if os.path.exists(f"/proc/{self.pid}"):
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = _tree_rss_kb(self.pid)
+            self.peak_kb = max(self.peak_kb, rss)
+            self.scenario_peak_kb = max(self.scenario_peak_kb, rss)
+
+    def next_scenario(self):
+        """
+        Returns the peak since the previous call (in MB) and starts a new one.
+        """
+        peak, self.scenario_peak_kb = self.scenario_peak_kb, 0
+        return round(peak / 1024, 1) if self._thread.is_alive() else None
+
+    def stop(self):
+        self._stop.set()
+
+
+def _tree_rss_kb(pid):
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending += [int(child) for child in f.read().split()]
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+# --- scenarios ---
+
+async def _drive(url, requests, concurrency, send, seed):
+    """
+    Runs `requests` calls of send(client, rng) over `concurrency` workers, each with its own
+    client (and so its own session cookie). send returns (ok, time to first item or None).
+    Each scenario gets its own seed, so one doesn't replay the previous one's (cached) queries.
+    """
+    latencies, ttfts = [], []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(index):
+        nonlocal errors
+        rng = random.Random(f"{seed}-{index}")
+        async with httpx.AsyncClient(base_url=url, timeout=REQUEST_TIMEOUT_SEC) as client:
+            for _ in counter:
+                start = time.perf_counter()
+                try:
+                    ok, ttft = await send(client, rng)
+                except httpx.HTTPError:
+                    ok, ttft = False, None
+                latencies.append(time.perf_counter() - start)
+                if ttft is not None:
+                    ttfts.append(ttft - start)
+                errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    result = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round((requests - errors) / wall, 3) if wall else 0.0,
+        "latency_sec": _rounded(percentiles(latencies)),
+    }
+    if ttfts:
+        result["ttft_sec"] = _rounded(percentiles(ttfts))
+    return result
+
+
+def _rounded(values):
+    return {key: round(value, 4) for key, value in values.items()} if values else None
+
+
+async def _events(response):
+    """
+    Parses a Server-Sent Events response into (event, data) pairs as they arrive.
+    """
+    event = None
+    async for line in response.aiter_lines():
+        if line.startswith("event: "):
+            event = line[7:]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[6:])
+            event = None
+
+
+async def send_chat(client, rng):
+    response = await client.post("/chat", json={"query": corpus.query(rng)})
+    return response.status_code == 200 and response.json().get("response") not in (None, "", LLM_ERROR), None
+
+
+async def send_chat_stream(client, rng):
+    first = None
+    text = []
+    async with client.stream("POST", "/chat/stream", json={"query": corpus.query(rng)}) as response:
+        if response.status_code != 200:
+            return False, None
+        async for event, data in _events(response):
+            if "token" in data:
+                first = first or time.perf_counter()
+                text.append(data["token"])
+    answer = "".join(text)
+    return answer not in ("", LLM_ERROR), first
+
+
+def _send_generation(path, key):
+    async def send(client, rng):
+        response = await client.post(path, json={"prefer_unseen": True})
+        items = response.json().get(key) if response.status_code == 200 else None
+        # the flashcard route answers an unparseable output with a single error card
+        return bool(items) and items[0].get("front") != "Error parsing LLM output", None
+    return send
+
+
+def _send_generation_stream(path):
+    async def send(client, rng):
+        first = None
+        count = 0
+        async with client.stream("POST", path, json={"prefer_unseen": True}) as response:
+            if response.status_code != 200:
+                return False, None
+            async for event, data in _events(response):
+                if "item" in data:
+                    first = first or time.perf_counter()
+                    count += 1
+        return count > 0, first
+    return send
+
+
+SENDERS = {
+    "chat": send_chat,
+    "chat_stream": send_chat_stream,
+    "flashcards": _send_generation("/generate_flashcards", "flashcards"),
+    "flashcards_stream": _send_generation_stream("/generate_flashcards/stream"),
+    "quiz": _send_generation("/generate_quiz", "quiz"),
+    "quiz_stream": _send_generation_stream("/generate_quiz/stream"),
+}
+GENERATION_SCENARIOS = {"flashcards", "flashcards_stream", "quiz", "quiz_stream"}
+
+
+async def run_upload(url, documents, concurrency):
+    """
+    Uploads every document (at most `concurrency` at a time) and waits for its ingestion
+    job. Pages/sec is over the wall time of the whole batch, and per kind over the time
+    each document took from upload to done.
+    """
+    limit = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def ingest(client, doc):
+        async with limit:
+            start = time.perf_counter()
+            with open(doc["path"], "rb") as f:
+                response = await client.post("/upload", files={"file": (os.path.basename(doc["path"]), f, "application/pdf")})
+            status = "failed"
+            if response.status_code == 202:
+                job_id = response.json()["job_id"]
+                while True:
+                    job = (await client.get(f"/jobs/{job_id}")).json()
+                    if job.get("status") in ("done", "failed"):
+                        status = job["status"]
+                        break
+                    await asyncio.sleep(0.1)
+            results.append((doc, status == "done", time.perf_counter() - start))
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=url, timeout=REQUEST_TIMEOUT_SEC) as client:
+        await asyncio.gather(*(ingest(client, doc) for doc in documents))
+    wall = time.perf_counter() - start
+
+    pages = sum(doc["pages"] for doc, ok, _ in results if ok)
+    by_kind = {}
+    for doc, ok, seconds in results:
+        if ok:
+            kind = by_kind.setdefault(doc["kind"], {"documents": 0, "pages": 0, "sec": 0.0})
+            kind["documents"] += 1
+            kind["pages"] += doc["pages"]
+            kind["sec"] += seconds
+    return {
+        "documents": len(documents),
+        "concurrency": concurrency,
+        "errors": sum(not ok for _, ok, _ in results),
+        "error_rate": round(sum(not ok for _, ok, _ in results) / len(documents), 4) if documents else 0.0,
+        "pages": pages,
+        "wall_sec": round(wall, 3),
+        "pages_per_sec": round(pages / wall, 3) if wall else 0.0,
+        "by_kind": {
+            kind: {"documents": k["documents"], "pages": k["pages"], "pages_per_sec": round(k["pages"] / k["sec"], 3)}
+            for kind, k in by_kind.items()
+        },
+        "latency_sec": _rounded(percentiles([seconds for _, _, seconds in results])),
+    }
+
+
+def _pregen_counts(url):
+    stats = httpx.get(url + "/stats", timeout=30).json().get("pregen") or {}
+    return stats.get("served", 0), stats.get("misses", 0)
+
+
+def wait_for_decks(url):
+    """
+    Waits until pre-generation has no deck queued or in progress, as after a student's
+    pause, and returns the seconds that took.
+    """
+    started = time.perf_counter()
+    while time.perf_counter() - started < DECK_FILL_TIMEOUT_SEC:
+        if httpx.get(url + "/stats", timeout=30).json().get("pregen", {}).get("pending", 0) == 0:
+            break
+        time.sleep(0.5)
+    return round(time.perf_counter() - started, 3)
+
+
+def run_profile(profile, url, documents, sampler=None, seed=0, pregen=False):
+    results = {}
+    for scenario in profile["scenarios"]:
+        name = scenario["name"]
+        print(f"  {name} ...", flush=True)
+        if pregen:
+            # generation scenarios start from a full deck pool; deck_fill_sec isn't part of them
+            fill_sec = wait_for_decks(url) if name in GENERATION_SCENARIOS else None
+            served, misses = _pregen_counts(url)
+        if sampler is not None:
+            sampler.next_scenario()
+        if name == "upload":
+            result = asyncio.run(run_upload(url, documents, scenario["concurrency"]))
+        else:
+            result = asyncio.run(_drive(url, scenario["requests"], scenario["concurrency"], SENDERS[name], f"{seed}-{name}"))
+        if sampler is not None:
+            result["peak_rss_mb"] = sampler.next_scenario()
+        if pregen:
+            now_served, now_misses = _pregen_counts(url)
+            result["deck_hits"], result["deck_misses"] = now_served - served, now_misses - misses
+            if fill_sec is not None:
+                result["deck_fill_sec"] = fill_sec
+        results[name] = result
+        print(f"    {_summary(result)}", flush=True)
+    return results
+
+
+def _summary(result):
+    parts = []
+    if "pages_per_sec" in result:
+        parts.append(f"{result['pages']} pages, {result['pages_per_sec']} pages/s")
+    if "throughput_rps" in result:
+        parts.append(f"{result['throughput_rps']} req/s")
+    for key in ("latency_sec", "ttft_sec"):
+        if result.get(key):
+            p = result[key]
+            parts.append(f"{key.split('_')[0]} p50/p95/p99 {p['p50']}/{p['p95']}/{p['p99']}s")
+    parts.append(f"{result['errors']} errors")
+    if result.get("deck_hits") or result.get("deck_misses"):
+        parts.append(f"decks {result['deck_hits']} hit/{result['deck_misses']} missed")
+    if result.get("peak_rss_mb") is not None:
+        parts.append(f"peak RSS {result['peak_rss_mb']} MB")
+    return ", ".join(parts)
+
+
+# --- baselines ---
+
+# metric path -> True if higher is better
+COMPARED = {
+    "throughput_rps": True,
+    "pages_per_sec": True,
+    "latency_sec.p50": False,
+    "latency_sec.p95": False,
+    "latency_sec.p99": False,
+    "ttft_sec.p50": False,
+    "ttft_sec.p95": False,
+    "peak_rss_mb": False,
+}
+ERROR_RATE_SLACK = 0.01     # error rate may rise by this much (absolute) before it counts
+
+
+def _lookup(result, path):
+    for key in path.split("."):
+        if not isinstance(result, dict) or result.get(key) is None:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(run, baseline, tolerance):
+    """
+    Compares a run to a baseline scenario by scenario. A metric regresses when it is worse
+    by more than `tolerance` (relative). Returns (rows, regressions) where rows are
+    (scenario, metric, baseline, current, change).
+    """
+    rows, regressions = [], []
+    for name, current in run["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = _lookup(base, metric), _lookup(current, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append((name, metric, old, new, change))
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.0%})")
+        old, new = base.get("error_rate", 0.0), current.get("error_rate", 0.0)
+        rows.append((name, "error_rate", old, new, new - old))
+        if new - old > ERROR_RATE_SLACK:
+            regressions.append(f"{name} error_rate: {old} -> {new}")
+    return rows, regressions
+
+
+def print_comparison(rows, regressions):
+    print(f"\n{'scenario':<20}{'metric':<18}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, metric, old, new, change in rows:
+        print(f"{name:<20}{metric:<18}{old:>12}{new:>12}{change:>+10.1%}")
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+    else:
+        print("\nNo regressions.")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark against a mock Ollama")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="smoke")
+    parser.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    parser.add_argument("--url", help="benchmark this running server instead of starting one")
+    parser.add_argument("--out", help="where to write the results JSON (default bench/results/)")
+    parser.add_argument("--save-baseline", action="store_true", help="also write bench/baselines/<profile>[-pregen].json")
+    parser.add_argument("--compare", metavar="BASELINE", help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="relative change that counts as a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pregen", action="store_true",
+                        help="run with deck pre-generation on and report deck hits (with --url, start the server with PREGEN=1)")
+    args = parser.parse_args(argv)
+
+    profile = PROFILES[args.profile]
+    # pre-generated decks make generation scenarios incomparable with live ones
+    name = f"{args.profile}-pregen" if args.pregen else args.profile
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("pregen", False) != args.pregen:
+            print(f"{args.compare} was recorded with{'' if baseline.get('pregen') else 'out'} --pregen; "
+                  f"compare against a baseline recorded the same way")
+            return 2
+    workdir = tempfile.mkdtemp(prefix="studybuddy-bench-")
+    print(f"Profile {name}, work dir {workdir}")
+    documents = corpus.build(os.path.join(workdir, "corpus"), profile["corpus"], args.seed)
+
+    mock = app = sampler = None
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+            wait_ready(url)
+        else:
+            mock_port, app_port = _free_port(), _free_port()
+            mock = start_mock(mock_port, profile["mock"], os.path.join(workdir, "mock.log"))
+            app = start_app(args.server, app_port, f"http://127.0.0.1:{mock_port}", workdir, args.pregen)
+            url = f"http://127.0.0.1:{app_port}"
+            startup = wait_ready(url, app, os.path.join(workdir, "app.log"))
+            print(f"App ready (import {startup['import_sec']}s, warm-up {startup['warmup_sec']}s)")
+            sampler = RssSampler(app.pid).start()
+
+        scenarios = run_profile(profile, url, documents, sampler, args.seed, args.pregen)
+        server_stats = httpx.get(url + "/stats", timeout=30).json()
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        stop(app)
+        stop(mock)
+
+    run = {
+        "profile": args.profile,
+        "server": "external" if args.url else args.server,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": profile,
+        "pregen": args.pregen,
+        "peak_rss_mb": round(sampler.peak_kb / 1024, 1) if sampler is not None and sampler.peak_kb else None,
+        "scenarios": scenarios,
+        "server_stats": {key: server_stats.get(key) for key in ("ollama", "generation", "response_cache", "pregen", "telemetry")},
+    }
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults written to {out}")
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        baseline_path = os.path.join(BASELINES_DIR, f"{name}.json")
+        with open(baseline_path, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline written to {baseline_path}")
+
+    if args.compare:
+        rows, regressions = compare(run, baseline, args.tolerance)
+        print_comparison(rows, regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import math
+import re
+import heapq
+import threading
+from collections import Counter
+
+_TERM_RE = re.compile(r"\w+")
+
+# very common English words carry no ranking signal and have the longest posting lists
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its of on or that the this "
+    "to was were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    return [t for t in _TERM_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-process inverted index with Okapi BM25 scoring, updated incrementally as chunks
+    are added or removed. Exact-term matches (course codes, formula names, acronyms)
+    that dense embeddings tend to blur are what this index is for.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}     # term -> {doc_id: term frequency}
+        self._doc_terms = {}    # doc_id -> {term: term frequency}, needed for removal
+        self._doc_len = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, doc_id, text):
+        terms = Counter(tokenize(text))
+        with self._lock:
+            if doc_id in self._doc_len:
+                self.remove(doc_id)
+            self._doc_terms[doc_id] = dict(terms)
+            self._doc_len[doc_id] = sum(terms.values())
+            self._total_len += self._doc_len[doc_id]
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id):
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            self._total_len -= self._doc_len.pop(doc_id)
+            for term in terms:
+                posting = self._postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self._postings[term]
+
+    def search(self, query, k=10):
+        """
+        Returns up to k (doc_id, score) pairs, best first. Only the posting lists of the
+        query's terms are visited, so cost grows with term rarity, not corpus size.
+        """
+        query_terms = set(tokenize(query))
+        scores = {}
+        with self._lock:
+            n = len(self._doc_len)
+            if n == 0:
+                return []
+            avg_len = self._total_len / n
+            for term in query_terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
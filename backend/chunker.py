@@ -0,0 +1,110 @@
+import os
+import re
+
+# config
+# all-MiniLM-L6-v2 truncates input at 256 word pieces; our word/punctuation count runs
+# ~1.3x lower than word pieces, so 128 keeps whole chunks inside the model's window.
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "128"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "16"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+_HYPHEN_BREAK_RE = re.compile(r"(\w)-\n(\w)")
+
+
+def count_tokens(text):
+    """
+    Cheap token estimate: words and punctuation marks, no tokenizer dependency.
+    """
+    return len(_TOKEN_RE.findall(text))
+
+
+def _sentences(page_text):
+    """
+    Yields (sentence, ends_paragraph) for one page, re-joining words hyphenated across lines.
+    """
+    page_text = _HYPHEN_BREAK_RE.sub(r"\1\2", page_text)
+    for paragraph in _PARAGRAPH_RE.split(page_text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        sentences = _SENTENCE_RE.split(paragraph)
+        for i, sentence in enumerate(sentences):
+            yield sentence, i == len(sentences) - 1
+
+
+def _split_long(sentence, max_tokens):
+    """
+    Breaks a single over-budget sentence (tables, lists without punctuation) on word boundaries.
+    """
+    words = sentence.split()
+    piece = []
+    tokens = 0
+    for word in words:
+        word_tokens = count_tokens(word)
+        if piece and tokens + word_tokens > max_tokens:
+            yield " ".join(piece)
+            piece, tokens = [], 0
+        piece.append(word)
+        tokens += word_tokens
+    if piece:
+        yield " ".join(piece)
+
+
+def chunk_pages(pages, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Streams chunks out of an iterable of (page_number, text), one page at a time.
+    Yields (chunk_text, page_start, page_end).
+
+    Chunks never split a sentence. They close early at the end of a paragraph once half
+    the token budget is used, and at the end of a page once a quarter is used, so most
+    chunks hold whole paragraphs from a single page. A chunk that hits the budget mid-paragraph
+    carries its last sentences (up to overlap_tokens) into the next one.
+    """
+    current = []        # [(sentence, tokens)]
+    current_tokens = 0
+    page_start = page_end = None
+
+    def flush(overlap):
+        nonlocal current, current_tokens, page_start
+        chunk = (" ".join(s for s, _ in current), page_start, page_end)
+        carried = []
+        if overlap:
+            carried_tokens = 0
+            for sentence, tokens in reversed(current):
+                if carried_tokens + tokens > overlap_tokens:
+                    break
+                carried.insert(0, (sentence, tokens))
+                carried_tokens += tokens
+        current = carried
+        current_tokens = sum(tokens for _, tokens in carried)
+        page_start = page_end if carried else None
+        return chunk
+
+    for page_number, page_text in pages:
+        for sentence, ends_paragraph in _sentences(page_text):
+            tokens = count_tokens(sentence)
+            pieces = [(sentence, tokens)] if tokens <= max_tokens else [
+                (piece, count_tokens(piece)) for piece in _split_long(sentence, max_tokens)
+            ]
+            for piece, piece_tokens in pieces:
+                if current and current_tokens + piece_tokens > max_tokens:
+                    yield flush(overlap=True)
+                    # the carried overlap may not leave room for this piece
+                    if current and current_tokens + piece_tokens > max_tokens:
+                        current, current_tokens, page_start = [], 0, None
+                if page_start is None:
+                    page_start = page_number
+                page_end = page_number
+                current.append((piece, piece_tokens))
+                current_tokens += piece_tokens
+
+            if ends_paragraph and current_tokens >= max_tokens // 2:
+                yield flush(overlap=False)
+
+        if current and current_tokens >= max_tokens // 4:
+            yield flush(overlap=False)
+
+    if current:
+        yield flush(overlap=False)
@@ -0,0 +1,326 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# config
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))          # chunks per forward pass during ingestion
+EMBED_QUERY_BATCH = int(os.getenv("EMBED_QUERY_BATCH", "32"))        # max concurrent queries merged into one pass
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))   # how long the batcher waits for more queries
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))        # query embeddings kept in the LRU cache
+# Which runtime computes the embeddings: "sentence-transformers" (PyTorch) or "onnx" (ONNX Runtime).
+# Both run all-MiniLM-L6-v2, so vectors already stored in Chroma stay comparable.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "sentence-transformers")
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "int8")         # onnx only: "int8" or "none"
+# onnx only: threads per forward pass. Passes are serialized (see EmbeddingService), so this is
+# what ingestion uses; more than ~4 gains little on a model this size and starves OCR / requests.
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", str(min(4, os.cpu_count() or 1))))
+# onnx only: a directory with model.onnx and tokenizer.json; empty downloads the pinned export below
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "")
+# Chroma's published ONNX export of all-MiniLM-L6-v2, checked against its SHA-256 and unpacked
+# into EMBEDDING_ONNX_CACHE on first use
+ONNX_EXPORTS = {
+    "all-MiniLM-L6-v2": ("https://chroma-onnx-models.s3.amazonaws.com/all-MiniLM-L6-v2/onnx.tar.gz",
+                         "913d7300ceae3b2dbc2c50d1de4baacab4be7b9380491c27fab7418616a16ec3"),
+}
+EMBEDDING_ONNX_CACHE = os.getenv("EMBEDDING_ONNX_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "studybuddy-onnx"))
+EMBEDDING_MAX_TOKENS = 256      # longer texts are truncated, as sentence-transformers does for this model
+
+
+def normalize_query(text):
+    """
+    Cache key for a query: case and whitespace differences don't change the embedding we reuse.
+    """
+    return " ".join(text.lower().split())
+
+
+class EmbeddingService:
+    """
+    Wraps an embedding model (any callable taking a list of texts and returning vectors).
+    load_model() is called once, on first use, so the model isn't loaded at import time.
+
+    - Called directly, it embeds documents in batches of batch_size; this is the ingestion path.
+    - embed_query() goes through an LRU cache keyed by normalized text, and cache misses
+      from concurrent /chat requests are merged by a background batcher into one forward pass.
+    """
+
+    def __init__(self, load_model, batch_size=EMBED_BATCH_SIZE, max_query_batch=EMBED_QUERY_BATCH,
+                 max_wait_ms=EMBED_BATCH_WAIT_MS, cache_size=EMBED_CACHE_SIZE, backend=None):
+        self._load_model = load_model
+        self.backend = backend
+        self._model = None
+        self._batcher = None
+        self._init_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.max_query_batch = max_query_batch
+        self.max_wait_sec = max_wait_ms / 1000
+        self.cache_size = cache_size
+
+        # one forward pass at a time, so ingestion and queries don't oversubscribe the CPU
+        self._model_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "query_batches": 0,
+            "queries_embedded": 0,
+            "max_query_batch": 0,
+            "document_batches": 0,
+            "documents_embedded": 0,
+        }
+
+    def _get_model(self):
+        if self._model is None:
+            with self._init_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+
+    def _start_batcher(self):
+        if self._batcher is None:
+            with self._init_lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(target=self._batch_loop, name="embed-batcher", daemon=True)
+                    self._batcher.start()
+
+    def warm_up(self):
+        """
+        Loads the model and runs one forward pass so the first real request doesn't pay for it.
+        """
+        self._start_batcher()
+        self._encode(["warm up"])
+
+    def _encode(self, texts):
+        model = self._get_model()
+        with self._model_lock:
+            return list(model(texts))
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    # --- Ingestion path ---
+    def __call__(self, input):
+        embeddings = []
+        for start in range(0, len(input), self.batch_size):
+            batch = input[start:start + self.batch_size]
+            embeddings.extend(self._encode(batch))
+            self._count(document_batches=1, documents_embedded=len(batch))
+        return embeddings
+
+    # --- Query path ---
+    def embed_query(self, input):
+        keys = [normalize_query(text) for text in input]
+        embeddings = {}
+        misses = []
+        with self._cache_lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    embeddings[key] = self._cache[key]
+                elif key not in misses:
+                    misses.append(key)
+        self._count(cache_hits=len(keys) - len(misses), cache_misses=len(misses))
+
+        # Hand misses to the batcher so they share a forward pass with other requests
+        if misses:
+            self._start_batcher()
+        futures = []
+        for key in misses:
+            future = Future()
+            self._queue.put((key, future))
+            futures.append((key, future))
+        for key, future in futures:
+            embeddings[key] = future.result()
+
+        if misses:
+            with self._cache_lock:
+                for key in misses:
+                    self._cache[key] = embeddings[key]
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [embeddings[key] for key in keys]
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                # Collect whatever else arrives within the wait window, up to the batch cap
+                while len(batch) < self.max_query_batch:
+                    try:
+                        batch.append(self._queue.get(timeout=self.max_wait_sec))
+                    except queue.Empty:
+                        break
+
+                texts = list(dict.fromkeys(key for key, _ in batch))  # identical queries embedded once
+                vectors = dict(zip(texts, self._encode(texts)))
+                for key, future in batch:
+                    future.set_result(vectors[key])
+
+                with self._stats_lock:
+                    self._stats["query_batches"] += 1
+                    self._stats["queries_embedded"] += len(texts)
+                    self._stats["max_query_batch"] = max(self._stats["max_query_batch"], len(texts))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        stats["cache_hit_rate"] = round(stats["cache_hits"] / lookups, 4) if lookups else 0.0
+        stats["avg_query_batch"] = round(stats["queries_embedded"] / stats["query_batches"], 2) if stats["query_batches"] else 0.0
+        stats["avg_document_batch"] = round(stats["documents_embedded"] / stats["document_batches"], 2) if stats["document_batches"] else 0.0
+        with self._cache_lock:
+            stats["cache_size"] = len(self._cache)
+        stats["model_loaded"] = self._model is not None
+        stats["backend"] = self.backend
+        return stats
+
+
+# --- Backends ---
+
+def load_backend(backend=EMBEDDING_BACKEND, model_name="all-MiniLM-L6-v2", **options):
+    """
+    Returns the embedding model for `backend`. Options are passed to the ONNX backend
+    (quantize, threads, model_dir); sentence-transformers takes none.
+    """
+    if backend == "sentence-transformers":
+        from chromadb.utils import embedding_functions
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+    if backend == "onnx":
+        return OnnxEmbedder.load(model_name, **options)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected 'sentence-transformers' or 'onnx'")
+
+
+class OnnxEmbedder:
+    """
+    Sentence embeddings from an ONNX export of a sentence-transformers model: token
+    embeddings from the ONNX Runtime session, mean-pooled over the attention mask and
+    L2-normalized, the same as the PyTorch model's Pooling and Normalize layers.
+
+    Each batch is padded only to its longest text, not to the maximum length, so short
+    chunks and queries cost a fraction of a full-length pass.
+    """
+
+    def __init__(self, session, tokenizer):
+        self.session = session
+        self.tokenizer = tokenizer
+        self._input_names = {i.name for i in session.get_inputs()}
+
+    @classmethod
+    def load(cls, model_name="all-MiniLM-L6-v2", quantize=EMBEDDING_QUANTIZE, threads=EMBEDDING_THREADS,
+             model_dir=EMBEDDING_ONNX_DIR, max_tokens=EMBEDDING_MAX_TOKENS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = model_dir or _download_onnx_export(model_name)
+        model_path = os.path.join(model_dir, "model.onnx")
+        if quantize == "int8":
+            model_path = _quantized(model_path)
+        elif quantize != "none":
+            raise ValueError(f"Unknown EMBEDDING_QUANTIZE {quantize!r}, expected 'int8' or 'none'")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        # don't busy-wait between passes: the idle cores are wanted by OCR and request threads
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        options.log_severity_level = 3
+        session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=max_tokens)
+        tokenizer.enable_padding(pad_id=tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+        print(f"ONNX embedding model loaded from {model_path} ({threads} threads)")
+        return cls(session, tokenizer)
+
+    def __call__(self, input):
+        import numpy as np
+
+        if not input:
+            return []
+        encoded = self.tokenizer.encode_batch(list(input))
+        ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+        output = self.session.run(None, {name: value for name, value in feed.items() if name in self._input_names})[0]
+
+        if output.ndim == 3:
+            weights = mask[:, :, None].astype(output.dtype)
+            output = (output * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.clip(norms, 1e-12, None)).astype(np.float32).tolist()
+
+
+def _download_onnx_export(model_name, cache_dir=None):
+    """
+    Directory with the pinned ONNX export of model_name (model.onnx, tokenizer.json),
+    downloaded and verified on first use. The archive is unpacked next to the final
+    directory and moved into place, so an interrupted download is never picked up.
+    """
+    import hashlib
+    import shutil
+    import tarfile
+    import tempfile
+    import requests
+
+    if model_name not in ONNX_EXPORTS:
+        raise ValueError(f"No ONNX export of {model_name} is pinned; set EMBEDDING_ONNX_DIR to one")
+    url, sha256 = ONNX_EXPORTS[model_name]
+    model_dir = os.path.join(cache_dir or EMBEDDING_ONNX_CACHE, model_name)
+    if all(os.path.exists(os.path.join(model_dir, f)) for f in ("model.onnx", "tokenizer.json")):
+        return model_dir
+
+    os.makedirs(os.path.dirname(model_dir), exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=f".{model_name}-", dir=os.path.dirname(model_dir))
+    try:
+        archive_path = os.path.join(work_dir, "export.tar.gz")
+        digest = hashlib.sha256()
+        with requests.get(url, stream=True, timeout=60) as response, open(archive_path, "wb") as f:
+            response.raise_for_status()
+            for block in response.iter_content(1 << 20):
+                digest.update(block)
+                f.write(block)
+        if digest.hexdigest() != sha256:
+            raise ValueError(f"ONNX export of {model_name} from {url} does not match its pinned SHA-256")
+        with tarfile.open(archive_path, "r:gz") as tar:
+            # only plain files under the archive's folder, nothing outside work_dir
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(work_dir, filter="data")
+            else:
+                tar.extractall(work_dir)
+        extracted = os.path.join(work_dir, "onnx")
+        if os.path.exists(model_dir):
+            shutil.rmtree(model_dir)        # an incomplete earlier copy
+        os.replace(extracted, model_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return model_dir
+
+
+def _quantized(model_path):
+    """
+    Path of an int8 copy of the model (dynamic quantization: int8 weights, activations
+    quantized per batch at run time), created next to it on first use.
+    """
+    quantized_path = model_path[:-len(".onnx")] + ".int8.onnx"
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # write under a temporary name so a concurrent or interrupted load never sees half a model
+        partial_path = f"{quantized_path}.{os.getpid()}.tmp"
+        quantize_dynamic(model_path, partial_path, weight_type=QuantType.QInt8)
+        os.replace(partial_path, quantized_path)
+    return quantized_path
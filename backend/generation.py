@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import math
+import asyncio
+import threading
+
+import llm
+import ollama_client
+import stream_json
+
+# config
+# Flashcards/quizzes are generated as several small completions over disjoint slices of the
+# sampled chunks instead of one long one: latency follows the longest shard, not the total.
+FANOUT = os.getenv("GENERATION_FANOUT", "1") == "1"
+FANOUT_SHARDS = int(os.getenv("GENERATION_SHARDS", "3"))
+# shards of one request running at once; never more than Ollama will serve in parallel
+FANOUT_PARALLEL = min(int(os.getenv("GENERATION_PARALLEL", "3")), ollama_client.MAX_INFLIGHT_PER_MODEL)
+SHARD_RETRIES = int(os.getenv("GENERATION_SHARD_RETRIES", "1"))
+ITEMS_PER_REQUEST = 10
+
+_NON_WORD_RE = re.compile(r"\W+")
+_LETTER_RE = re.compile(r"^([A-Za-z])[.):]?$")
+
+
+def _text(value):
+    return isinstance(value, str) and value.strip() != ""
+
+
+def valid_flashcard(item):
+    return isinstance(item, dict) and _text(item.get("front")) and _text(item.get("back"))
+
+
+def valid_quiz_item(item):
+    """
+    Needs a question, 2+ distinct options and a correct_answer the UI can match to one of them:
+    the option itself, its letter ("B") or a prefix like "B." / "B)".
+    """
+    if not isinstance(item, dict) or not _text(item.get("question")) or not _text(item.get("correct_answer")):
+        return False
+    options = item.get("options")
+    if not isinstance(options, list) or len(options) < 2 or not all(_text(o) for o in options):
+        return False
+    if len({o.strip().lower() for o in options}) != len(options):
+        return False
+    answer = item["correct_answer"].strip().lower()
+    if any(o.strip().lower() == answer for o in options):
+        return True
+    letter = _LETTER_RE.match(answer)
+    if letter:
+        index = ord(letter.group(1).lower()) - ord("a")
+        return 0 <= index < len(options)
+    return any(o.strip().lower().startswith(prefix) for o in options for prefix in (answer + ".", answer + ")"))
+
+
+# Cheap fixes tried before an item is rejected (and, if too many are, its shard regenerated)
+_FLASHCARD_ALIASES = {"front": ("question", "term", "q"), "back": ("answer", "definition", "a")}
+_QUIZ_ALIASES = {"question": ("prompt", "q"), "options": ("choices", "answers"),
+                 "correct_answer": ("answer", "correct", "correctAnswer", "correct_option")}
+
+
+def _renamed(item, aliases):
+    item = dict(item)
+    for field, names in aliases.items():
+        if field not in item:
+            name = next((name for name in names if name in item), None)
+            if name is not None:
+                item[field] = item.pop(name)
+    return item
+
+
+def _as_text(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value.strip() if isinstance(value, str) else value
+
+
+def repair_flashcard(item):
+    """
+    Renames look-alike fields (question/answer, term/definition), turns numbers into
+    text and strips whitespace. Returns a new dict; anything else is returned as is.
+    """
+    if not isinstance(item, dict):
+        return item
+    item = _renamed(item, _FLASHCARD_ALIASES)
+    for field in ("front", "back"):
+        if field in item:
+            item[field] = _as_text(item[field])
+    return item
+
+
+def repair_quiz_item(item):
+    """
+    Like repair_flashcard, and also accepts options as {"A": ..., "B": ...}. A correct_answer
+    given as a letter or "B." prefix is rewritten to the option's text, so every valid
+    item has an answer that is exactly one of its options.
+    """
+    if not isinstance(item, dict):
+        return item
+    item = _renamed(item, _QUIZ_ALIASES)
+    for field in ("question", "correct_answer"):
+        if field in item:
+            item[field] = _as_text(item[field])
+    options = item.get("options")
+    if isinstance(options, dict):
+        options = list(options.values())
+    if not isinstance(options, list):
+        return item
+    options = item["options"] = [_as_text(option) for option in options]
+    answer = item.get("correct_answer")
+    if not _text(answer) or not all(_text(option) for option in options) or answer in options:
+        return item
+    answer = answer.lower()
+    letter = _LETTER_RE.match(answer)
+    for index, option in enumerate(options):
+        lowered = option.lower()
+        if lowered == answer or (letter and index == ord(letter.group(1)) - ord("a")) \
+                or lowered.startswith((answer + ".", answer + ")")):
+            item["correct_answer"] = option
+            break
+    return item
+
+
+# template -> (llm coroutine, validator, field that identifies a duplicate)
+KINDS = {
+    "flashcards": (llm.agenerate_flashcards, valid_flashcard, "front"),
+    "quiz": (llm.agenerate_quiz, valid_quiz_item, "question"),
+}
+# template -> llm async generator streaming the same completion
+STREAM_KINDS = {
+    "flashcards": llm.agenerate_flashcards_stream,
+    "quiz": llm.agenerate_quiz_stream,
+}
+REPAIRS = {
+    "flashcards": repair_flashcard,
+    "quiz": repair_quiz_item,
+}
+
+# running totals for /stats, kept apart for interactive requests and background work
+# (deck pre-generation, see ollama_client.as_background)
+_TOTAL_KEYS = ("requests", "completions", "parse_failures", "regenerations", "repaired_items", "invalid_items", "items")
+_totals = {"interactive": dict.fromkeys(_TOTAL_KEYS, 0), "background": dict.fromkeys(_TOTAL_KEYS, 0)}
+_totals_lock = threading.Lock()
+
+
+def _new_stats(n_shards):
+    return {"shards": n_shards, "completions": 0, "shard_retries": 0, "parse_failures": 0,
+            "repaired_items": 0, "invalid_items": 0, "duplicate_items": 0}
+
+
+def _check_item(template, item, stats):
+    """
+    Repairs and validates one parsed item. Returns the item to use, or None.
+    """
+    validate = KINDS[template][1]
+    repaired = REPAIRS[template](item)
+    if not validate(repaired):
+        stats["invalid_items"] += 1
+        return None
+    if not validate(item):
+        stats["repaired_items"] += 1
+    return repaired
+
+
+def _count_completion(stats, parsed, malformed, failed):
+    """
+    Counts one finished completion; it is a parse failure if Ollama answered (not `failed`)
+    but some object in it was unreadable, or there was no item at all.
+    """
+    stats["completions"] += 1
+    stats["invalid_items"] += malformed
+    if not failed and (malformed or not parsed):
+        stats["parse_failures"] += 1
+
+
+def _record(stats, n_items):
+    with _totals_lock:
+        totals = _totals["background" if ollama_client.in_background() else "interactive"]
+        totals["requests"] += 1
+        totals["items"] += n_items
+        totals["regenerations"] += stats["shard_retries"]
+        for key in ("completions", "parse_failures", "repaired_items", "invalid_items"):
+            totals[key] += stats[key]
+
+
+def _with_rates(totals):
+    first_attempts = totals["completions"] - totals["regenerations"]
+    totals["parse_failure_rate"] = round(totals["parse_failures"] / totals["completions"], 4) if totals["completions"] else 0.0
+    totals["regeneration_rate"] = round(totals["regenerations"] / first_attempts, 4) if first_attempts else 0.0
+    return totals
+
+
+def stats():
+    """
+    Totals since start for interactive requests, with background work's totals under
+    "background". parse_failure_rate is per completion, regeneration_rate per first
+    attempt (how often a shard had to be generated again).
+    """
+    with _totals_lock:
+        result, background = dict(_totals["interactive"]), dict(_totals["background"])
+    result = _with_rates(result)
+    result["background"] = _with_rates(background)
+    return result
+
+
+def dedup_key(item, field):
+    return _NON_WORD_RE.sub(" ", item[field].lower()).strip()
+
+
+def _shards(chunks, n_shards):
+    """
+    Splits chunk texts into up to n_shards contiguous groups of near-equal size.
+    """
+    n_shards = max(1, min(n_shards, len(chunks)))
+    size = math.ceil(len(chunks) / n_shards)
+    return [chunks[i:i + size] for i in range(0, len(chunks), size)]
+
+
+async def generate_items(template, chunks, count=ITEMS_PER_REQUEST, n_shards=FANOUT_SHARDS):
+    """
+    Generates `count` flashcards or quiz questions from chunk texts by fanning out one
+    small completion per shard (at most FANOUT_PARALLEL at a time). Each item is repaired
+    if needed and validated on its own; a shard that fails or comes back mostly invalid is
+    regenerated by itself up to SHARD_RETRIES times. Results are merged and de-duplicated.
+    Returns (items, stats).
+    """
+    agenerate, _, field = KINDS[template]
+    shards = _shards(chunks, n_shards)
+    per_shard = math.ceil(count / len(shards))
+    limit = asyncio.Semaphore(FANOUT_PARALLEL)
+    stats = _new_stats(len(shards))
+
+    async def run_shard(texts):
+        context = "\n".join(texts)
+        for attempt in range(SHARD_RETRIES + 1):
+            async with limit:
+                response = await agenerate(context, per_shard)
+            candidates, malformed = stream_json.parse_items(response)
+            _count_completion(stats, len(candidates), malformed, response == llm.LLM_ERROR)
+            valid = [item for item in (_check_item(template, c, stats) for c in candidates) if item is not None]
+            # half the asked-for items is good enough; anything less is worth one more try
+            if len(valid) * 2 >= per_shard or attempt == SHARD_RETRIES:
+                return valid
+            stats["shard_retries"] += 1
+
+    results = await asyncio.gather(*(run_shard(texts) for texts in shards))
+
+    # round-robin across shards, so trimming to `count` keeps every part of the context covered
+    items = []
+    seen = set()
+    for rank in range(max(len(r) for r in results)):
+        for shard_items in results:
+            if rank >= len(shard_items):
+                continue
+            item = shard_items[rank]
+            key = dedup_key(item, field)
+            if key in seen:
+                stats["duplicate_items"] += 1
+                continue
+            seen.add(key)
+            items.append(item)
+    items = items[:count]
+    _record(stats, len(items))
+    return items, stats
+
+
+async def generate(template, chunks):
+    """
+    Model output for a flashcard/quiz request as text: the validated items as a JSON array,
+    from fanned-out shards or one completion when GENERATION_FANOUT=0. Returns (text, stats).
+    """
+    items, stats = await generate_items(template, chunks, n_shards=FANOUT_SHARDS if FANOUT else 1)
+    if not items:
+        return llm.LLM_ERROR, stats
+    return json.dumps(items), stats
+
+
+async def stream_items(template, chunks, stats, count=ITEMS_PER_REQUEST, n_shards=FANOUT_SHARDS):
+    """
+    Streaming form of generate_items: yields each valid, new item as soon as any shard's
+    output completes it, so the first card doesn't wait for the slowest shard. Every shard
+    contributes at most its share of `count`, which keeps the context covered. `stats` is
+    filled in as generate_items' stats are.
+    """
+    agenerate_stream = STREAM_KINDS[template]
+    field = KINDS[template][2]
+    shards = _shards(chunks, n_shards)
+    per_shard = math.ceil(count / len(shards))
+    limit = asyncio.Semaphore(FANOUT_PARALLEL)
+    stats.update(_new_stats(len(shards)))
+    queue = asyncio.Queue()     # items from every shard; None marks a finished shard
+
+    async def run_shard(texts):
+        context = "\n".join(texts)
+        sent = 0
+        try:
+            for attempt in range(SHARD_RETRIES + 1):
+                parser = stream_json.ItemStream()
+                parsed = valid = 0
+                failed = False
+                async with limit:
+                    tokens = agenerate_stream(context, per_shard)
+                    try:
+                        async for token in tokens:
+                            failed = token == llm.LLM_ERROR
+                            for item in parser.feed(token):
+                                parsed += 1
+                                item = _check_item(template, item, stats)
+                                if item is None:
+                                    continue
+                                valid += 1
+                                if sent < per_shard:
+                                    sent += 1
+                                    queue.put_nowait(item)
+                    finally:
+                        await tokens.aclose()
+                _count_completion(stats, parsed, parser.malformed, failed)
+                if valid * 2 >= per_shard or attempt == SHARD_RETRIES:
+                    return
+                stats["shard_retries"] += 1
+        finally:
+            queue.put_nowait(None)
+
+    tasks = [asyncio.create_task(run_shard(texts)) for texts in shards]
+    seen = set()
+    try:
+        finished = 0
+        while finished < len(tasks) and len(seen) < count:
+            item = await queue.get()
+            if item is None:
+                finished += 1
+                continue
+            key = dedup_key(item, field)
+            if key in seen:
+                stats["duplicate_items"] += 1
+                continue
+            seen.add(key)
+            yield item
+    finally:
+        # enough items, or the client went away: stop the shards still generating
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _record(stats, len(seen))
+
+
+def generate_stream(template, chunks, stats):
+    """
+    Items for a flashcard/quiz request as they are generated (one shard when GENERATION_FANOUT=0).
+    """
+    return stream_items(template, chunks, stats, n_shards=FANOUT_SHARDS if FANOUT else 1)
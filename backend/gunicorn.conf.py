@@ -0,0 +1,33 @@
+import os
+
+# Concurrency model (see README, "Serving"):
+# one worker process with many threads. Request handlers spend nearly all their time blocked
+# on Ollama or Chroma, which release the GIL, so threads scale the way we need. A single
+# process keeps one copy of the embedding model and one view of the in-memory state
+# (ingestion jobs, BM25 index, response cache, memory sessions); raising `workers` duplicates
+# all of it and needs SESSION_BACKEND=sqlite at the very least.
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:9000")
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+# connections waiting for a free thread; beyond this the kernel refuses them
+backlog = int(os.getenv("GUNICORN_BACKLOG", "512"))
+
+# gthread's timeout is a worker heartbeat, not a per-request limit, so long generations are fine.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
+# On SIGTERM in-flight requests (including open chat streams) finish first, then
+# app.shutdown() drains ingestion jobs; both must fit before the worker is killed.
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "90"))
+
+# Not preloaded: the app loads its model and Chroma lazily, and torch / Chroma state must not
+# be created in the master and inherited through fork.
+preload_app = False
+reload = os.getenv("GUNICORN_RELOAD", "0") == "1"
+
+accesslog = "-"
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# config
+# INGEST_WORKERS bounds how many PDFs are parsed/embedded at once, INGEST_MAX_PENDING
+# bounds how many more can wait in the queue before /upload starts refusing work.
+MAX_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "16"))
+JOB_TTL_SEC = int(os.getenv("INGEST_JOB_TTL_SEC", "3600"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="ingest")
+_slots = threading.BoundedSemaphore(MAX_WORKERS + MAX_PENDING)
+_jobs = {}
+_batches = {}           # batch id -> job ids, for /upload_batch
+_futures = set()
+_lock = threading.Lock()
+_accepting = True
+
+
+class Job:
+    """
+    Tracks one background ingestion run and its per-stage progress.
+    """
+
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"
+        self.stage = "queued"
+        self.progress = {}
+        self.message = ""
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, stage, **counts):
+        """
+        Progress callback handed to rag.ingest_file, e.g. update("embedding", chunks_embedded=64).
+        """
+        with self._lock:
+            self.stage = stage
+            self.progress.update(counts)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "filename": self.filename,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": dict(self.progress),
+                "message": self.message,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+def _run(job, func, args, release=None):
+    job.status = "running"
+    try:
+        success, msg = func(*args, progress=job.update)
+        job.status = "done" if success else "failed"
+        job.message = msg
+    except Exception as e:
+        print(f"Ingestion job {job.id} crashed: {e}")
+        job.status = "failed"
+        job.message = str(e)
+    finally:
+        job.stage = job.status
+        job.finished_at = time.time()
+        (release or _slots.release)()
+
+
+def _prune():
+    cutoff = time.time() - JOB_TTL_SEC
+    with _lock:
+        for job_id in [j.id for j in _jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del _jobs[job_id]
+        for batch_id in [b for b, job_ids in _batches.items() if not any(j in _jobs for j in job_ids)]:
+            del _batches[batch_id]
+
+
+def submit(filename, func, *args):
+    """
+    Queues func(*args, progress=callback) on the ingestion pool.
+    Returns the Job, or None when the queue is full or the server is shutting down.
+    """
+    if not _accepting or not _slots.acquire(blocking=False):
+        return None
+
+    _prune()
+    job = Job(filename)
+    with _lock:
+        _jobs[job.id] = job
+        future = _executor.submit(_run, job, func, args)
+        _futures.add(future)
+    future.add_done_callback(_futures.discard)
+    return job
+
+
+def submit_batch(entries):
+    """
+    Queues several files as one admission: entries are (filename, func, args) and each becomes
+    its own Job on the shared pool, so they run INGEST_WORKERS at a time, but the batch takes a
+    single queue slot (held until its last file finishes). A semester of notes in one request
+    is therefore not refused for being more than INGEST_MAX_PENDING files.
+    Returns (batch id, jobs), or None when the queue is full or the server is shutting down.
+    """
+    if not entries or not _accepting or not _slots.acquire(blocking=False):
+        return None
+
+    _prune()
+    remaining = [len(entries)]
+    remaining_lock = threading.Lock()
+
+    def release():
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            _slots.release()
+
+    batch_id = uuid.uuid4().hex
+    batch = []
+    with _lock:
+        for filename, func, args in entries:
+            job = Job(filename)
+            _jobs[job.id] = job
+            future = _executor.submit(_run, job, func, args, release)
+            _futures.add(future)
+            future.add_done_callback(_futures.discard)
+            batch.append(job)
+        _batches[batch_id] = [job.id for job in batch]
+    return batch_id, batch
+
+
+def get(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def get_batch(batch_id):
+    """
+    The batch's jobs (those not yet pruned), or None for an unknown batch id.
+    """
+    with _lock:
+        job_ids = _batches.get(batch_id)
+        if job_ids is None:
+            return None
+        return [_jobs[job_id] for job_id in job_ids if job_id in _jobs]
+
+
+def shutdown(timeout):
+    """
+    Stops accepting uploads and waits up to `timeout` seconds for queued and running jobs.
+    Returns the number of jobs that had not finished.
+    """
+    global _accepting
+    _accepting = False
+    with _lock:
+        pending = set(_futures)
+    _, not_done = wait(pending, timeout=timeout)
+    _executor.shutdown(wait=False, cancel_futures=True)
+    return len(not_done)
+
+
+def stats():
+    with _lock:
+        statuses = [j.status for j in _jobs.values()]
+    return {
+        "workers": MAX_WORKERS,
+        "max_pending": MAX_PENDING,
+        "queued": statuses.count("queued"),
+        "running": statuses.count("running"),
+    }
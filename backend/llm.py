@@ -1,16 +1,56 @@
-import requests
 import os
+import requests
+import json
 import sys
 
+import ollama_client
+import prompt
+
 # config
-OLLAMA_BASE_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
-GENERATE_URL = f"{OLLAMA_BASE_URL}/api/generate"
-CHAT_URL = f"{OLLAMA_BASE_URL}/api/chat"
 MODEL_NAME = "llama3.1"
 
-raw_url = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
-base_url = raw_url.rstrip('/').replace('/api', '')
-print(f"DEBUG: LLM connecting to: {base_url}", file=sys.stderr)
+# returned in place of a model answer when Ollama can't be reached
+LLM_ERROR = "Error connecting to LLM."
+
+# Flashcard/quiz completions send a JSON schema as Ollama's `format`, which constrains decoding
+# to that shape; set to 0 for a model or Ollama version without structured outputs.
+STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") == "1"
+
+FLASHCARD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "front": {"type": "string"},
+        "back": {"type": "string"},
+    },
+    "required": ["front", "back"],
+}
+
+QUIZ_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}, "minItems": 2},
+        "correct_answer": {"type": "string"},
+    },
+    "required": ["question", "options", "correct_answer"],
+}
+
+CHAT_SYSTEM_PROMPT = (
+    "You are a helpful study assistant. "
+    "You must answer questions based ONLY on the provided context. "
+    "If the answer is not in the context, state clearly that you cannot find the information."
+)
+
+def warm_up():
+    """
+    Opens the pooled connection and checks Ollama is reachable, so the first request doesn't pay for it.
+    """
+    try:
+        ollama_client.get("/api/tags").raise_for_status()
+        return True
+    except requests.exceptions.RequestException as e:
+        print(f"Ollama warm-up failed: {e}", file=sys.stderr)
+        return False
 
 # def _query_ollama(prompt, system_prompt): # helper function to interop with ollama
 #     payload = {
@@ -26,7 +66,10 @@ print(f"DEBUG: LLM connecting to: {base_url}", file=sys.stderr)
 #     except requests.exceptions.RequestException as e:
 #         print(f"Ollama Connection Error: {e}")
 #         return "Error connecting to LLM. Is Ollama running?"
-def _generate(prompt, system_prompt):
+def _items_schema(item_schema, count):
+    return {"type": "array", "items": item_schema, "minItems": 1, "maxItems": count}
+
+async def _agenerate(prompt, system_prompt, schema=None):
     """
     Helper for the /api/generate endpoint (Completion).
     Used for functional tasks like Flashcards and Quizzes.
@@ -37,16 +80,60 @@ def _generate(prompt, system_prompt):
         "system": system_prompt,
         "stream": False
     }
+    if schema is not None and STRUCTURED_OUTPUT:
+        payload["format"] = schema
     try:
-        print(payload)
-        response = requests.post(GENERATE_URL, json=payload)
-        response.raise_for_status()
-        return response.json().get('response', '')
-    except requests.exceptions.RequestException as e:
+        async with ollama_client.post("/api/generate", payload) as response:
+            return json.loads(await response.aread()).get('response', '')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # ValueError: a body that isn't valid JSON
         print(f"Ollama Generate Error: {e}")
-        return "Error connecting to LLM."
+        return LLM_ERROR
 
-def _chat(messages):
+async def _ndjson(response):
+    """
+    Yields the JSON objects of a streamed Ollama response, one per line. A partial or garbled
+    line is logged and skipped instead of ending the stream.
+    """
+    async for line in response.aiter_lines():
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            print(f"Skipping malformed Ollama stream line: {line[:200]!r}", flush=True)
+            continue
+        if not isinstance(data, dict):
+            continue
+        if 'error' in data:
+            print(f"Ollama stream error: {data['error']}", flush=True)
+        yield data
+
+async def _agenerate_stream(prompt, system_prompt, schema=None):
+    """
+    Streaming variant of _agenerate: yields response text as Ollama produces it.
+    """
+    payload = {
+        "model": MODEL_NAME,
+        "prompt": prompt,
+        "system": system_prompt,
+        "stream": True
+    }
+    if schema is not None and STRUCTURED_OUTPUT:
+        payload["format"] = schema
+    try:
+        async with ollama_client.post("/api/generate", payload) as response:
+            async for data in _ndjson(response):
+                token = data.get('response', '')
+                if token:
+                    yield token
+                if data.get('done'):
+                    break
+    except requests.exceptions.RequestException as e:
+        print(f"Ollama Generate Stream Error: {e}",flush=True)
+        yield LLM_ERROR
+
+async def _achat(messages):
     """
     Helper for the /api/chat endpoint (Conversational).
     Used for the Chat feature.
@@ -54,26 +141,60 @@ def _chat(messages):
     payload = {
         "model": MODEL_NAME,
         "messages": messages,
-        "stream": False
+        "stream": False,
+        # the prompt assembler budgets for this window, so the model must actually use it
+        "options": {"num_ctx": prompt.LLM_CONTEXT_TOKENS}
     }
     try:
-        response = requests.post(CHAT_URL, json=payload)
-        response.raise_for_status()
-        # Chat endpoint returns 'message' object inside 'message' key
-        return response.json().get('message', {}).get('content', '')
-    except requests.exceptions.RequestException as e:
+        async with ollama_client.post("/api/chat", payload) as response:
+            # Chat endpoint returns 'message' object inside 'message' key
+            return json.loads(await response.aread()).get('message', {}).get('content', '')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # ValueError: a body that isn't valid JSON
         print(f"Ollama Chat Error: {e}",flush=True)
-        return "Error connecting to LLM."
-    
-def chat(context, query, chat_history=None):
+        return LLM_ERROR
+
+async def _achat_stream(messages):
+    """
+    Streaming variant of _achat: yields content tokens as Ollama produces them.
+    Ollama streams one JSON object per line (NDJSON) until "done" is true.
+    """
+    payload = {
+        "model": MODEL_NAME,
+        "messages": messages,
+        "stream": True,
+        "options": {"num_ctx": prompt.LLM_CONTEXT_TOKENS}
+    }
+    try:
+        async with ollama_client.post("/api/chat", payload) as response:
+            async for data in _ndjson(response):
+                token = data.get('message', {}).get('content', '')
+                if token:
+                    yield token
+                if data.get('done'):
+                    return
+        # the body ended without the final "done" object: the answer is cut off
+        print("Ollama Chat Stream Error: stream ended before done", flush=True)
+        yield LLM_ERROR
+    except requests.exceptions.RequestException as e:
+        print(f"Ollama Chat Stream Error: {e}",flush=True)
+        yield LLM_ERROR
+
+# Sync wrappers: the coroutines run on ollama_client's shared event loop
+def _generate(prompt, system_prompt, schema=None):
+    return ollama_client.run(_agenerate(prompt, system_prompt, schema))
+
+def _chat(messages):
+    return ollama_client.run(_achat(messages))
+
+def _chat_stream(messages):
+    return ollama_client.iterate(_achat_stream(messages))
+
+def _build_chat_messages(context, query, chat_history=None):
     # 1. Define the System Prompt
     system_message = {
         "role": "system", 
-        "content": (
-            "You are a helpful study assistant. "
-            "You must answer questions based ONLY on the provided context. "
-            "If the answer is not in the context, state clearly that you cannot find the information."
-        )
+        "content": CHAT_SYSTEM_PROMPT
     }
 
     # 2. Build the Message Chain
@@ -90,10 +211,24 @@ def chat(context, query, chat_history=None):
         "content": f"Context from notes:\n{context}\n\nQuestion: {query}"
     }
     messages.append(user_message)
-    
-    return _chat(messages)
+    return messages
 
-def generate_flashcards(context):
+def chat(context, query, chat_history=None):
+    return _chat(_build_chat_messages(context, query, chat_history))
+
+def chat_messages(messages, stream=False):
+    """
+    Sends an already assembled message list (see prompt.build_chat_prompt).
+    """
+    return _chat_stream(messages) if stream else _chat(messages)
+
+async def achat_messages(messages):
+    return await _achat(messages)
+
+def achat_messages_stream(messages):
+    return _achat_stream(messages)
+
+def _flashcards_prompt(context, count=10):
     system_prompt = (
         "You are a study aid flashcard generator. "
         "Output ONLY valid JSON. "
@@ -103,15 +238,15 @@ def generate_flashcards(context):
     )
     
     prompt = f"""
-    Based on the following text, generate 10 study flashcards.
+    Based on the following text, generate {count} study flashcards.
     Format strictly as a JSON array of objects: [{{"front": "question", "back": "answer"}}, ...]
     
     Text: {context}
     """
     
-    return _generate(prompt, system_prompt)
+    return prompt, system_prompt, _items_schema(FLASHCARD_SCHEMA, count)
 
-def generate_quiz(context):
+def _quiz_prompt(context, count=10):
     system_prompt = (
         "You are a quiz generator. "
         "Output ONLY valid JSON. "
@@ -120,11 +255,29 @@ def generate_quiz(context):
     )
     
     prompt = f"""
-    Generate 10 multiple choice questions based on this text.
+    Generate {count} multiple choice questions based on this text.
     Format strictly as a JSON array: 
     [{{"question": "...", "options": ["A", "B", "C", "D"], "correct_answer": "A"}}, ...]
     
     Text: {context}
     """
     
-    return _generate(prompt, system_prompt)
\ No newline at end of file
+    return prompt, system_prompt, _items_schema(QUIZ_SCHEMA, count)
+
+def generate_flashcards(context):
+    return _generate(*_flashcards_prompt(context))
+
+def generate_quiz(context):
+    return _generate(*_quiz_prompt(context))
+
+async def agenerate_flashcards(context, count=10):
+    return await _agenerate(*_flashcards_prompt(context, count))
+
+async def agenerate_quiz(context, count=10):
+    return await _agenerate(*_quiz_prompt(context, count))
+
+def agenerate_flashcards_stream(context, count=10):
+    return _agenerate_stream(*_flashcards_prompt(context, count))
+
+def agenerate_quiz_stream(context, count=10):
+    return _agenerate_stream(*_quiz_prompt(context, count))
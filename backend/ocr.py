@@ -0,0 +1,67 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytesseract
+from pdf2image import convert_from_path
+
+# config
+# Pages are rendered OCR_BATCH_PAGES at a time inside the worker processes, so at most
+# OCR_WORKERS * OCR_BATCH_PAGES page images exist at once no matter how long the PDF is.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_BATCH_PAGES = int(os.getenv("OCR_BATCH_PAGES", "4"))
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+
+# Kept in its own module (no chromadb / model imports) so spawned workers start cheaply
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the parent runs Flask and ingestion threads
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _ocr_page_range(filepath, first_page, last_page):
+    """
+    Worker process: renders pages first_page..last_page (1-based, inclusive) and OCRs them.
+    Requires Poppler and Tesseract to be installed.
+    """
+    start_time = time.perf_counter()
+    images = convert_from_path(filepath, dpi=OCR_DPI, first_page=first_page, last_page=last_page)
+    texts = []
+    for img in images:
+        texts.append(pytesseract.image_to_string(img))
+        img.close()
+    return texts, time.perf_counter() - start_time
+
+
+def submit(filepath, first_page, last_page):
+    """
+    Queues OCR of one run of consecutive pages on the process pool.
+    The future resolves to (page texts, seconds spent in the worker).
+    """
+    try:
+        return _get_pool().submit(_ocr_page_range, filepath, first_page, last_page)
+    except BrokenProcessPool:
+        # a worker died (e.g. killed for memory); start a fresh pool rather than failing every later OCR
+        _reset_pool()
+        return _get_pool().submit(_ocr_page_range, filepath, first_page, last_page)
@@ -0,0 +1,421 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import weakref
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# config
+CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "180"))       # max gap between bytes, not total time
+MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))     # 0.5s, 1s, 2s, ...
+POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "32"))                # idle keep-alive connections per event loop
+MAX_INFLIGHT_PER_MODEL = int(os.getenv("OLLAMA_MAX_INFLIGHT", "4"))  # what the GPU/CPU host can actually serve
+QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "60"))      # how long a request may wait for a slot
+BREAKER_THRESHOLD = int(os.getenv("OLLAMA_BREAKER_THRESHOLD", "5"))  # consecutive failures before failing fast
+BREAKER_RESET_SEC = float(os.getenv("OLLAMA_BREAKER_RESET_SEC", "30"))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without touching the network while Ollama is considered down."""
+
+
+class OverloadedError(requests.exceptions.RequestException):
+    """Raised when a model already has MAX_INFLIGHT_PER_MODEL requests and no slot frees up in time."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `reset_sec`;
+    then lets a single trial request through (half-open) to decide whether to close again.
+    A trial that never reports back (e.g. the client went away) is superseded after reset_sec.
+    """
+
+    def __init__(self, threshold, reset_sec):
+        self.threshold = threshold
+        self.reset_sec = reset_sec
+        self.failures = 0
+        self.opened_at = None
+        self._trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_sec:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_sec:
+                return False
+            if self._trial_started_at is not None and now - self._trial_started_at < self.reset_sec:
+                return False
+            self._trial_started_at = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_started_at = None
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class ModelSlots:
+    """
+    In-flight limit for one model, shared by coroutines on every thread's event loop. Waiters
+    are served in arrival order and a freed slot is handed straight to the next one. A waiting
+    coroutine is just a parked future, so thousands of queued async requests cost no threads.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflight = 0
+        self.background = 0         # requests marked as background work, running or waiting
+        self._waiters = deque()     # callables that hand a slot to one waiter
+        self._lock = threading.Lock()
+
+    def _take(self):
+        if self.inflight < self.limit and not self._waiters:
+            self.inflight += 1
+            return True
+        return False
+
+    def _withdraw(self, waiter):
+        """
+        Removes a waiter that gave up. False means a slot was handed to it in the meantime.
+        """
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    async def acquire_async(self, timeout):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                return True
+            future = loop.create_future()
+
+            def waiter():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return not self._withdraw(waiter)
+        except asyncio.CancelledError:
+            # the client went away while queued; pass on a slot we were already handed
+            if not self._withdraw(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self.inflight -= 1
+                return
+            waiter = self._waiters.popleft()
+        waiter()
+
+    def queued(self):
+        with self._lock:
+            return len(self._waiters)
+
+    def add_background(self, n):
+        with self._lock:
+            self.background += n
+
+    def interactive(self):
+        """
+        Requests running or waiting for a slot that were not marked as background work.
+        """
+        with self._lock:
+            return max(0, self.inflight + len(self._waiters) - self.background)
+
+
+_breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_SEC)
+
+_session = None
+_base_url = None
+_init_lock = threading.Lock()
+
+# httpx.AsyncClient is bound to the event loop that created it: one per loop
+_async_clients = weakref.WeakKeyDictionary()
+_runner_loop = None
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+# set for the Ollama requests of background work (deck pre-generation), see as_background()
+_background = contextvars.ContextVar("ollama_background", default=False)
+
+_stats = {"requests": 0, "failures": 0, "retries": 0, "rejected_open": 0, "rejected_overloaded": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def url(path):
+    """
+    Full Ollama URL for an API path; the base URL is resolved on first use rather than at import.
+    """
+    global _base_url
+    if _base_url is None:
+        with _init_lock:
+            if _base_url is None:
+                raw_url = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
+                _base_url = raw_url.rstrip('/').replace('/api', '')
+                print(f"DEBUG: LLM connecting to: {_base_url}", file=sys.stderr)
+    return f"{_base_url}{path}"
+
+
+def _get_session():
+    """
+    Keep-alive session for the few plain sync calls (health check); urllib3 retries with backoff.
+    """
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                retry = Retry(
+                    total=MAX_RETRIES,
+                    backoff_factor=RETRY_BACKOFF,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({"GET", "POST"}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            # concurrency is already capped by the per-model slots; the pool only bounds idle connections
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _slot(model):
+    with _slots_lock:
+        if model not in _slots:
+            _slots[model] = ModelSlots(MAX_INFLIGHT_PER_MODEL)
+        return _slots[model]
+
+
+def _is_outage(e):
+    # 4xx (e.g. unknown model) means Ollama answered; only count unreachable/5xx as failures
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return True
+
+
+def _as_request_error(e):
+    """
+    Re-raises httpx errors as the requests exceptions callers already handle.
+    """
+    if isinstance(e, httpx.HTTPStatusError):
+        return requests.exceptions.HTTPError(str(e))
+    if isinstance(e, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(e))
+    return requests.exceptions.ConnectionError(str(e))
+
+
+async def _send(client, path, payload):
+    """
+    Sends the request and returns the (unread) response, retrying connection errors and
+    502/503/504 with exponential backoff.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            request = client.build_request("POST", url(path), json=payload)
+            response = await client.send(request, stream=True)
+            if response.status_code in (502, 503, 504) and attempt < MAX_RETRIES:
+                await response.aclose()
+            else:
+                if response.is_error:
+                    await response.aread()
+                    await response.aclose()
+                response.raise_for_status()
+                return response
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt == MAX_RETRIES:
+                raise
+        _count("retries")
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+@asynccontextmanager
+async def post(path, payload):
+    """
+    POSTs payload to Ollama and yields the httpx response with its body not yet read,
+    holding one of the model's in-flight slots until the caller is done with it
+    (important for streams). Raises a requests RequestException subclass on any failure.
+    """
+    model = payload.get("model", "")
+    if not _breaker.allow():
+        _count("rejected_open")
+        raise CircuitOpenError("Ollama circuit is open; failing fast")
+
+    slot = _slot(model)
+    background = _background.get()
+    if background:
+        slot.add_background(1)
+    try:
+        if not await slot.acquire_async(QUEUE_TIMEOUT):
+            _count("rejected_overloaded")
+            raise OverloadedError(f"Too many in-flight requests for model {model}")
+    except BaseException:
+        if background:
+            slot.add_background(-1)
+        raise
+
+    _count("requests")
+    try:
+        try:
+            response = await _send(_get_async_client(), path, payload)
+        except httpx.HTTPError as e:
+            _count("failures")
+            if _is_outage(e):
+                _breaker.record_failure()
+            raise _as_request_error(e) from e
+
+        try:
+            yield response
+        except httpx.HTTPError as e:
+            # e.g. the connection dropped mid-stream
+            _count("failures")
+            _breaker.record_failure()
+            raise _as_request_error(e) from e
+        finally:
+            await response.aclose()
+        _breaker.record_success()
+    finally:
+        slot.release()
+        if background:
+            slot.add_background(-1)
+
+
+def _get_runner_loop():
+    """
+    Event loop on a daemon thread that runs coroutines for sync callers, so they share one
+    long-lived AsyncClient (and its keep-alive connections) instead of a new loop per call.
+    """
+    global _runner_loop
+    if _runner_loop is None:
+        with _init_lock:
+            if _runner_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ollama-client", daemon=True).start()
+                _runner_loop = loop
+    return _runner_loop
+
+
+def run(coro):
+    """
+    Runs a coroutine from sync code and returns its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_runner_loop()).result()
+
+
+def iterate(async_gen):
+    """
+    Iterates an async generator from sync code, one item per hop to the runner loop.
+    """
+    loop = _get_runner_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(async_gen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # stops the request (and frees its slot) if the consumer stops early
+        asyncio.run_coroutine_threadsafe(async_gen.aclose(), loop).result()
+
+
+def get(path, timeout=5):
+    return _get_session().get(url(path), timeout=timeout)
+
+
+def interactive(model=None):
+    """
+    Number of requests running or waiting for Ollama (for one model, or all), not counting
+    background work; background work backs off while this is above 0.
+    """
+    with _slots_lock:
+        slots = dict(_slots)
+    if model is not None:
+        return slots[model].interactive() if model in slots else 0
+    return sum(slot.interactive() for slot in slots.values())
+
+
+def in_background():
+    """
+    True inside as_background(), e.g. for code that keeps background work out of its stats.
+    """
+    return _background.get()
+
+
+async def as_background(coro):
+    """
+    Awaits coro with every Ollama request it makes (including from tasks it starts) marked
+    as background work, so interactive() doesn't count it.
+    """
+    token = _background.set(True)
+    try:
+        return await coro
+    finally:
+        _background.reset(token)
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    with _slots_lock:
+        slots = dict(_slots)
+    result["inflight"] = {model: slot.inflight for model, slot in slots.items()}
+    result["queued"] = {model: slot.queued() for model, slot in slots.items()}
+    result["background"] = {model: slot.background for model, slot in slots.items()}
+    result["max_inflight_per_model"] = MAX_INFLIGHT_PER_MODEL
+    result["circuit"] = _breaker.state
+    return result
@@ -0,0 +1,265 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+import llm
+import rag
+import generation
+import ollama_client
+
+# config
+# Flashcard/quiz decks are generated ahead of time, section by section of each PDF, while
+# Ollama has nothing interactive to do; the generate endpoints then answer from them at once.
+ENABLED = os.getenv("PREGEN", "1") == "1"
+DECKS_PER_SOURCE = int(os.getenv("PREGEN_DECKS_PER_SOURCE", "2"))    # ready decks kept per PDF and template
+SECTION_CHUNKS = int(os.getenv("PREGEN_SECTION_CHUNKS", "12"))       # consecutive chunks one deck is drawn from
+DECK_CHUNKS = 6                                                      # as for a live request
+# Ollama counts as idle once no interactive request has run or waited on it for this long
+IDLE_SEC = float(os.getenv("PREGEN_IDLE_SEC", "2"))
+FAILURE_BACKOFF_SEC = float(os.getenv("PREGEN_FAILURE_BACKOFF_SEC", "30"))
+POLL_SEC = 0.25
+
+TEMPLATES = ("flashcards", "quiz")
+
+_decks = {}             # (template, source) -> ready decks, oldest first
+_cursors = {}           # (template, source) -> section the next deck is drawn from
+_pending = deque()      # (template, source) keys that need a deck, in arrival order
+_active = None          # key the worker is waiting to generate or generating
+_cond = threading.Condition()
+_worker_lock = threading.Lock()
+_worker_thread = None
+_stopping = False
+_stats = {"generated": 0, "served": 0, "misses": 0, "preempted": 0, "failed": 0, "dropped": 0}
+
+
+class Preempted(Exception):
+    """Raised when interactive traffic reaches Ollama while a deck is being generated."""
+
+
+def schedule(source, templates=TEMPLATES):
+    """
+    Queues deck generation for a PDF until it has DECKS_PER_SOURCE decks ready per template.
+    """
+    if not ENABLED or _stopping:
+        return
+    with _cond:
+        for template in templates:
+            if (template, source) not in _pending:
+                _pending.append((template, source))
+        _cond.notify()
+    _ensure_worker()
+
+
+def source_ingested(source):
+    """
+    Called once a PDF has been (re-)ingested: drops its decks that were built on chunks the
+    new version no longer has, then tops it up again.
+    """
+    current = set(rag.chunk_index.ids(source))
+    with _cond:
+        for template in TEMPLATES:
+            key = (template, source)
+            decks = _decks.get(key)
+            if decks:
+                kept = deque(deck for deck in decks if current.issuperset(deck["chunk_ids"]))
+                _stats["dropped"] += len(decks) - len(kept)
+                _decks[key] = kept
+            # the sections may have moved
+            _cursors.pop(key, None)
+    schedule(source)
+
+
+def take(template, source=None, exclude=()):
+    """
+    Removes and returns a ready deck ({"response", "chunk_ids", "source", "section"}) for
+    the template: from `source`, or without one from the PDF with the most decks ready.
+    Decks that share a chunk with `exclude` are skipped. Returns None if no deck fits.
+    Either way the pool is refilled in the background.
+    """
+    if not ENABLED:
+        return None
+    exclude = set(exclude)
+    with _cond:
+        if source is not None:
+            keys = [(template, source)]
+        else:
+            keys = [key for key, decks in _decks.items() if key[0] == template and decks]
+            random.shuffle(keys)
+            keys.sort(key=lambda key: len(_decks[key]), reverse=True)
+        deck = _pick(keys, exclude)
+        _stats["served" if deck is not None else "misses"] += 1
+
+    if deck is not None:
+        schedule(deck["source"], (template,))
+    elif source is not None:
+        schedule(source, (template,))
+    else:
+        for indexed in rag.list_sources():
+            schedule(indexed, (template,))
+    return deck
+
+
+def _pick(keys, exclude):
+    for key in keys:
+        decks = _decks.get(key, ())
+        for deck in decks:
+            if exclude.isdisjoint(deck["chunk_ids"]):
+                decks.remove(deck)
+                return deck
+    return None
+
+
+def _ensure_worker():
+    global _worker_thread
+    if _worker_thread is None:
+        with _worker_lock:
+            if _worker_thread is None:
+                thread = threading.Thread(target=_worker, name="pregen", daemon=True)
+                thread.start()
+                _worker_thread = thread
+
+
+def _worker():
+    global _active
+    while True:
+        with _cond:
+            _active = None
+            _cond.wait_for(lambda: _pending or _stopping)
+            if _stopping:
+                return
+            key = _pending.popleft()
+            if len(_decks.get(key, ())) >= DECKS_PER_SOURCE:
+                continue
+            _active = key
+
+        if not _wait_until_idle():
+            return
+        chunk_ids, section = _next_section(key)
+        if not chunk_ids:
+            continue
+        try:
+            deck = _generate(key, chunk_ids, section)
+        except Preempted:
+            # the same deck is started over once Ollama is idle again
+            with _cond:
+                _stats["preempted"] += 1
+                _cursors[key] = section
+                if key not in _pending:
+                    _pending.appendleft(key)
+            continue
+        except Exception as e:
+            print(f"Deck pre-generation failed for {key}: {e}")
+            deck = None
+
+        if deck is None:
+            # not requeued: the next request for it that finds no deck schedules it again
+            with _cond:
+                _stats["failed"] += 1
+                _active = None
+                if _cond.wait_for(lambda: _stopping, timeout=FAILURE_BACKOFF_SEC):
+                    return
+            continue
+        _store(key, deck)
+
+
+def _wait_until_idle():
+    """
+    Blocks until no interactive request has run or waited on Ollama for IDLE_SEC.
+    Returns False if the scheduler is stopping.
+    """
+    idle_since = None
+    while True:
+        now = time.monotonic()
+        if ollama_client.interactive() > 0:
+            idle_since = None
+        elif idle_since is None:
+            idle_since = now
+        elif now - idle_since >= IDLE_SEC:
+            return True
+        with _cond:
+            if _cond.wait_for(lambda: _stopping, timeout=POLL_SEC):
+                return False
+
+
+def _next_section(key):
+    """
+    Draws DECK_CHUNKS chunk ids (kept in document order) from the key's next section of
+    SECTION_CHUNKS consecutive chunks, so successive decks work through the whole PDF.
+    Returns (chunk ids, section number).
+    """
+    ids = rag.chunk_index.ids(key[1])
+    if not ids:
+        return [], None
+    sections = [ids[i:i + SECTION_CHUNKS] for i in range(0, len(ids), SECTION_CHUNKS)]
+    # templates start at different points, as a session's flashcards and quizzes avoid each other's chunks
+    start = TEMPLATES.index(key[0]) * len(sections) // len(TEMPLATES) if key[0] in TEMPLATES else 0
+    with _cond:
+        section = _cursors.get(key, start) % len(sections)
+        _cursors[key] = section + 1
+    chunk_ids = sections[section]
+    picked = sorted(random.sample(range(len(chunk_ids)), min(DECK_CHUNKS, len(chunk_ids))))
+    return [chunk_ids[i] for i in picked], section
+
+
+def _generate(key, chunk_ids, section):
+    template, source = key
+    texts = rag.get_chunks(chunk_ids)
+    chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id in texts]
+    if not chunk_ids:
+        return None
+    response, _ = ollama_client.run(_preemptible(generation.generate(template, [texts[i] for i in chunk_ids])))
+    if response == llm.LLM_ERROR:
+        return None
+    return {"response": response, "chunk_ids": chunk_ids, "source": source, "section": section}
+
+
+async def _preemptible(coro):
+    """
+    Runs coro as background work and cancels it as soon as an interactive request is
+    running or waiting on Ollama, which frees its slots for that request.
+    """
+    task = asyncio.ensure_future(ollama_client.as_background(coro))
+    while not task.done():
+        await asyncio.wait({task}, timeout=POLL_SEC)
+        if not task.done() and ollama_client.interactive() > 0:
+            task.cancel()
+            try:
+                return await task       # it may have finished in the meantime
+            except asyncio.CancelledError:
+                raise Preempted()
+    return task.result()
+
+
+def _store(key, deck):
+    current = set(rag.chunk_index.ids(key[1]))
+    with _cond:
+        # the PDF may have been re-ingested while the deck was generated
+        if not current.issuperset(deck["chunk_ids"]):
+            _stats["dropped"] += 1
+        else:
+            _decks.setdefault(key, deque()).append(deck)
+            _stats["generated"] += 1
+        if len(_decks.get(key, ())) < DECKS_PER_SOURCE and key not in _pending:
+            _pending.append(key)
+
+
+def shutdown():
+    """
+    Stops the scheduler from starting more decks; ready decks are in memory only.
+    """
+    global _stopping
+    with _cond:
+        _stopping = True
+        _cond.notify_all()
+
+
+def stats():
+    with _cond:
+        ready = {template: 0 for template in TEMPLATES}
+        for (template, _), decks in _decks.items():
+            ready[template] += len(decks)
+        return dict(_stats, enabled=ENABLED, ready=ready, pending=len(_pending) + (_active is not None),
+                    sources=len({source for (_, source), decks in _decks.items() if decks}))
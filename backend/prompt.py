@@ -0,0 +1,142 @@
+import os
+
+from chunker import count_tokens
+
+# config
+# Must match the num_ctx the model is run with (sent to Ollama by llm.py); anything past it is silently cut.
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "4096"))
+# room left for the answer, which shares the context window with the prompt
+RESPONSE_RESERVE_TOKENS = int(os.getenv("RESPONSE_RESERVE_TOKENS", "1024"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+# chunker.count_tokens runs ~1.3x below llama word pieces; over-estimating keeps us inside num_ctx
+TOKEN_SCALE = 1.3
+MESSAGE_OVERHEAD_TOKENS = 4     # role header / separators the chat template adds per message
+
+SUMMARY_QUESTION_CHARS = 160
+SUMMARY_ANSWER_CHARS = 240
+
+SEE_ABOVE = "(The relevant notes were already provided earlier in this conversation.)"
+
+
+def estimate_tokens(text):
+    return int(count_tokens(text) * TOKEN_SCALE) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "..."
+
+
+def _turns(history):
+    """
+    Pairs stored history messages into (question, answer, chunk ids) turns, oldest first.
+    """
+    turns = []
+    question = None
+    for msg in history:
+        if msg["role"] == "user":
+            question = msg["content"]
+        elif question is not None:
+            turns.append((question, msg["content"], list(msg.get("sources", []))))
+            question = None
+    return turns
+
+
+def summarize_turns(summary, turns):
+    """
+    Folds (question, answer, chunk ids) turns into the running summary. The summary is
+    extractive (no extra model call) and its oldest lines are dropped past SUMMARY_MAX_TOKENS.
+    """
+    lines = summary.splitlines() if summary else []
+    for question, answer, _ in turns:
+        lines.append(f"- Student asked: {_clip(question, SUMMARY_QUESTION_CHARS)}")
+        lines.append(f"  You answered: {_clip(answer, SUMMARY_ANSWER_CHARS)}")
+    while lines and count_tokens("\n".join(lines)) * TOKEN_SCALE > SUMMARY_MAX_TOKENS:
+        lines = lines[2:]
+    return "\n".join(lines)
+
+
+def compact_history(history, summary, max_messages):
+    """
+    Folds the oldest turns into the summary until at most max_messages remain.
+    Returns (history, summary).
+    """
+    if len(history) <= max_messages:
+        return history, summary
+    cut = len(history) - max_messages
+    cut += cut % 2      # whole turns only
+    return history[cut:], summarize_turns(summary, _turns(history[:cut]))
+
+
+def _user_content(chunk_texts, chunk_ids, query):
+    if chunk_ids:
+        context = "\n".join(chunk_texts[chunk_id] for chunk_id in chunk_ids)
+    else:
+        context = SEE_ABOVE
+    return f"Context from notes:\n{context}\n\nQuestion: {query}"
+
+
+def build_chat_prompt(system_prompt, history, summary, context_ids, chunk_texts, query,
+                      budget=LLM_CONTEXT_TOKENS - RESPONSE_RESERVE_TOKENS):
+    """
+    Fits system prompt + running summary + recent turns + retrieved chunks into `budget` tokens.
+
+    Each earlier question is replayed with the notes it was answered from, but every chunk is
+    sent only once, in the first turn that used it; later turns (including this one) rely on
+    it being above. Recent turns are kept newest first while they fit; older ones are folded
+    into the summary. If the retrieved chunks alone overflow, the lowest-ranked ones are cut.
+
+    `history` is the stored [{"role", "content", "sources"?}] list and `chunk_texts` maps chunk id
+    to text for this turn's and the history's chunks (ids missing from it are skipped).
+    Returns (messages, new summary, number of turns compacted off the front of history, report).
+    """
+    turns = _turns(history)
+    context_ids = [chunk_id for chunk_id in context_ids if chunk_id in chunk_texts]
+
+    def system_message(summary):
+        content = system_prompt
+        if summary:
+            content += "\n\nSummary of the earlier conversation:\n" + summary
+        return {"role": "system", "content": content}
+
+    # This turn's chunks come first: without them there is nothing to answer from.
+    # Room for a full summary is held back, since compaction below may grow it.
+    fixed = estimate_tokens(system_message("")["content"]) + SUMMARY_MAX_TOKENS
+    while len(context_ids) > 1 and fixed + estimate_tokens(_user_content(chunk_texts, context_ids, query)) > budget:
+        context_ids = context_ids[:-1]
+    used = fixed + estimate_tokens(_user_content(chunk_texts, context_ids, query))
+
+    # Newest turns first; each is costed with all its chunks, so dropping repeats below only shrinks it
+    kept = 0
+    for question, answer, chunk_ids in reversed(turns):
+        chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id in chunk_texts]
+        cost = estimate_tokens(_user_content(chunk_texts, chunk_ids, question)) + estimate_tokens(answer)
+        if used + cost > budget:
+            break
+        used += cost
+        kept += 1
+
+    compacted = len(turns) - kept
+    if compacted:
+        summary = summarize_turns(summary, turns[:compacted])
+
+    messages = [system_message(summary)]
+    sent = set()
+    for question, answer, chunk_ids in turns[compacted:]:
+        new_ids = [chunk_id for chunk_id in chunk_ids if chunk_id in chunk_texts and chunk_id not in sent]
+        sent.update(new_ids)
+        messages.append({"role": "user", "content": _user_content(chunk_texts, new_ids, question)})
+        messages.append({"role": "assistant", "content": answer})
+
+    new_ids = [chunk_id for chunk_id in context_ids if chunk_id not in sent]
+    messages.append({"role": "user", "content": _user_content(chunk_texts, new_ids, query)})
+
+    report = {
+        "prompt_tokens": sum(estimate_tokens(msg["content"]) for msg in messages),
+        "budget_tokens": budget,
+        "history_turns": kept,
+        "compacted_turns": compacted,
+        "context_chunks": len(new_ids),
+        "repeated_chunks": len(context_ids) - len(new_ids),
+    }
+    return messages, summary, compacted, report
@@ -1,102 +1,451 @@
+import os
+import time
+import hashlib
+import contextlib
+import threading
+from collections import deque
 import PyPDF2
-import pytesseract
-from pdf2image import convert_from_path
-import chromadb
-from chromadb.utils import embedding_functions
+
+import ocr
+import embeddings
+import response_cache
+import sampling
+import chunker
+import bm25
 
 # --- Setup Vector DB (Chroma) ---
-# using 'all-MiniLM-L6-v2' which is small and fast for CPU
-chroma_client = chromadb.Client()
-sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
+# Persisted on disk so embeddings survive restarts (volume-mounted in docker-compose)
+CHROMA_PATH = os.getenv("CHROMA_PATH", "chroma_db")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# The model and the collection are created on first use (or by warm_up()), not at import,
+# so importing rag stays cheap for the Flask process and the test suite.
+_collection = None
+_init_lock = threading.Lock()
+
+# chunk ids per source, for random sampling without loading documents, and a BM25 keyword
+# index for hybrid retrieval; both are rebuilt from the collection on first open, then
+# updated by ingest_file
+chunk_index = sampling.ChunkIndex()
+keyword_index = bm25.BM25Index()
+
+def _load_embedding_model():
+    # using 'all-MiniLM-L6-v2' which is small and fast for CPU; EMBEDDING_BACKEND picks the runtime
+    return embeddings.load_backend(embeddings.EMBEDDING_BACKEND, EMBEDDING_MODEL)
+
+# Batched ingestion embeddings, plus cached and micro-batched query embeddings for /chat
+embedder = embeddings.EmbeddingService(_load_embedding_model, backend=embeddings.EMBEDDING_BACKEND)
+
+def get_collection():
+    """
+    Returns the Chroma collection, opening the persistent client on first call.
+    """
+    global _collection
+    if _collection is None:
+        with _init_lock:
+            if _collection is None:
+                import chromadb
+                chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+                # Create a single collection for the session; embeddings are always passed
+                # in explicitly from the embedder
+                collection = chroma_client.get_or_create_collection(
+                    name="course_notes",
+                    embedding_function=None
+                )
+                _load_indexes(collection)
+                _collection = collection
+    return _collection
+
+def _load_indexes(collection, page_size=5000):
+    ids_by_source = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas", "documents"], limit=page_size, offset=offset)
+        for chunk_id, metadata, document in zip(page['ids'], page['metadatas'], page['documents']):
+            ids_by_source.setdefault(metadata.get("source"), []).append((metadata.get("chunk_index", 0), chunk_id))
+            keyword_index.add(chunk_id, document)
+        if len(page['ids']) < page_size:
+            break
+        offset += page_size
+    # in document order, so a run of ids is one section of the document (see pregen.py)
+    for source, ids in ids_by_source.items():
+        chunk_index.set_source(source, [chunk_id for _, chunk_id in sorted(ids)])
+
+def warm_up():
+    """
+    Loads the embedding model and opens the vector store ahead of the first request.
+    """
+    get_collection()
+    embedder.warm_up()
+
+# minimum number of chunks embedded per collection.upsert call, so ingestion can report
+# progress; a larger EMBED_BATCH_SIZE raises it, so each upsert fills whole forward passes
+ADD_BATCH_SIZE = 64
+# chunks whose metadata is rewritten per collection.update call at the end of an ingest
+METADATA_BATCH_SIZE = 1000
+
+# pages read ahead of the oldest unfinished OCR batch; bounds memory while OCR catches up
+MAX_READAHEAD_PAGES = 64
+
+# pages whose text layer yields fewer characters than this are treated as scanned
+MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "20"))
+
+page_counters = {"text_pages": 0, "ocr_pages": 0, "ocr_sec": 0.0}  # ocr_sec is time spent in OCR workers
+_page_counters_lock = threading.Lock()
+
+# --- Retrieval ---
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))   # per retriever, before fusion
+RRF_K = 60
+RERANK = os.getenv("RETRIEVAL_RERANK", "1") == "1"
+CONTEXT_CHAR_BUDGET = int(os.getenv("CONTEXT_CHAR_BUDGET", "2400"))
+
+retrieval_stats = {"queries": 0}
+_retrieval_stats_lock = threading.Lock()
 
-# Create a single collection for the session
-collection = chroma_client.get_or_create_collection(
-    name="course_notes", 
-    embedding_function=sentence_transformer_ef
-)
+def _noop_progress(stage, **counts):
+    pass
 
-def extract_text_from_pdf(filepath):
+def _open_source(source):
     """
-    Extracts text from PDF. Uses OCR (Tesseract) if text extraction yields little result.
+    A path is opened here (and closed by the caller); an upload (uploads.SpooledPDF) is read
+    in place from memory or its spool, and stays open for its owner to close.
     """
-    text = ""
+    if isinstance(source, str):
+        return open(source, 'rb'), True
+    source.file.seek(0)
+    return source.file, False
+
+def iter_pdf_pages(source, progress=_noop_progress):
+    """
+    Yields (page_number, text) in page order, one page at a time, so a document is never held
+    in memory as a single string. Pages whose text layer is empty or near-empty (scanned slides,
+    diagrams, handwriting) are OCR'd with Tesseract on the OCR process pool while later pages
+    keep being read; the rest use PyPDF2.
+
+    source is a file path or an upload (uploads.SpooledPDF). An upload is only written out
+    to a named file if some page needs OCR, since the OCR workers render pages from a path.
+    """
+    f = owned = None
     try:
-        with open(filepath, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-        
-        # Fallback to OCR if text is minimal (e.g., < 50 chars for a whole file)
-        if len(text.strip()) < 50: 
-            print(f"Text too short in {filepath}, attempting OCR...")
-            try:
-                # Requires Poppler to be installed
-                images = convert_from_path(filepath)
-                for img in images:
-                    # Requires Tesseract to be installed
-                    text += pytesseract.image_to_string(img) + "\n"
-            except Exception as e:
-                print(f"OCR failed (is poppler/tesseract installed?): {e}")
-                
+        f, owned = _open_source(source)
+        reader = PyPDF2.PdfReader(f)
+        pages_total = len(reader.pages)
     except Exception as e:
         print(f"Error reading PDF: {e}")
-        return None
-    return text
+        if owned:
+            f.close()
+        return
+    filepath = source if owned else None
+
+    counts = {"text_pages": 0, "ocr_pages": 0, "ocr_sec": 0.0}
+    pending = deque()   # (page numbers, PyPDF2 texts, OCR future or None), in page order
+    scanned_run = []
+
+    def submit_scanned():
+        if scanned_run:
+            future = ocr.submit(filepath or source.path(), scanned_run[0][0], scanned_run[-1][0])
+            pending.append(([p for p, _ in scanned_run], [t for _, t in scanned_run], future))
+            scanned_run.clear()
+
+    def pop_ready(wait_for_head):
+        # Yields pages from the front of the queue until it reaches an OCR batch still running
+        while pending and (wait_for_head or pending[0][2] is None or pending[0][2].done()):
+            wait_for_head = False
+            pages, texts, future = pending.popleft()
+            if future is not None:
+                try:
+                    texts, seconds = future.result()
+                    counts["ocr_pages"] += len(pages)
+                    counts["ocr_sec"] += seconds
+                except Exception as e:
+                    # keep whatever the text layer had for these pages
+                    print(f"OCR failed (is poppler/tesseract installed?): {e}")
+                progress("ocr", pages_ocr=counts["ocr_pages"])
+            yield from zip(pages, texts)
+
+    try:
+        with (f if owned else contextlib.nullcontext()):
+            progress("extracting", pages_total=pages_total, pages_parsed=0)
+            for i, page in enumerate(reader.pages, start=1):
+                try:
+                    page_text = page.extract_text() or ""
+                except Exception as e:
+                    print(f"Error reading page {i}: {e}")
+                    page_text = ""
 
-def chunk_text(text, chunk_size=500, overlap=50):
+                # Only pages without a usable text layer go to OCR, so OCR time scales with scanned pages
+                if len(page_text.strip()) < MIN_PAGE_CHARS:
+                    scanned_run.append((i, page_text))
+                    if len(scanned_run) == ocr.OCR_BATCH_PAGES:
+                        submit_scanned()
+                else:
+                    submit_scanned()
+                    pending.append(([i], [page_text], None))
+                    counts["text_pages"] += 1
+                progress("extracting", pages_parsed=i)
+
+                # Stop reading ahead when the OCR pool is saturated or too many pages are buffered
+                ocr_in_flight = sum(1 for _, _, future in pending if future is not None)
+                buffered = sum(len(pages) for pages, _, _ in pending)
+                yield from pop_ready(ocr_in_flight >= ocr.OCR_WORKERS * 2 or buffered > MAX_READAHEAD_PAGES)
+
+            submit_scanned()
+            while pending:
+                yield from pop_ready(True)
+    finally:
+        with _page_counters_lock:
+            for key, value in counts.items():
+                page_counters[key] += value
+        progress("extracted", pages_text=counts["text_pages"], pages_ocr=counts["ocr_pages"],
+                 ocr_sec=round(counts["ocr_sec"], 3))
+
+def extraction_stats():
     """
-    Splits text into overlapping chunks.
+    Cumulative count of pages read from the text layer vs. OCR'd, and total OCR time.
     """
-    chunks = []
-    for i in range(0, len(text), chunk_size - overlap):
-        chunks.append(text[i:i + chunk_size])
-    return chunks
+    with _page_counters_lock:
+        return dict(page_counters)
+
+def _file_hash(source):
+    sha = hashlib.sha256()
+    f, owned = _open_source(source)
+    try:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    finally:
+        if owned:
+            f.close()
+    return sha.hexdigest()
 
-def ingest_file(filepath, filename):
+def _chunk_hash(chunk):
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+
+def ingest_file(source, filename, progress=_noop_progress):
     """
-    Orchestrates extraction, chunking, and storing in ChromaDB.
+    Orchestrates extraction, chunking, and storing in ChromaDB as one stream: pages are
+    chunked as they are read and new chunks are embedded in batches of ADD_BATCH_SIZE (or the
+    embedder's batch_size, if larger).
+    progress(stage, **counts) is called as pages are parsed and chunks are embedded.
+    source is a file path or an upload held in memory (see iter_pdf_pages).
+
+    Chunks are keyed by content hash: re-uploading identical bytes is skipped entirely,
+    and a changed file only embeds the chunks that are new and drops the ones that disappeared.
+    The file hash that marks a file as processed is only written once every chunk is stored,
+    so an ingest cut off partway is finished (reusing the chunks it stored) when the file is re-uploaded.
     """
-    text = extract_text_from_pdf(filepath)
-    if not text:
+    collection = get_collection()
+    file_hash = _file_hash(source)
+    # complete only if every chunk of that ingest got the hash (see the end of this function)
+    existing = collection.get(where={"file_hash": file_hash}, include=["metadatas"])
+    if existing['ids'] and len(existing['ids']) >= existing['metadatas'][0].get("file_chunks", 0):
+        source = existing['metadatas'][0].get("source", filename)
+        progress("skipped")
+        return True, f"Already processed (identical to {source})"
+
+    # What is already stored for this file name, to diff against
+    stored_ids = set(collection.get(where={"source": filename}, include=[])['ids'])
+
+    # Cached LLM answers built on the previous version of this file are no longer valid
+    response_cache.cache.invalidate(stored_ids)
+
+    metadata_by_id = {}
+    kept = []
+    batch_ids, batch_documents, batch_metadatas = [], [], []
+    embedded = 0
+    flush_size = max(ADD_BATCH_SIZE, embedder.batch_size)
+
+    def embed_batch():
+        nonlocal embedded
+        if batch_ids:
+            collection.upsert(
+                documents=batch_documents,
+                embeddings=embedder(batch_documents),
+                ids=batch_ids,
+                metadatas=batch_metadatas,
+            )
+            for chunk_id, document in zip(batch_ids, batch_documents):
+                keyword_index.add(chunk_id, document)
+            embedded += len(batch_ids)
+            progress("embedding", chunks_embedded=embedded)
+            batch_ids.clear()
+            batch_documents.clear()
+            batch_metadatas.clear()
+
+    for chunk, page_start, page_end in chunker.chunk_pages(iter_pdf_pages(source, progress)):
+        # Content-addressed IDs for chunks: "filename_chunkHash" (identical chunks are stored once)
+        chunk_id = f"{filename}_{_chunk_hash(chunk)}"
+        if chunk_id in metadata_by_id:
+            continue
+        metadata = {
+            "source": filename,
+            "chunk_index": len(metadata_by_id),
+            "page_start": page_start,
+            "page_end": page_end,
+        }
+        metadata_by_id[chunk_id] = metadata
+
+        if chunk_id in stored_ids:
+            kept.append(chunk_id)
+        else:
+            batch_ids.append(chunk_id)
+            batch_documents.append(chunk)
+            batch_metadatas.append(metadata)
+            if len(batch_ids) >= flush_size:
+                embed_batch()
+    embed_batch()
+
+    if not metadata_by_id:
         return False, "Could not extract text"
-        
-    chunks = chunk_text(text)
-    if not chunks:
-        return False, "File was empty"
+    progress("embedding", chunks_total=len(metadata_by_id))
+
+    stale = list(stored_ids - set(metadata_by_id))
+    if stale:
+        collection.delete(ids=stale)
+        for chunk_id in stale:
+            keyword_index.remove(chunk_id)
+    # Last step: every chunk gets the file hash and chunk count (unchanged chunks only need
+    # their metadata refreshed, not re-embedding); once all have it, the file counts as processed
+    chunk_ids = list(metadata_by_id)
+    for i in range(0, len(chunk_ids), METADATA_BATCH_SIZE):
+        batch = chunk_ids[i:i + METADATA_BATCH_SIZE]
+        collection.update(ids=batch, metadatas=[dict(metadata_by_id[chunk_id], file_hash=file_hash, file_chunks=len(chunk_ids))
+                                                for chunk_id in batch])
+
+    chunk_index.set_source(filename, list(metadata_by_id))
+    return True, f"Processed {len(metadata_by_id)} chunks ({embedded} embedded, {len(kept)} unchanged, {len(stale)} removed)"
+
+def _rrf(rankings, k=RRF_K):
+    """
+    Reciprocal rank fusion: each list contributes 1 / (k + rank) for every id it ranks.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True), scores
+
+def _rerank(query, candidates, documents, fused_scores):
+    """
+    Cheap re-rank: boosts fused candidates by the share of distinct query terms they contain.
+    """
+    query_terms = set(bm25.tokenize(query))
+    if not query_terms:
+        return candidates
+
+    def score(chunk_id):
+        chunk_terms = set(bm25.tokenize(documents[chunk_id]))
+        coverage = len(query_terms & chunk_terms) / len(query_terms)
+        return fused_scores[chunk_id] * (1 + coverage)
 
-    # Create unique IDs for chunks: "filename_chunkIndex"
-    ids = [f"{filename}_{i}" for i in range(len(chunks))]
-    metadatas = [{"source": filename} for _ in range(len(chunks))]
-    
-    collection.add(documents=chunks, ids=ids, metadatas=metadatas)
-    return True, f"Processed {len(chunks)} chunks"
+    return sorted(candidates, key=score, reverse=True)
 
-def retrieve_context(query, n_results=3):
+def retrieve_context(query, n_results=3, timings=None):
     """
-    Queries ChromaDB for the most relevant text chunks.
+    Hybrid retrieval: dense (Chroma) and BM25 keyword candidates are fused with reciprocal
+    rank fusion, optionally re-ranked, and the top n_results that fit in CONTEXT_CHAR_BUDGET
+    are returned. Per-stage latencies (ms) are written into `timings` if a dict is given.
     """
+    timings = {} if timings is None else timings
+    stage_start = time.perf_counter()
+
+    def lap(stage):
+        nonlocal stage_start
+        now = time.perf_counter()
+        timings[stage] = round((now - stage_start) * 1000, 3)
+        stage_start = now
+
     # Check if the collection has any documents
+    collection = get_collection()
     if collection.count() == 0:
         return "", []
-        
-    results = collection.query(query_texts=[query], n_results=n_results)
-    if results['documents']:
-        # Documents are returned as a list of lists (outer list for queries, inner list for results)
-        return "\n".join(results['documents'][0]), results['ids'][0]
-    return "", []
 
-def get_random_context(n=3):
+    query_embedding = embedder.embed_query([query])
+    lap("embed_ms")
+
+    results = collection.query(query_embeddings=query_embedding, n_results=RETRIEVAL_CANDIDATES,
+                               include=["documents"])
+    # Documents are returned as a list of lists (outer list for queries, inner list for results)
+    dense_ids = results['ids'][0] if results['ids'] else []
+    documents = dict(zip(dense_ids, results['documents'][0])) if dense_ids else {}
+    lap("dense_ms")
+
+    sparse_ids = [chunk_id for chunk_id, _ in keyword_index.search(query, RETRIEVAL_CANDIDATES)]
+    lap("sparse_ms")
+
+    candidates, fused_scores = _rrf([dense_ids, sparse_ids])
+    missing = [chunk_id for chunk_id in candidates if chunk_id not in documents]
+    if missing:
+        fetched = collection.get(ids=missing, include=["documents"])
+        documents.update(zip(fetched['ids'], fetched['documents']))
+    candidates = [chunk_id for chunk_id in candidates if chunk_id in documents]
+    lap("fuse_ms")
+
+    if RERANK:
+        candidates = _rerank(query, candidates, documents, fused_scores)
+    lap("rerank_ms")
+
+    # Fill the context in rank order without exceeding the character budget
+    selected = []
+    used_chars = 0
+    for chunk_id in candidates:
+        if len(selected) == n_results:
+            break
+        length = len(documents[chunk_id])
+        if selected and used_chars + length > CONTEXT_CHAR_BUDGET:
+            continue
+        selected.append(chunk_id)
+        used_chars += length
+
+    _record_retrieval(timings)
+    if not selected:
+        return "", []
+    return "\n".join(documents[chunk_id] for chunk_id in selected), selected
+
+def _record_retrieval(timings):
+    with _retrieval_stats_lock:
+        retrieval_stats["queries"] += 1
+        for stage, ms in timings.items():
+            retrieval_stats["total_" + stage] = retrieval_stats.get("total_" + stage, 0.0) + ms
+
+def get_retrieval_stats():
     """
-    Gets random documents (for flashcard/quiz generation without a specific query).
+    Query count and average per-stage retrieval latency in milliseconds.
     """
-    if collection.count() == 0:
-        return ""
-        
-    # .peek() returns the first n items; good enough for "random" generation context in this scope, it is deterministic unless we use random.sample
-    data = collection.peek(limit=n)
-    if data['documents']:
-        # documents is a list of documents
-        return "\n".join(data['documents'])
-    return ""
\ No newline at end of file
+    with _retrieval_stats_lock:
+        stats = dict(retrieval_stats)
+    queries = stats.pop("queries")
+    result = {"queries": queries, "keyword_index_size": len(keyword_index)}
+    for key, total in stats.items():
+        result["avg_" + key[len("total_"):]] = round(total / queries, 3) if queries else 0.0
+    return result
+
+def get_chunks(chunk_ids):
+    """
+    Maps chunk id to text for the given ids; ids no longer in the store are left out.
+    """
+    if not chunk_ids:
+        return {}
+    data = get_collection().get(ids=list(chunk_ids), include=["documents"])
+    return dict(zip(data['ids'], data['documents']))
+
+def get_random_chunks(n=3, source=None, exclude=()):
+    """
+    Gets random chunks (for flashcard/quiz generation without a specific query) as (id, text) pairs.
+    Samples are stratified across source PDFs (or limited to `source`), and chunk ids in
+    `exclude` are only used once the others run out.
+    """
+    get_collection()    # loads chunk_index on first use
+    chunk_ids = chunk_index.sample(n, source=source, exclude=exclude)
+    if not chunk_ids:
+        return []
+
+    # Only the sampled chunks are fetched from the store
+    documents = get_chunks(chunk_ids)
+    return [(chunk_id, documents[chunk_id]) for chunk_id in chunk_ids if chunk_id in documents]
+
+def list_sources():
+    """
+    Maps each ingested PDF to its number of chunks.
+    """
+    get_collection()
+    return chunk_index.sources()
\ No newline at end of file
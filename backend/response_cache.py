@@ -0,0 +1,124 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+from embeddings import normalize_query
+
+# config
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL_SEC = float(os.getenv("RESPONSE_CACHE_TTL_SEC", "3600"))
+# cosine similarity above which a different chat question over the same chunks reuses an answer (0 disables)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of LLM responses keyed on (prompt template, model, context chunk ids, normalized query).
+
+    Entries remember which chunk ids they were generated from, so invalidate(chunk_ids) drops every
+    answer that depended on re-ingested chunks. Lookups may pass a query embedding to also match a
+    near-identical question asked against the same chunks.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_sec=RESPONSE_CACHE_TTL_SEC,
+                 similarity=RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.similarity = similarity
+        self._entries = OrderedDict()   # key -> (value, expires_at, query_embedding)
+        self._by_chunk = {}             # chunk id -> keys depending on it
+        self._by_context = {}           # (template, model, chunk ids) -> keys, for similarity lookups
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "invalidated": 0}
+
+    @staticmethod
+    def _key(template, model, chunk_ids, query):
+        return (template, model, tuple(chunk_ids), normalize_query(query))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        for chunk_id in key[2]:
+            keys = self._by_chunk.get(chunk_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_chunk[chunk_id]
+        context = key[:3]
+        keys = self._by_context.get(context)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[context]
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            self._remove(key)
+            return None
+        return entry
+
+    def get(self, template, model, chunk_ids, query="", query_embedding=None):
+        key = self._key(template, model, chunk_ids, query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._live(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+
+            if query_embedding is not None and self.similarity > 0:
+                for other in list(self._by_context.get(key[:3], ())):
+                    entry = self._live(other, now)
+                    if entry is not None and entry[2] is not None and _cosine(query_embedding, entry[2]) >= self.similarity:
+                        self._entries.move_to_end(other)
+                        self._stats["similar_hits"] += 1
+                        return entry[0]
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, template, model, chunk_ids, value, query="", query_embedding=None):
+        key = self._key(template, model, chunk_ids, query)
+        embedding = list(query_embedding) if query_embedding is not None else None
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_sec, embedding)
+            for chunk_id in key[2]:
+                self._by_chunk.setdefault(chunk_id, set()).add(key)
+            self._by_context.setdefault(key[:3], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, chunk_ids):
+        """
+        Drops every cached response generated from any of these chunks.
+        """
+        with self._lock:
+            keys = set()
+            for chunk_id in chunk_ids:
+                keys |= self._by_chunk.get(chunk_id, set())
+            for key in keys:
+                self._remove(key)
+            self._stats["invalidated"] += len(keys)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["similar_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+cache = ResponseCache()
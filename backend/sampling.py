@@ -0,0 +1,111 @@
+import random
+import threading
+
+
+class ChunkIndex:
+    """
+    In-memory index of chunk ids per source document, used to draw generation context
+    without loading the collection. Kept in step with the vector store by rag.ingest_file.
+    """
+
+    def __init__(self):
+        self._ids_by_source = {}
+        self._source_of = {}    # chunk id -> source, to count a sample's excluded ids per document
+        self._lock = threading.Lock()
+
+    def set_source(self, source, chunk_ids):
+        with self._lock:
+            for chunk_id in self._ids_by_source.pop(source, ()):
+                self._source_of.pop(chunk_id, None)
+            if chunk_ids:
+                # replaced, never changed in place, so sample() can use a list outside the lock
+                self._ids_by_source[source] = list(chunk_ids)
+                self._source_of.update(dict.fromkeys(chunk_ids, source))
+
+    def ids(self, source):
+        """
+        The source's chunk ids in document order (empty if it isn't indexed).
+        """
+        with self._lock:
+            return list(self._ids_by_source.get(source, []))
+
+    def sources(self):
+        """
+        Maps each source to its number of chunks.
+        """
+        with self._lock:
+            return {source: len(ids) for source, ids in self._ids_by_source.items()}
+
+    def sample(self, n, source=None, exclude=(), rng=random):
+        """
+        Draws up to n chunk ids, stratified so every document gets an (almost) equal share.
+        Ids in `exclude` (recently used) are only drawn once the fresh ones run out.
+        Costs O(n + len(exclude)) per document, not O(chunks in the document).
+        """
+        with self._lock:
+            if source is not None:
+                pools = {source: self._ids_by_source[source]} if source in self._ids_by_source else {}
+            else:
+                pools = dict(self._ids_by_source)
+            excluded = {s: [] for s in pools}
+            for chunk_id in dict.fromkeys(exclude):
+                owner = self._source_of.get(chunk_id)
+                if owner in excluded:
+                    excluded[owner].append(chunk_id)
+
+        # Documents are visited in random order, so n < number of documents still spreads out
+        order = list(pools)
+        rng.shuffle(order)
+        fresh_quota = _quotas({s: len(pools[s]) - len(excluded[s]) for s in order}, order, n)
+        used_quota = _quotas({s: len(excluded[s]) for s in order}, order, n - sum(fresh_quota.values()))
+
+        fresh, used = {}, {}
+        for s in order:
+            skip = set(excluded[s])
+            # any quota + len(skip) distinct ids of the document hold at least quota fresh ones,
+            # so the whole list is only drawn from when it is mostly excluded
+            candidates = rng.sample(pools[s], min(len(pools[s]), fresh_quota[s] + len(skip))) if fresh_quota[s] else []
+            fresh[s] = [i for i in candidates if i not in skip][:fresh_quota[s]]
+            used[s] = rng.sample(excluded[s], used_quota[s])
+        picked = _round_robin(fresh, order, n)
+        if len(picked) < n:
+            picked += _round_robin(used, order, n - len(picked))
+        return picked
+
+
+def _quotas(capacity, order, n):
+    """
+    How many ids each pool gives when one is taken from each in turn (skipping exhausted
+    ones) until n ids are taken.
+    """
+    quota = dict.fromkeys(order, 0)
+    order = [s for s in order if capacity[s] > 0]
+    position = 0
+    while n > 0 and order:
+        position %= len(order)
+        s = order[position]
+        quota[s] += 1
+        n -= 1
+        if quota[s] < capacity[s]:
+            position += 1
+        else:
+            del order[position]     # the next pool moves up into this position
+    return quota
+
+
+def _round_robin(pools, order, n):
+    """
+    Takes one id from each pool in turn (skipping empty ones) until n ids are taken.
+    """
+    order = [s for s in order if pools[s]]
+    picked = []
+    position = 0
+    while len(picked) < n and order:
+        position %= len(order)
+        s = order[position]
+        picked.append(pools[s].pop())
+        if pools[s]:
+            position += 1
+        else:
+            del order[position]
+    return picked
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# config
+# "memory" keeps sessions in this process (lost on restart, not shared between workers);
+# "sqlite" keeps them in SESSION_DB_PATH, shared by every worker on the host.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_TTL_SEC = float(os.getenv("SESSION_TTL_SEC", "86400"))     # idle time before a session expires
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))                # memory backend only, least recently used go first
+PURGE_INTERVAL_SEC = 300
+
+
+class SessionStore(ABC):
+    """
+    Server-side per-session state, keyed by the id kept in the session cookie.
+
+    Chat history is an append-only list of {"role", "content", "sources"?} messages, so a turn
+    writes two messages instead of re-serializing the conversation. Small values (running summary,
+    recently used chunk ids) live alongside it. A session expires SESSION_TTL_SEC after its last write.
+    """
+
+    def __init__(self, ttl_sec=SESSION_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+
+    @abstractmethod
+    def history(self, session_id, limit=None):
+        """
+        Returns the last `limit` messages (all if None), oldest first.
+        """
+
+    @abstractmethod
+    def append(self, session_id, messages):
+        pass
+
+    @abstractmethod
+    def drop_oldest(self, session_id, n):
+        pass
+
+    @abstractmethod
+    def get(self, session_id, key, default=None):
+        pass
+
+    @abstractmethod
+    def set(self, session_id, key, value):
+        pass
+
+    @abstractmethod
+    def purge_expired(self):
+        pass
+
+    @abstractmethod
+    def stats(self):
+        pass
+
+    def _maybe_purge(self):
+        # called after writes from many request threads; only one of them runs the purge
+        now = time.monotonic()
+        with self._purge_lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + PURGE_INTERVAL_SEC
+        self.purge_expired()
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store: an LRU of at most max_sessions sessions with idle-time expiry.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl_sec=SESSION_TTL_SEC):
+        super().__init__(ttl_sec)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()   # session id -> {"messages", "values", "expires_at"}
+        self._lock = threading.Lock()
+
+    def _session(self, session_id, create=False):
+        now = time.monotonic()
+        entry = self._sessions.get(session_id)
+        if entry is not None and entry["expires_at"] < now:
+            del self._sessions[session_id]
+            entry = None
+        if entry is None:
+            if not create:
+                return None
+            entry = {"messages": [], "values": {}, "expires_at": 0.0}
+            self._sessions[session_id] = entry
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        if create:
+            entry["expires_at"] = now + self.ttl_sec
+        self._sessions.move_to_end(session_id)
+        return entry
+
+    def history(self, session_id, limit=None):
+        with self._lock:
+            entry = self._session(session_id)
+            if entry is None:
+                return []
+            messages = entry["messages"]
+            if limit is not None:
+                messages = messages[max(len(messages) - limit, 0):]
+            return [dict(msg) for msg in messages]
+
+    def append(self, session_id, messages):
+        with self._lock:
+            self._session(session_id, create=True)["messages"].extend(dict(msg) for msg in messages)
+        self._maybe_purge()
+
+    def drop_oldest(self, session_id, n):
+        with self._lock:
+            entry = self._session(session_id)
+            if entry is not None:
+                del entry["messages"][:n]
+
+    def get(self, session_id, key, default=None):
+        with self._lock:
+            entry = self._session(session_id)
+            return default if entry is None else entry["values"].get(key, default)
+
+    def set(self, session_id, key, value):
+        with self._lock:
+            self._session(session_id, create=True)["values"][key] = value
+        self._maybe_purge()
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, entry in self._sessions.items() if entry["expires_at"] < now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._sessions)}
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite-backed store. Messages are rows, so appending a turn is two INSERTs and reading
+    history is one indexed range scan. One connection per thread, WAL so readers don't block writers.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, ttl_sec=SESSION_TTL_SEC):
+        super().__init__(ttl_sec)
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    sources TEXT
+                );
+                CREATE INDEX IF NOT EXISTS messages_by_session ON messages (session_id, id);
+                CREATE TABLE IF NOT EXISTS session_values (
+                    session_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (session_id, key)
+                );
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _touch(self, conn, session_id):
+        now = time.time()
+        # an expired session that hasn't been purged yet starts over empty
+        for table in ("messages", "session_values"):
+            conn.execute(
+                f"DELETE FROM {table} WHERE session_id = ? AND "
+                "EXISTS (SELECT 1 FROM sessions WHERE id = ? AND expires_at < ?)",
+                (session_id, session_id, now),
+            )
+        conn.execute(
+            "INSERT INTO sessions (id, expires_at) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET expires_at = excluded.expires_at",
+            (session_id, now + self.ttl_sec),
+        )
+
+    def _live(self, conn, session_id):
+        row = conn.execute("SELECT expires_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return row is not None and row[0] >= time.time()
+
+    def history(self, session_id, limit=None):
+        conn = self._conn()
+        if not self._live(conn, session_id):
+            return []
+        rows = conn.execute(
+            "SELECT role, content, sources FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, -1 if limit is None else limit),
+        ).fetchall()
+        messages = []
+        for role, content, sources in reversed(rows):
+            msg = {"role": role, "content": content}
+            if sources is not None:
+                msg["sources"] = json.loads(sources)
+            messages.append(msg)
+        return messages
+
+    def append(self, session_id, messages):
+        with self._conn() as conn:
+            self._touch(conn, session_id)
+            conn.executemany(
+                "INSERT INTO messages (session_id, role, content, sources) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, msg["role"], msg["content"],
+                     json.dumps(msg["sources"]) if "sources" in msg else None)
+                    for msg in messages
+                ],
+            )
+        self._maybe_purge()
+
+    def drop_oldest(self, session_id, n):
+        with self._conn() as conn:
+            conn.execute(
+                "DELETE FROM messages WHERE id IN "
+                "(SELECT id FROM messages WHERE session_id = ? ORDER BY id LIMIT ?)",
+                (session_id, n),
+            )
+
+    def get(self, session_id, key, default=None):
+        conn = self._conn()
+        if not self._live(conn, session_id):
+            return default
+        row = conn.execute(
+            "SELECT value FROM session_values WHERE session_id = ? AND key = ?", (session_id, key)
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, session_id, key, value):
+        with self._conn() as conn:
+            self._touch(conn, session_id)
+            conn.execute(
+                "INSERT INTO session_values (session_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id, key) DO UPDATE SET value = excluded.value",
+                (session_id, key, json.dumps(value)),
+            )
+        self._maybe_purge()
+
+    def purge_expired(self):
+        with self._conn() as conn:
+            expired = "SELECT id FROM sessions WHERE expires_at < ?"
+            now = time.time()
+            conn.execute(f"DELETE FROM messages WHERE session_id IN ({expired})", (now,))
+            conn.execute(f"DELETE FROM session_values WHERE session_id IN ({expired})", (now,))
+            return conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,)).rowcount
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {"backend": "sqlite", "sessions": count}
+
+
+def create_store(backend=SESSION_BACKEND):
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+
+
+store = create_store()
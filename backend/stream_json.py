@@ -0,0 +1,108 @@
+import re
+import json
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+class ItemStream:
+    """
+    Incremental, tolerant parser for model output that should be a JSON array of objects.
+
+    feed() takes the next piece of text (e.g. one streamed token) and returns the items it
+    completed: each object directly inside the outermost array, as soon as its closing brace
+    arrives. Text around the JSON (introductions, ```json fences) is ignored, a wrapper object
+    like {"flashcards": [...]} is looked through, bare objects without the array are accepted,
+    and an object that is malformed or cut off is dropped without losing the items around it.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        # open containers: [bracket, start offset in _buf, expecting a key, yielded items]
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self.malformed = 0      # objects dropped because they could not be parsed
+
+    def feed(self, text):
+        self._buf += text
+        items = []
+        buf, stack = self._buf, self._stack
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif not stack:
+                # outside any JSON only an opening bracket matters
+                if ch in "[{":
+                    stack.append([ch, i, ch == "{", False])
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                top = stack[-1]
+                if top[0] == "{" and top[2]:
+                    # a value where a key belongs: the open object is broken, so drop it
+                    # and read this one as its sibling
+                    stack.pop()
+                    self.malformed += 1
+                    continue
+                stack.append([ch, i, ch == "{", False])
+            elif ch == ":":
+                stack[-1][2] = False
+            elif ch == ",":
+                stack[-1][2] = stack[-1][0] == "{"
+            elif ch in "]}":
+                opener = "[" if ch == "]" else "{"
+                if any(frame[0] == opener for frame in stack):
+                    # close the innermost matching container, abandoning anything left open inside it
+                    while stack[-1][0] != opener:
+                        if stack.pop()[0] == "{":
+                            self.malformed += 1
+                    frame = stack.pop()
+                    if ch == "}" and self._is_item(frame):
+                        item = self._parse(buf[frame[1]:i + 1])
+                        if item is not None:
+                            items.append(item)
+                            if stack:
+                                stack[0][3] = True
+            i += 1
+
+        # keep only the text an item still being read can need
+        keep = next((frame[1] for frame in stack if frame[0] == "{" and not frame[3]), i)
+        self._buf = buf[keep:]
+        self._pos = i - keep
+        for frame in stack:
+            frame[1] -= keep
+        return items
+
+    def _is_item(self, frame):
+        arrays = [f for f in self._stack if f[0] == "["]
+        if arrays:
+            # directly inside the outermost array, not nested deeper (e.g. in a quiz item's options)
+            return len(arrays) == 1 and self._stack[-1] is arrays[0]
+        # a top-level object is an item itself unless items were found inside it (a wrapper)
+        return not self._stack and not frame[3]
+
+    def _parse(self, text):
+        # cheap repairs for the usual slips: raw newlines/tabs inside strings, trailing commas
+        for candidate in (text, _TRAILING_COMMA_RE.sub(r"\1", text)):
+            try:
+                return json.loads(candidate, strict=False)
+            except ValueError:
+                pass
+        self.malformed += 1
+        return None
+
+
+def parse_items(text):
+    """
+    Items in a complete model output (see ItemStream). Returns (items, malformed count).
+    """
+    parser = ItemStream()
+    return parser.feed(text), parser.malformed
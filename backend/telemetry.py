@@ -1,11 +1,56 @@
+import os
+import math
 import time
 import json
+import atexit
+import shutil
+import threading
+from collections import deque
 
-LOG_FILE = "telemetry_logs.jsonl"
+# config
+LOG_FILE = os.getenv("TELEMETRY_LOG_FILE", "telemetry_logs.jsonl")
+# Entries wait in memory for the writer thread; if it falls this far behind, the oldest are dropped
+BUFFER_SIZE = int(os.getenv("TELEMETRY_BUFFER", "10000"))
+FLUSH_INTERVAL_SEC = float(os.getenv("TELEMETRY_FLUSH_SEC", "1.0"))
+FLUSH_BATCH = 500       # flush early once this many entries are waiting
+# LOG_FILE is rotated to LOG_FILE.1 (.1 -> .2, ...) once it passes MAX_BYTES
+MAX_BYTES = int(os.getenv("TELEMETRY_MAX_BYTES", str(20 * 1024 * 1024)))
+BACKUP_COUNT = int(os.getenv("TELEMETRY_BACKUPS", "5"))
+METRICS_WINDOW = 2048   # latest requests per endpoint/pathway that /metrics percentiles are over
 
-def log(pathway, endpoint, prompt_len, response_len, latency, success=True):
+_buffer = deque(maxlen=BUFFER_SIZE)
+_cond = threading.Condition()
+_write_lock = threading.Lock()
+_writer_thread = None
+_stats = {"logged": 0, "written": 0, "dropped": 0, "flushes": 0, "rotations": 0, "write_errors": 0}
+
+_series = {}            # (endpoint, pathway) -> counts and recent timings
+_metrics_lock = threading.Lock()
+
+
+class Stages:
+    """
+    Wall time of each stage of one request. mark(stage) ends the stage that just ran:
+    it is charged the time since the previous mark (or the request start).
+    """
+
+    def __init__(self, start_time):
+        self._last = start_time
+        self.timings = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + now - self._last, 4)
+        self._last = now
+
+
+def log(pathway, endpoint, prompt_len, response_len, latency, success=True, ttft=None, stages=None, **extra):
+    """
+    Records one request. Only appends to an in-memory buffer; the file is written in
+    batches by a background thread, so the request never waits on disk.
+    """
     entry = {
-        "timestamp": time.perf_counter(),
+        "timestamp": round(time.time(), 3),
         "endpoint": endpoint,
         "pathway": pathway,
         "latency_sec": round(latency, 4),
@@ -13,9 +58,142 @@ def log(pathway, endpoint, prompt_len, response_len, latency, success=True):
         "output_length": response_len,
         "success": success
     }
-    
+    # time to first token, for streamed responses
+    if ttft is not None:
+        entry["ttft_sec"] = round(ttft, 4)
+    # seconds spent in validate / retrieve / prompt / llm / parse
+    if stages:
+        entry["stages"] = dict(stages)
+    # endpoint specific figures, e.g. prompt token counts
+    entry.update(extra)
+
+    _observe(entry)
+    _ensure_writer()
+    with _cond:
+        if len(_buffer) == BUFFER_SIZE:
+            _stats["dropped"] += 1
+        _buffer.append(entry)
+        _stats["logged"] += 1
+        if len(_buffer) >= FLUSH_BATCH:
+            _cond.notify()
+
+
+def _ensure_writer():
+    global _writer_thread
+    if _writer_thread is None:
+        with _write_lock:
+            if _writer_thread is None:
+                thread = threading.Thread(target=_writer, name="telemetry-writer", daemon=True)
+                thread.start()
+                _writer_thread = thread
+
+
+def _writer():
+    while True:
+        with _cond:
+            _cond.wait_for(lambda: len(_buffer) >= FLUSH_BATCH, timeout=FLUSH_INTERVAL_SEC)
+        flush()
+
+
+def flush():
+    """
+    Writes everything buffered to LOG_FILE in one append. Run by the writer thread,
+    and on shutdown so the last entries aren't lost. Returns the number written.
+    """
+    with _write_lock:
+        with _cond:
+            entries = list(_buffer)
+            _buffer.clear()
+        if not entries:
+            return 0
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        try:
+            _rotate_if_needed()
+            with open(LOG_FILE, "a") as f:
+                f.write(lines)
+        except Exception as e:
+            _stats["write_errors"] += 1
+            print(f"Telemetry logging failed: {e}")
+            return 0
+        _stats["written"] += len(entries)
+        _stats["flushes"] += 1
+        return len(entries)
+
+
+def _rotate_if_needed():
     try:
-        with open(LOG_FILE, "a") as f:
-            f.write(json.dumps(entry) + "\n")
-    except Exception as e:
-        print(f"Telemetry logging failed: {e}")
\ No newline at end of file
+        if os.path.getsize(LOG_FILE) < MAX_BYTES:
+            return
+    except OSError:
+        return
+    for i in range(BACKUP_COUNT - 1, 0, -1):
+        if os.path.exists(f"{LOG_FILE}.{i}"):
+            os.replace(f"{LOG_FILE}.{i}", f"{LOG_FILE}.{i + 1}")
+    if BACKUP_COUNT > 0:
+        try:
+            os.replace(LOG_FILE, f"{LOG_FILE}.1")
+        except OSError:
+            # LOG_FILE is itself a mount point (docker-compose bind-mounts it), so it can't be renamed
+            shutil.copyfile(LOG_FILE, f"{LOG_FILE}.1")
+    open(LOG_FILE, "w").close()
+    _stats["rotations"] += 1
+
+
+atexit.register(flush)
+
+
+def _observe(entry):
+    key = (entry["endpoint"], entry["pathway"])
+    with _metrics_lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = {"count": 0, "failures": 0, "latency": deque(maxlen=METRICS_WINDOW),
+                                     "ttft": deque(maxlen=METRICS_WINDOW), "stages": {}}
+        series["count"] += 1
+        if not entry["success"]:
+            series["failures"] += 1
+        series["latency"].append(entry["latency_sec"])
+        if "ttft_sec" in entry:
+            series["ttft"].append(entry["ttft_sec"])
+        for stage, seconds in entry.get("stages", {}).items():
+            series["stages"].setdefault(stage, deque(maxlen=METRICS_WINDOW)).append(seconds)
+
+
+def percentiles(values):
+    """
+    Nearest-rank p50/p95/p99 and max of a list of seconds, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = lambda p: values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "max": values[-1]}
+
+
+def metrics():
+    """
+    Per endpoint and pathway: request and failure counts since start, and latency, time to
+    first token and per-stage percentiles over the latest METRICS_WINDOW requests.
+    """
+    with _metrics_lock:
+        snapshot = {
+            key: (series["count"], series["failures"], list(series["latency"]), list(series["ttft"]),
+                  {stage: list(values) for stage, values in series["stages"].items()})
+            for key, series in _series.items()
+        }
+    result = {}
+    for (endpoint, pathway), (count, failures, latency, ttft, stages) in sorted(snapshot.items()):
+        entry = {"count": count, "failures": failures, "latency_sec": percentiles(latency)}
+        if ttft:
+            entry["ttft_sec"] = percentiles(ttft)
+        if stages:
+            entry["stages_sec"] = {stage: percentiles(values) for stage, values in stages.items()}
+        result.setdefault(endpoint, {})[pathway] = entry
+    return result
+
+
+def stats():
+    with _cond:
+        result = dict(_stats)
+        result["buffered"] = len(_buffer)
+    return result
@@ -2,6 +2,9 @@ import pytest
 import json
 import sys
 import os
+import time
+import asyncio
+import threading
 
 # Ensure we can import backend modules
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,6 +13,21 @@ sys.path.insert(0, parent_dir)
 
 import validate
 import llm
+import jobs
+import ocr
+import embeddings
+import ollama_client
+import response_cache
+import sampling
+import chunker
+import bm25
+import prompt
+import sessions
+import generation
+import stream_json
+import telemetry
+import rag
+import pregen
 
 # --- Fixtures ---
 
@@ -54,7 +72,1000 @@ def test_validate_length_limit():
     assert "too long" in msg
 
 # ==========================================
-# 2. INTEGRATION TESTS: LLM FUNCTIONS
+# 2. UNIT TESTS: BACKGROUND INGESTION JOBS
+# ==========================================
+
+def test_ingestion_job_reports_progress():
+    """Test that a queued job runs in the background and records stage progress."""
+    def fake_ingest(name, progress):
+        progress("extracting", pages_total=2, pages_parsed=2)
+        progress("embedding", chunks_total=5, chunks_embedded=5)
+        return True, f"Processed {name}"
+
+    job = jobs.submit("notes.pdf", fake_ingest, "notes.pdf")
+    assert job is not None
+    assert jobs.get(job.id) is job
+
+    deadline = time.time() + 5
+    while job.status in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.01)
+
+    status = job.to_dict()
+    assert status["status"] == "done"
+    assert status["message"] == "Processed notes.pdf"
+    assert status["progress"] == {"pages_total": 2, "pages_parsed": 2, "chunks_total": 5, "chunks_embedded": 5}
+
+def test_upload_batch_runs_files_as_jobs_under_one_slot(monkeypatch):
+    """Test that a batch takes a single queue slot, runs every file as its own job and frees the slot at the end."""
+    monkeypatch.setattr(jobs, "_slots", threading.BoundedSemaphore(1))
+    gate = threading.Event()
+
+    def fake_ingest(name, progress):
+        gate.wait(5)
+        return name != "bad.pdf", f"Processed {name}"
+
+    batch_id, batch_jobs = jobs.submit_batch([(name, fake_ingest, (name,)) for name in ("a.pdf", "b.pdf", "bad.pdf")])
+    assert jobs.submit("c.pdf", fake_ingest, "c.pdf") is None      # the batch holds the only slot
+    gate.set()
+
+    deadline = time.time() + 5
+    while any(job.status in ("queued", "running") for job in batch_jobs) and time.time() < deadline:
+        time.sleep(0.01)
+    assert [job.status for job in jobs.get_batch(batch_id)] == ["done", "done", "failed"]
+    assert jobs._slots.acquire(blocking=False)
+
+def test_upload_batch_spools_pdfs_and_unpacks_zips(monkeypatch, tmp_path):
+    """Test that a batch keeps small PDFs in memory within its budget, flattens zip folders and rejects the rest."""
+    import io
+    import zipfile
+    from werkzeug.datastructures import FileStorage
+    import uploads
+
+    monkeypatch.setattr(uploads, "BATCH_MEMORY_BYTES", 150)
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("Course/Week 1/notes.pdf", b"%PDF" + b"1" * 96)
+        z.writestr("Course/Week 2/notes.pdf", b"%PDF" + b"2" * 96)
+        z.writestr("__MACOSX/Course/._notes.pdf", b"junk")
+        z.writestr("Course/readme.txt", b"hi")
+    archive.seek(0)
+
+    batch = uploads.Batch(str(tmp_path))
+    for part in (FileStorage(archive, "course.zip"), FileStorage(io.BytesIO(b"%PDF" + b"1" * 96), "Course Week 1 notes.pdf"),
+                 FileStorage(io.BytesIO(b"text"), "notes.txt"), FileStorage(io.BytesIO(b"PK broken"), "broken.zip")):
+        batch.add_part(part)
+
+    assert [name for name, _ in batch.files] == ["Course_Week_1_notes.pdf", "Course_Week_2_notes.pdf"]
+    assert [r["filename"] for r in batch.rejected] == ["Course_Week_1_notes.pdf", "notes.txt", "broken.zip"]
+    first, second = (upload for _, upload in batch.files)
+    assert first.in_memory and not second.in_memory          # the second is past the 150 byte budget
+    assert second.file.read() == b"%PDF" + b"2" * 96
+
+    path = first.path()                                     # written out only when asked (OCR)
+    with open(path, "rb") as f:
+        assert f.read() == b"%PDF" + b"1" * 96
+    batch.close()
+    assert not os.path.exists(path)
+
+def test_ocr_submit_returns_pages_in_order_and_replaces_a_broken_pool(monkeypatch):
+    """Test an OCR batch returns its pages' text in page order, and a broken process pool is replaced instead of failing every later batch."""
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+
+    class FakeImage:
+        def __init__(self, page):
+            self.page, self.closed = page, False
+
+        def close(self):
+            self.closed = True
+
+    rendered = []
+    def fake_convert(filepath, dpi, first_page, last_page):
+        rendered.extend(FakeImage(p) for p in range(first_page, last_page + 1))
+        return rendered[-(last_page - first_page + 1):]
+
+    monkeypatch.setattr(ocr, "convert_from_path", fake_convert)
+    monkeypatch.setattr(ocr.pytesseract, "image_to_string", lambda image: f"text of page {image.page}")
+    texts, seconds = ocr._ocr_page_range("scan.pdf", 3, 5)
+    assert texts == ["text of page 3", "text of page 4", "text of page 5"] and seconds >= 0
+    assert all(image.closed for image in rendered)          # page images are freed as soon as they are read
+
+    class FakePool:
+        def __init__(self, broken):
+            self.broken = broken
+
+        def submit(self, func, *args):
+            if self.broken:
+                raise BrokenProcessPool("a worker was killed")
+            future = Future()
+            future.set_result(func(*args))
+            return future
+
+        def shutdown(self, wait, cancel_futures):
+            pass
+
+    pools = iter([FakePool(broken=True), FakePool(broken=False)])
+    monkeypatch.setattr(ocr, "_pool", None)
+    monkeypatch.setattr(ocr, "ProcessPoolExecutor", lambda **options: next(pools))
+    assert ocr.submit("scan.pdf", 7, 8).result()[0] == ["text of page 7", "text of page 8"]
+
+def test_interrupted_ingest_is_finished_on_reupload(monkeypatch, tmp_path):
+    """Test an ingest cut off after some chunks were stored isn't skipped as "already processed" on re-upload."""
+    import uuid
+    import chromadb
+
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(f"ingest-{uuid.uuid4().hex}", embedding_function=None)
+    monkeypatch.setattr(rag, "_collection", collection)
+    monkeypatch.setattr(rag, "chunk_index", sampling.ChunkIndex())
+    monkeypatch.setattr(rag, "keyword_index", bm25.BM25Index())
+    monkeypatch.setattr(rag, "embedder", embeddings.EmbeddingService(CountingModel, batch_size=2))
+    monkeypatch.setattr(rag, "ADD_BATCH_SIZE", 2)
+    pages = [(i, f"Page {i} explains topic number {i} in a full sentence of its own.") for i in range(1, 9)]
+    monkeypatch.setattr(rag.chunker, "chunk_pages", lambda page_iter: ((text, n, n) for n, text in page_iter))
+    pdf = tmp_path / "notes.pdf"
+    pdf.write_bytes(b"%PDF same bytes")
+
+    def cut_off(source, progress):
+        yield from pages[:5]
+        raise SystemExit("worker killed")
+
+    monkeypatch.setattr(rag, "iter_pdf_pages", cut_off)
+    with pytest.raises(SystemExit):
+        rag.ingest_file(str(pdf), "notes.pdf")
+    assert 0 < collection.count() < len(pages)              # some batches were already stored
+
+    monkeypatch.setattr(rag, "iter_pdf_pages", lambda source, progress: iter(pages))
+    success, msg = rag.ingest_file(str(pdf), "notes.pdf")
+    assert success and "Already processed" not in msg
+    assert collection.count() == len(pages)
+    assert "4 unchanged" in msg                             # the stored chunks are reused, not re-embedded
+
+    success, msg = rag.ingest_file(str(pdf), "notes.pdf")
+    assert success and msg.startswith("Already processed")
+
+    # EMBED_BATCH_SIZE above ADD_BATCH_SIZE reaches the model during ingestion
+    model = CountingModel()
+    monkeypatch.setattr(rag, "embedder", embeddings.EmbeddingService(lambda: model, batch_size=6))
+    monkeypatch.setattr(rag.chunker, "chunk_pages", lambda page_iter: ((text + " Revised.", n, n) for n, text in page_iter))
+    pdf.write_bytes(b"%PDF revised bytes")
+    assert rag.ingest_file(str(pdf), "notes.pdf")[0]
+    assert model.calls == [6, 2]
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+
+    def extract_text(self):
+        if isinstance(self.text, Exception):
+            raise self.text
+        return self.text
+
+def test_pdf_pages_use_text_layer_and_ocr_only_scanned_runs(monkeypatch, tmp_path):
+    """Test text pages skip OCR, image-only/near-empty runs go to OCR, a failed batch keeps its text layer, and pages stay in order."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    layers = ["Page one has a real text layer.", "", "  ", "Page four has a real text layer.",
+              "fig 2", ValueError("bad page"), "", "Page eight has a real text layer."]
+    monkeypatch.setattr(rag.PyPDF2, "PdfReader", lambda f: type("Reader", (), {"pages": [FakePage(t) for t in layers]})())
+    monkeypatch.setattr(ocr, "OCR_BATCH_PAGES", 2)
+    pdf = tmp_path / "scan.pdf"
+    pdf.write_bytes(b"%PDF stub")
+
+    submitted = []
+    pool = ThreadPoolExecutor(max_workers=4)
+
+    def fake_submit(filepath, first_page, last_page):
+        submitted.append((first_page, last_page))
+        def run():
+            # the first batch finishes last, so later pages are ready before it
+            time.sleep(0.1 if first_page == 2 else 0)
+            if first_page == 7:
+                raise RuntimeError("tesseract is not installed")
+            return [f"OCR text of page {p}" for p in range(first_page, last_page + 1)], 0.01
+        return pool.submit(run)
+
+    monkeypatch.setattr(rag.ocr, "submit", fake_submit)
+    pages = list(rag.iter_pdf_pages(str(pdf)))
+    pool.shutdown()
+
+    assert submitted == [(2, 3), (5, 6), (7, 7)]
+    assert [number for number, _ in pages] == list(range(1, 9))
+    assert pages[0][1] == layers[0] and pages[3][1] == layers[3] and pages[7][1] == layers[7]
+    assert [text for _, text in pages[1:3]] == ["OCR text of page 2", "OCR text of page 3"]
+    assert [text for _, text in pages[4:6]] == ["OCR text of page 5", "OCR text of page 6"]
+    assert pages[6][1] == ""                                 # OCR failed: the (empty) text layer is kept
+
+# ==========================================
+# 3. UNIT TESTS: EMBEDDING SERVICE
+# ==========================================
+
+class CountingModel:
+    """Stand-in embedding model that records the size of every forward pass."""
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(len(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+def test_embedding_cache_hits_on_normalized_query():
+    """Test that repeated queries differing only in case/whitespace reuse the cached embedding."""
+    model = CountingModel()
+    service = embeddings.EmbeddingService(lambda: model, max_wait_ms=1)
+
+    first = service.embed_query(["What is X?"])
+    second = service.embed_query(["  what is   x? "])
+
+    assert first == second
+    assert model.calls == [1]
+    stats = service.stats()
+    assert stats["cache_hits"] == 1 and stats["cache_misses"] == 1
+
+def test_embedding_batches_documents_and_concurrent_queries():
+    """Test that ingestion respects batch_size and concurrent queries share one forward pass."""
+    model = CountingModel()
+    service = embeddings.EmbeddingService(lambda: model, batch_size=4, max_wait_ms=200)
+
+    assert len(service([f"chunk {i}" for i in range(10)])) == 10
+    assert model.calls == [4, 4, 2]
+
+    model.calls.clear()
+    threads = [threading.Thread(target=service.embed_query, args=([f"question {i}"],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(model.calls) == 8
+    assert len(model.calls) < 8
+
+class TokenVectorSession:
+    """Stand-in ONNX session: each token's hidden state is a fixed vector per token id."""
+    VECTORS = {0: [100.0, 100.0], 1: [1.0, 0.0], 2: [0.0, 1.0], 3: [1.0, 1.0]}
+
+    def get_inputs(self):
+        return [type("Input", (), {"name": name})() for name in ("input_ids", "attention_mask")]
+
+    def run(self, outputs, feed):
+        assert set(feed) == {"input_ids", "attention_mask"}
+        import numpy as np
+        return [np.array([[self.VECTORS[i] for i in row] for row in feed["input_ids"]], dtype=np.float32)]
+
+def test_onnx_embedder_mean_pools_without_padding():
+    """Test that ONNX embeddings are mask-weighted means, normalized, and unaffected by batch padding."""
+    tokenizers = pytest.importorskip("tokenizers")
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel({"[PAD]": 0, "cell": 1, "energy": 2, "atp": 3}, unk_token="[PAD]"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+    model = embeddings.OnnxEmbedder(TokenVectorSession(), tokenizer)
+
+    alone = model(["cell"])
+    batch = model(["cell", "cell energy atp"])
+    assert alone[0] == pytest.approx([1.0, 0.0])
+    assert batch[0] == pytest.approx(alone[0])         # the [PAD] positions don't count
+    assert batch[1] == pytest.approx([2 ** -0.5, 2 ** -0.5])
+    assert model([]) == []
+    with pytest.raises(ValueError):
+        embeddings.load_backend("tensorflow")
+
+def test_onnx_export_is_verified_and_cached(monkeypatch, tmp_path):
+    """Test the pinned ONNX export is only used if its SHA-256 matches, and is downloaded once."""
+    import io
+    import hashlib
+    import tarfile
+    import requests
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        for name, data in (("onnx/model.onnx", b"graph"), ("onnx/tokenizer.json", b"{}")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    payload = archive.getvalue()
+    downloads = []
+
+    class FakeResponse:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+        def iter_content(self, size):
+            yield payload
+
+    monkeypatch.setattr(requests, "get", lambda url, **options: downloads.append(url) or FakeResponse())
+    monkeypatch.setitem(embeddings.ONNX_EXPORTS, "tiny", ("https://example.invalid/tiny.tar.gz", "0" * 64))
+    with pytest.raises(ValueError, match="SHA-256"):
+        embeddings._download_onnx_export("tiny", str(tmp_path))
+    assert os.listdir(tmp_path) == []                       # nothing half-downloaded is left behind
+
+    monkeypatch.setitem(embeddings.ONNX_EXPORTS, "tiny", ("https://example.invalid/tiny.tar.gz", hashlib.sha256(payload).hexdigest()))
+    model_dir = embeddings._download_onnx_export("tiny", str(tmp_path))
+    assert sorted(os.listdir(model_dir)) == ["model.onnx", "tokenizer.json"]
+    assert embeddings._download_onnx_export("tiny", str(tmp_path)) == model_dir
+    assert len(downloads) == 2
+    with pytest.raises(ValueError, match="EMBEDDING_ONNX_DIR"):
+        embeddings._download_onnx_export("unknown-model", str(tmp_path))
+
+# ==========================================
+# 4. UNIT TESTS: OLLAMA CLIENT
+# ==========================================
+
+def test_circuit_breaker_opens_and_recovers():
+    """Test that the breaker fails fast after repeated failures and closes after a good trial."""
+    breaker = ollama_client.CircuitBreaker(threshold=2, reset_sec=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()          # single half-open trial
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+def test_model_slots_hand_over_to_waiters_on_any_loop():
+    """Test the in-flight limit is shared by coroutines on different threads' loops, and waiters time out cleanly."""
+    slots = ollama_client.ModelSlots(limit=1)
+    assert asyncio.run(slots.acquire_async(timeout=0))
+
+    async def scenario():
+        assert not await slots.acquire_async(timeout=0.01)      # still held, gives up
+        waiter = asyncio.create_task(slots.acquire_async(timeout=1))
+        await asyncio.sleep(0.01)
+        assert slots.queued() == 1
+        slots.release()                                         # handed straight to the coroutine
+        assert await waiter
+        assert slots.inflight == 1
+
+    asyncio.run(scenario())
+    results = []
+    thread = threading.Thread(target=lambda: results.append(asyncio.run(slots.acquire_async(timeout=5))))
+    thread.start()
+    _wait_for(lambda: slots.queued() == 1)
+    slots.release()                                             # handed to the other thread's loop
+    thread.join()
+    assert results == [True] and slots.inflight == 1
+    slots.release()
+    assert slots.inflight == 0 and slots.queued() == 0
+
+# ==========================================
+# 5. UNIT TESTS: RESPONSE CACHE
+# ==========================================
+
+def test_response_cache_similarity_and_invalidation():
+    """Test near-identical questions hit the cache and re-ingested chunks evict dependent answers."""
+    cache = response_cache.ResponseCache(max_entries=10, ttl_sec=60, similarity=0.99)
+    cache.put("chat", "llama3.1", ["a_1", "a_2"], "answer", "What is X?", [1.0, 0.0])
+
+    assert cache.get("chat", "llama3.1", ["a_1", "a_2"], "what is x?") == "answer"
+    assert cache.get("chat", "llama3.1", ["a_1", "a_2"], "Define X", [0.999, 0.01]) == "answer"
+    assert cache.get("chat", "llama3.1", ["a_1", "a_2"], "Define Y", [0.0, 1.0]) is None
+    assert cache.get("chat", "llama3.1", ["a_3"], "what is x?") is None
+
+    cache.invalidate(["a_2"])
+    assert cache.get("chat", "llama3.1", ["a_1", "a_2"], "what is x?") is None
+    assert cache.stats()["entries"] == 0
+
+# ==========================================
+# 6. UNIT TESTS: CONTEXT SAMPLING
+# ==========================================
+
+def test_sampling_is_stratified_and_prefers_unseen_chunks():
+    """Test samples spread across PDFs, honour the source filter and skip recently used chunks."""
+    index = sampling.ChunkIndex()
+    index.set_source("a.pdf", [f"a_{i}" for i in range(20)])
+    index.set_source("b.pdf", [f"b_{i}" for i in range(20)])
+
+    picked = index.sample(6)
+    assert len(set(picked)) == 6
+    assert sum(p.startswith("a_") for p in picked) == 3
+
+    assert all(p.startswith("b_") for p in index.sample(5, source="b.pdf"))
+    assert index.sample(5, source="missing.pdf") == []
+
+    recent = [f"b_{i}" for i in range(18)]
+    fresh_first = index.sample(3, source="b.pdf", exclude=recent)
+    assert set(fresh_first[:2]) == {"b_18", "b_19"}
+    assert fresh_first[2] in recent
+
+    # with most of both PDFs excluded, the fresh chunks of either still come first
+    both = index.sample(5, exclude=recent + [f"a_{i}" for i in range(19)])
+    assert set(both[:3]) == {"a_19", "b_18", "b_19"} and len(set(both)) == 5
+
+    # ids of a re-ingested PDF's old version no longer count against it
+    index.set_source("b.pdf", ["b_new"])
+    assert index.sample(2, source="b.pdf", exclude=recent) == ["b_new"]
+
+# ==========================================
+# 7. UNIT TESTS: CHUNKER
+# ==========================================
+
+def test_chunker_keeps_sentences_whole_and_tracks_pages():
+    """Test chunks stay under the token budget, never cut a sentence, and record their pages."""
+    sentences = [f"Cell fact number {i} is about mitochondria." for i in range(40)]
+    pages = [(1, " ".join(sentences[:20])), (2, " ".join(sentences[20:]) + "\n\nShort tail.")]
+
+    chunks = list(chunker.chunk_pages(iter(pages), max_tokens=40, overlap_tokens=0))
+
+    assert all(chunker.count_tokens(text) <= 40 for text, _, _ in chunks)
+    assert all(text.endswith(".") for text, _, _ in chunks)
+    assert chunks[0][1:] == (1, 1)
+    assert chunks[-1][2] == 2
+    joined = " ".join(text for text, _, _ in chunks)
+    assert all(sentence in joined for sentence in sentences)
+
+# ==========================================
+# 8. UNIT TESTS: BM25 KEYWORD INDEX AND HYBRID RETRIEVAL
+# ==========================================
+
+def test_bm25_ranks_exact_terms_and_supports_removal():
+    """Test exact-term matches rank first and removed chunks disappear from results."""
+    index = bm25.BM25Index()
+    index.add("notes_1", "CSCI4440 covers retrieval augmented generation.")
+    index.add("notes_2", "Photosynthesis converts light energy into chemical energy.")
+    index.add("notes_3", "Retrieval of memories happens in the hippocampus.")
+
+    results = index.search("What is CSCI4440 about?", k=3)
+    assert results[0][0] == "notes_1"
+    assert {doc for doc, _ in index.search("retrieval", k=3)} == {"notes_1", "notes_3"}
+
+    index.remove("notes_1")
+    assert index.search("CSCI4440") == []
+    assert len(index) == 2
+
+def test_rrf_fuses_rankings_and_rerank_boosts_query_terms():
+    """Test reciprocal rank fusion rewards ids both retrievers rank, and the re-rank lifts chunks covering the query terms."""
+    fused, scores = rag._rrf([["a", "b", "c"], ["c", "a"]], k=60)
+    assert fused == ["a", "c", "b"]
+    assert scores["a"] == pytest.approx(1 / 61 + 1 / 62)
+    assert scores["b"] == pytest.approx(1 / 62)
+
+    documents = {"a": "The Calvin cycle happens in the stroma.",
+                 "c": "The Krebs cycle runs in the mitochondria.",
+                 "b": "Nothing relevant here."}
+    # "c" covers both query terms: 2x its fused score overtakes "a" (1.5x, "cycle" only)
+    assert rag._rerank("What is the Krebs cycle?", fused, documents, scores) == ["c", "a", "b"]
+    assert rag._rerank("?", fused, documents, scores) == fused      # no query terms: order unchanged
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def count(self):
+        return len(self.documents)
+
+    def query(self, query_embeddings, n_results, include):
+        ids = list(self.documents)[:n_results]
+        return {"ids": [ids], "documents": [[self.documents[i] for i in ids]]}
+
+    def get(self, ids, include):
+        return {"ids": ids, "documents": [self.documents[i] for i in ids]}
+
+def test_retrieve_context_fills_budget_with_whole_chunks(monkeypatch):
+    """Test the context stops at CONTEXT_CHAR_BUDGET without cutting a chunk, skipping chunks that no longer fit."""
+    documents = {"first": "a" * 500, "too_long": "b" * 400, "fits": "c" * 300, "over_count": "d" * 10}
+    monkeypatch.setattr(rag, "_collection", FakeCollection(documents))
+    monkeypatch.setattr(rag, "keyword_index", bm25.BM25Index())
+    monkeypatch.setattr(rag.embedder, "embed_query", lambda texts: [[0.0]])
+    monkeypatch.setattr(rag, "RERANK", False)
+    monkeypatch.setattr(rag, "CONTEXT_CHAR_BUDGET", 850)
+
+    context, selected = rag.retrieve_context("anything", n_results=2)
+    assert selected == ["first", "fits"]                    # 500 + 400 is over budget, 500 + 300 is not
+    assert context == documents["first"] + "\n" + documents["fits"]
+
+    # a first chunk larger than the whole budget is still returned whole, and alone
+    monkeypatch.setattr(rag, "CONTEXT_CHAR_BUDGET", 100)
+    context, selected = rag.retrieve_context("anything", n_results=3)
+    assert selected == ["first"] and context == documents["first"]
+
+# ==========================================
+# 9. UNIT TESTS: PROMPT ASSEMBLY
+# ==========================================
+
+def test_prompt_budget_compacts_history_and_skips_repeated_chunks():
+    """Test old turns fold into the summary and chunks already sent are not repeated."""
+    chunk_texts = {f"c{i}": f"Fact number {i} about photosynthesis and chlorophyll. " * 10 for i in range(6)}
+    history = []
+    for i in range(3):
+        history.append({"role": "user", "content": f"Question {i}?"})
+        history.append({"role": "assistant", "content": f"Answer {i}. " * 40, "sources": [f"c{i}", "c5"]})
+
+    messages, summary, compacted, report = prompt.build_chat_prompt(
+        "Be helpful.", history, "", ["c5", "c4"], chunk_texts, "Final question?", budget=1200
+    )
+    assert report["prompt_tokens"] <= 1200
+    assert compacted >= 1 and "Question 0?" in summary
+    assert report["history_turns"] + compacted == 3
+    assert report["repeated_chunks"] == 1     # c5 was already sent with a kept turn
+    prompt_text = "".join(msg["content"] for msg in messages)
+    assert prompt_text.count(chunk_texts["c5"]) == 1
+    assert messages[-1]["content"].endswith("Question: Final question?")
+
+    history, summary = prompt.compact_history(history, "", max_messages=2)
+    assert len(history) == 2 and "Question 1?" in summary
+
+# ==========================================
+# 10. UNIT TESTS: SESSION STORES
+# ==========================================
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_session_store_history_values_and_expiry(backend, tmp_path):
+    """Test both stores append history, keep values per session and expire idle sessions."""
+    if backend == "memory":
+        store = sessions.MemorySessionStore(max_sessions=2, ttl_sec=60)
+    else:
+        store = sessions.SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl_sec=60)
+
+    store.append("s1", [{"role": "user", "content": "Q1"}, {"role": "assistant", "content": "A1", "sources": ["c1"]}])
+    store.append("s1", [{"role": "user", "content": "Q2"}, {"role": "assistant", "content": "A2", "sources": []}])
+    store.set("s1", "chat_summary", "earlier")
+    assert [msg["content"] for msg in store.history("s1")] == ["Q1", "A1", "Q2", "A2"]
+    assert store.history("s1", limit=2)[1] == {"role": "assistant", "content": "A2", "sources": []}
+    assert store.get("s1", "chat_summary") == "earlier"
+    assert store.get("s2", "chat_summary", "") == ""
+
+    store.drop_oldest("s1", 2)
+    assert [msg["content"] for msg in store.history("s1")] == ["Q2", "A2"]
+
+    store.ttl_sec = -1      # every write from now on is already expired
+    store.set("s3", "recent_chunks", ["c1"])
+    assert store.get("s3", "recent_chunks") is None
+    store.purge_expired()
+    assert store.stats()["sessions"] == 1
+    assert len(store.history("s1")) == 2
+
+def test_session_store_interface_and_purge_runs_once(monkeypatch):
+    """Test a store missing a method fails when created, and concurrent writers trigger one purge per interval."""
+    class Incomplete(sessions.SessionStore):
+        def history(self, session_id, limit=None):
+            return []
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+    store = sessions.MemorySessionStore()
+    purges = []
+    barrier = threading.Barrier(8)
+    monkeypatch.setattr(store, "purge_expired", lambda: purges.append(1) or time.sleep(0.05))
+
+    def write(i):
+        barrier.wait()
+        store.set(f"s{i}", "recent_chunks", [i])
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(purges) == 1
+
+# ==========================================
+# 11. UNIT TESTS: FAN-OUT GENERATION
+# ==========================================
+
+def test_fanout_generation_retries_failed_shards_and_dedups(monkeypatch):
+    """Test shards run separately, only the failing shard is retried and duplicates are merged."""
+    calls = []
+
+    async def fake_generate(context, count):
+        calls.append(context)
+        if context == "chunk C" and calls.count(context) == 1:
+            return llm.LLM_ERROR
+        cards = [{"front": f"What is {context}?", "back": "It is explained in the notes."},
+                 {"front": "Shared question", "back": "Same in every shard."},
+                 {"front": "", "back": "invalid, no front"}]
+        # one malformed object must not take the valid ones down with it
+        return "Here you go: [" + json.dumps(cards[0]) + ', {"front": "broken", ' + json.dumps(cards[1]) + ", " + json.dumps(cards[2]) + "]"
+
+    monkeypatch.setitem(generation.KINDS, "flashcards",
+                        (fake_generate, generation.valid_flashcard, "front"))
+    items, stats = asyncio.run(generation.generate_items("flashcards", ["chunk A", "chunk B", "chunk C"], count=10, n_shards=3))
+
+    assert sorted(calls) == ["chunk A", "chunk B", "chunk C", "chunk C"]
+    assert stats["shards"] == 3 and stats["shard_retries"] == 1
+    fronts = [item["front"] for item in items]
+    assert fronts.count("Shared question") == 1
+    assert {"What is chunk A?", "What is chunk B?", "What is chunk C?"} <= set(fronts)
+
+def test_quiz_item_validation():
+    """Test quiz items need options and an answer the UI can match."""
+    item = {"question": "Which gas do plants absorb?", "options": ["Oxygen", "Carbon dioxide"], "correct_answer": "B"}
+    assert generation.valid_quiz_item(item)
+    assert generation.valid_quiz_item(dict(item, correct_answer="Carbon dioxide"))
+    assert not generation.valid_quiz_item(dict(item, correct_answer="E"))
+    assert not generation.valid_quiz_item(dict(item, options=["Oxygen"]))
+
+def test_generation_repairs_items_and_counts_parse_failures(monkeypatch):
+    """Test near-miss items are repaired, and unreadable output counts as a parse failure and regenerates."""
+    outputs = iter([
+        'Sorry, I cannot produce JSON for this.',
+        '[{"prompt": "Which gas do plants absorb?", "choices": {"A": "Oxygen", "B": "Carbon dioxide"}, "answer": "B"}, '
+        '{"question": "Q2", "options": ["x", "y"], "correct_answer": "y",}, {"question": "broken" "options"}]',
+    ])
+
+    async def fake_generate(context, count):
+        return next(outputs)
+
+    monkeypatch.setitem(generation.KINDS, "quiz", (fake_generate, generation.valid_quiz_item, "question"))
+    items, stats = asyncio.run(generation.generate_items("quiz", ["chunk A"], count=3, n_shards=1))
+
+    assert items[0] == {"question": "Which gas do plants absorb?", "options": ["Oxygen", "Carbon dioxide"],
+                        "correct_answer": "Carbon dioxide"}
+    assert items[1]["correct_answer"] == "y"
+    assert stats["completions"] == 2 and stats["shard_retries"] == 1
+    assert stats["parse_failures"] == 2 and stats["repaired_items"] == 1
+    assert generation.stats()["parse_failure_rate"] > 0
+
+    # pre-generated decks are counted apart from interactive requests
+    before = generation.stats()
+    outputs = iter(['no JSON here', '[{"question": "Q", "options": ["a", "b"], "correct_answer": "a"}]'])
+    asyncio.run(ollama_client.as_background(generation.generate_items("quiz", ["chunk A"], count=1, n_shards=1)))
+    after = generation.stats()
+    assert after["parse_failures"] == before["parse_failures"] and after["requests"] == before["requests"]
+    assert after["background"]["parse_failures"] == before["background"]["parse_failures"] + 1
+
+    # the schema Ollama constrains decoding with asks for exactly the shard's share of items
+    schema = llm._quiz_prompt("notes", 4)[2]
+    assert schema["type"] == "array" and schema["maxItems"] == 4
+    assert schema["items"]["required"] == ["question", "options", "correct_answer"]
+
+# ==========================================
+# 12. UNIT TESTS: STREAMING JSON PARSER
+# ==========================================
+
+def test_item_stream_yields_objects_as_they_close():
+    """Test items come out of a token stream as soon as they close, around prose, wrappers and broken objects."""
+    text = ('Sure! ```json\n{"flashcards": [{"front": "Why {braces}?", "back": "Strings \\"quote\\" }"}, '
+            '{"front": "broken", {"front": "Trailing comma", "back": "repaired",}, '
+            '{"question": "Nested?", "options": [{"x": 1}], "correct_answer": "A"}, {"front": "cut off')
+    parser = stream_json.ItemStream()
+    items = []
+    for i in range(0, len(text), 3):
+        got = parser.feed(text[i:i + 3])
+        # the first card must be out before the rest of the output has arrived
+        if got and not items:
+            assert i < text.index("broken")
+        items += got
+
+    assert [item.get("front", item.get("question")) for item in items] == ["Why {braces}?", "Trailing comma", "Nested?"]
+    assert items[0]["back"] == 'Strings "quote" }'
+    assert parser.malformed == 1
+    assert stream_json.parse_items(text) == (items, 1)
+
+def test_stream_items_caps_each_shard_and_dedups(monkeypatch):
+    """Test streamed generation yields new valid items only, at most each shard's share."""
+    async def fake_stream(context, count):
+        cards = [{"front": f"{context} card {i}", "back": "From the notes."} for i in range(count + 2)]
+        cards.insert(1, {"front": "Shared question", "back": "Same in every shard."})
+        text = "[" + ", ".join(json.dumps(card) for card in cards) + "]"
+        for i in range(0, len(text), 7):
+            yield text[i:i + 7]
+
+    monkeypatch.setitem(generation.STREAM_KINDS, "flashcards", fake_stream)
+
+    async def collect():
+        stats = {}
+        items = [item async for item in generation.stream_items("flashcards", ["A", "B"], stats, count=6, n_shards=2)]
+        return items, stats
+
+    items, stats = asyncio.run(collect())
+    fronts = [item["front"] for item in items]
+    assert len(fronts) == len(set(fronts)) == 5
+    assert fronts.count("Shared question") == 1 and stats["duplicate_items"] == 1
+    assert sum(front.startswith("A card") for front in fronts) == 2
+
+def test_llm_stream_skips_garbled_ndjson_lines(monkeypatch):
+    """Test a partial or garbled line from Ollama's NDJSON stream is skipped instead of ending the answer."""
+    from contextlib import asynccontextmanager
+
+    lines = ['{"message": {"content": "The mito"}, "done": false}', '{"message": {"cont',
+             'not json at all', '', '42', '{"message": {"content": "chondria."}, "done": false}',
+             '{"message": {"content": ""}, "done": true}', '{"message": {"content": "after done"}}']
+
+    class FakeResponse:
+        async def aiter_lines(self):
+            for line in lines:
+                yield line
+
+        async def aread(self):
+            return b"<html>502 Bad Gateway</html>"
+
+    @asynccontextmanager
+    async def fake_post(path, payload):
+        yield FakeResponse()
+
+    monkeypatch.setattr(llm.ollama_client, "post", fake_post)
+
+    async def collect():
+        return [token async for token in llm._achat_stream([{"role": "user", "content": "Q"}])]
+
+    assert asyncio.run(collect()) == ["The mito", "chondria."]
+    assert asyncio.run(llm._achat([{"role": "user", "content": "Q"}])) == llm.LLM_ERROR
+
+# ==========================================
+# 13. UNIT TESTS: DECK PRE-GENERATION
+# ==========================================
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_pregen_fills_serves_and_drops_stale_decks(monkeypatch):
+    """Test decks are generated section by section, served, refilled, and dropped when their PDF changes."""
+    index = sampling.ChunkIndex()
+    index.set_source("notes.pdf", [f"c{i}" for i in range(20)])
+    monkeypatch.setattr(pregen.rag, "chunk_index", index)
+    monkeypatch.setattr(pregen.rag, "get_chunks", lambda ids: {i: f"text {i}" for i in ids})
+
+    async def fake_generate(template, chunks):
+        return json.dumps([{"front": chunk, "back": "from the notes"} for chunk in chunks]), {}
+
+    monkeypatch.setattr(pregen.generation, "generate", fake_generate)
+    for name, value in {"_decks": {}, "_cursors": {}, "_pending": pregen.deque(), "_active": None, "_cond": threading.Condition(),
+                        "_worker_thread": None, "_stopping": False, "IDLE_SEC": 0, "POLL_SEC": 0.01,
+                        "_stats": dict.fromkeys(pregen._stats, 0)}.items():
+        monkeypatch.setattr(pregen, name, value)
+    ready = lambda: pregen.stats()["ready"]["flashcards"]
+
+    try:
+        pregen.schedule("notes.pdf", ("flashcards",))
+        _wait_for(lambda: ready() == pregen.DECKS_PER_SOURCE)
+        _wait_for(lambda: pregen.stats()["pending"] == 0)     # the worker has nothing left to do
+        first = pregen.take("flashcards")
+        assert first["source"] == "notes.pdf" and first["section"] == 0
+        assert first["chunk_ids"] == sorted(first["chunk_ids"], key=lambda i: int(i[1:]))
+        assert set(first["chunk_ids"]) <= {f"c{i}" for i in range(12)}
+        assert json.loads(first["response"])[0]["front"] == "text " + first["chunk_ids"][0]
+
+        # a deck built on chunks the session already saw isn't served to it
+        assert pregen.take("flashcards", "notes.pdf", exclude=[f"c{i}" for i in range(20)]) is None
+        _wait_for(lambda: ready() == pregen.DECKS_PER_SOURCE)
+
+        # the new version of the PDF has none of the old chunks
+        index.set_source("notes.pdf", [f"v2-{i}" for i in range(6)])
+        pregen.source_ingested("notes.pdf")
+        assert pregen.stats()["dropped"] == pregen.DECKS_PER_SOURCE
+        _wait_for(lambda: ready() == pregen.DECKS_PER_SOURCE)
+        assert pregen.take("flashcards", "notes.pdf")["chunk_ids"] == [f"v2-{i}" for i in range(6)]
+    finally:
+        pregen.shutdown()
+
+def test_pregen_yields_to_interactive_requests():
+    """Test background requests aren't counted as interactive, and an interactive one preempts a deck."""
+    slot = ollama_client._slot("pregen-test-model")
+    slot.add_background(1)
+    assert asyncio.run(slot.acquire_async(timeout=0))
+    assert ollama_client.interactive("pregen-test-model") == 0
+    slot.release()
+    slot.add_background(-1)
+
+    assert asyncio.run(slot.acquire_async(timeout=0))      # an interactive request is running
+    try:
+        started = time.perf_counter()
+        with pytest.raises(pregen.Preempted):
+            asyncio.run(pregen._preemptible(asyncio.sleep(5)))
+        assert time.perf_counter() - started < 2
+    finally:
+        slot.release()
+    assert asyncio.run(pregen._preemptible(asyncio.sleep(0, result="deck"))) == "deck"
+
+# ==========================================
+# 14. UNIT TESTS: ASGI ENTRY POINT
+# ==========================================
+
+async def _asgi_get(application, path):
+    messages = []
+    requested = asyncio.Event()
+
+    async def receive():
+        if requested.is_set():
+            await asyncio.sleep(3600)               # no disconnect while the response is sent
+        requested.set()
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": [],
+             "http_version": "1.1", "root_path": "", "server": ("testserver", 80)}
+    await application(scope, receive, send)
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+def test_asgi_falls_back_to_flask_on_the_thread_pool():
+    """Test routes without an async version reach Flask, and overlapping WSGI requests run in parallel threads."""
+    import asgi
+
+    assert asyncio.run(_asgi_get(asgi.app, "/")) == (200, b"Hello, World!")
+
+    threads, closed = set(), []
+    # every handler waits until all four are running, so serialized requests break the barrier
+    all_running = threading.Barrier(4, timeout=5)
+
+    class Body(list):
+        def close(self):
+            closed.append(True)
+
+    def slow_wsgi(environ, start_response):
+        threads.add(threading.get_ident())
+        all_running.wait()
+        start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "5")])
+        return Body([b"hel", b"lo, world"])                 # longer than Content-Length
+
+    async def overlapping():
+        return await asyncio.gather(*(_asgi_get(asgi._Wsgi(slow_wsgi), f"/{i}") for i in range(4)))
+
+    responses = asyncio.run(overlapping())
+    assert not all_running.broken
+    assert responses == [(200, b"hello")] * 4
+    assert len(threads) == 4 and len(closed) == 4
+
+# ==========================================
+# 15. UNIT TESTS: TELEMETRY
+# ==========================================
+
+def test_telemetry_buffers_flushes_and_rotates(tmp_path, monkeypatch):
+    """Test log() only buffers, flush() appends the batch with wall-clock timestamps, and big files rotate."""
+    log_file = tmp_path / "telemetry.jsonl"
+    monkeypatch.setattr(telemetry, "LOG_FILE", str(log_file))
+    monkeypatch.setattr(telemetry, "MAX_BYTES", 600)
+    monkeypatch.setattr(telemetry, "BACKUP_COUNT", 2)
+    monkeypatch.setattr(telemetry, "FLUSH_INTERVAL_SEC", 3600)
+    telemetry.flush()
+
+    stages = telemetry.Stages(time.perf_counter())
+    stages.mark("validate")
+    stages.mark("retrieve")
+    for _ in range(5):
+        telemetry.log("rag", "/chat", 10, 20, 0.5, stages=stages.timings)
+    assert not log_file.exists()
+
+    assert telemetry.flush() == 5
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert len(entries) == 5
+    assert abs(entries[0]["timestamp"] - time.time()) < 60
+    assert set(entries[0]["stages"]) == {"validate", "retrieve"}
+
+    for _ in range(3):
+        telemetry.log("rag", "/chat", 10, 20, 0.5)
+        telemetry.flush()
+    assert (tmp_path / "telemetry.jsonl.1").exists()
+    assert len(log_file.read_text().splitlines()) < 5
+
+def test_telemetry_metrics_percentiles(tmp_path, monkeypatch):
+    """Test /metrics percentiles are nearest-rank and split by endpoint and pathway."""
+    monkeypatch.setattr(telemetry, "LOG_FILE", str(tmp_path / "telemetry.jsonl"))
+    assert telemetry.percentiles([]) is None
+    values = [i / 100 for i in range(1, 101)]
+    assert telemetry.percentiles(values) == {"p50": 0.5, "p95": 0.95, "p99": 0.99, "max": 1.0}
+
+    for latency in (0.1, 0.2, 0.3):
+        telemetry.log("rag", "/test_metrics", 0, 0, latency, ttft=latency / 2, stages={"llm": latency})
+    telemetry.log("rag_cached", "/test_metrics", 0, 0, 0.01, success=False)
+    metrics = telemetry.metrics()["/test_metrics"]
+    assert metrics["rag"]["count"] == 3 and metrics["rag"]["latency_sec"]["p50"] == 0.2
+    assert metrics["rag"]["ttft_sec"]["max"] == 0.15 and metrics["rag"]["stages_sec"]["llm"]["p99"] == 0.3
+    assert metrics["rag_cached"]["failures"] == 1
+    telemetry.flush()
+
+# ==========================================
+# 16. ROUTE TESTS: FLASK APP AGAINST THE MOCK OLLAMA
+# ==========================================
+# bench/mock_ollama.py on a free port stands in for Ollama; Chroma is a fresh store in tmp_path.
+
+QUESTION = "How do mitochondria produce energy?"
+
+@pytest.fixture
+def chat_app(monkeypatch, tmp_path):
+    """Yields (Flask app, mock Ollama) over a two-chunk store for notes.pdf that isn't opened yet."""
+    import chromadb
+    from http.server import ThreadingHTTPServer
+    import app as flask_app
+    sys.path.insert(0, os.path.join(parent_dir, "bench"))
+    import mock_ollama
+
+    chroma_path = str(tmp_path / "chroma")
+    chromadb.PersistentClient(path=chroma_path).create_collection("course_notes", embedding_function=None).add(
+        ids=["notes.pdf_0", "notes.pdf_1"],
+        embeddings=[[60.0, 1.0], [52.0, 1.0]],
+        documents=["Mitochondria produce energy for the cell through respiration.",
+                   "Chloroplasts capture light energy for photosynthesis."],
+        metadatas=[{"source": "notes.pdf", "chunk_index": 0}, {"source": "notes.pdf", "chunk_index": 1}],
+    )
+    monkeypatch.setattr(rag, "CHROMA_PATH", chroma_path)
+    monkeypatch.setattr(rag, "_collection", None)
+    monkeypatch.setattr(rag, "chunk_index", sampling.ChunkIndex())
+    monkeypatch.setattr(rag, "keyword_index", bm25.BM25Index())
+    monkeypatch.setattr(rag, "embedder", embeddings.EmbeddingService(CountingModel, max_wait_ms=1))
+    monkeypatch.setattr(response_cache, "cache", response_cache.ResponseCache())
+    monkeypatch.setattr(sessions, "store", sessions.MemorySessionStore())
+    monkeypatch.setattr(telemetry, "LOG_FILE", str(tmp_path / "telemetry.jsonl"))
+
+    mock = mock_ollama.MockOllama(latency=0, tokens_per_sec=2000, max_parallel=4, answer_tokens=12,
+                                  fail_rate=0, cut_rate=0, malformed_rate=0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), mock_ollama.make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(ollama_client, "_base_url", f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(ollama_client, "_breaker", ollama_client.CircuitBreaker(100, 1))
+    try:
+        yield flask_app.app, mock
+    finally:
+        telemetry.flush()       # into tmp_path, before LOG_FILE is restored
+        server.shutdown()
+        server.server_close()
+
+def _sse_events(response):
+    """(event name, data) pairs of a Server-Sent Events response body."""
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if block.strip():
+            fields = dict(line.split(": ", 1) for line in block.splitlines())
+            events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+def test_store_and_model_load_on_the_first_request(chat_app):
+    """Test importing the app opens neither Chroma nor the embedding model, and the first request loads both."""
+    import subprocess
+    code = "import sys, app, rag; print(rag._collection is None, rag.embedder._model is None, 'chromadb' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=parent_dir, capture_output=True, text=True, timeout=120,
+                            env=dict(os.environ, WARMUP_ON_START="0"))
+    assert result.stdout.split()[-3:] == ["True", "True", "False"], result.stderr
+
+    app, mock = chat_app
+    assert rag._collection is None and rag.chunk_index.sources() == {} and len(rag.keyword_index) == 0
+    response = app.test_client().post("/chat", json={"query": QUESTION})
+    assert response.status_code == 200 and response.get_json()["sources"]
+    # the indexes were rebuilt from what the store already held
+    assert rag.chunk_index.ids("notes.pdf") == ["notes.pdf_0", "notes.pdf_1"]
+    assert len(rag.keyword_index) == 2 and rag.embedder._model is not None
+
+def test_chat_stream_sends_sources_tokens_then_done(chat_app):
+    """Test /chat/stream's event order, and that a cached answer arrives as one token."""
+    app, mock = chat_app
+    events = _sse_events(app.test_client().post("/chat/stream", json={"query": QUESTION}))
+    names = [name for name, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert len(names) > 3 and set(names[1:-1]) == {"message"}
+    assert "notes.pdf_0" in events[0][1]["sources"]
+    answer = "".join(data["token"] for _, data in events[1:-1])
+    assert answer.startswith("The cell membrane") and events[-1][1] == {"response_length": len(answer)}
+
+    # the same question from another session is answered from the response cache
+    cached = _sse_events(app.test_client().post("/chat/stream", json={"query": QUESTION}))
+    assert cached == [events[0], ("message", {"token": answer}), events[-1]]
+    assert mock.stats["requests"] == 1
+
+def test_cut_off_chat_stream_is_neither_cached_nor_remembered(chat_app):
+    """Test a stream Ollama cuts off mid-answer isn't cached for other sessions or stored in the session history."""
+    app, mock = chat_app
+    mock.cut_rate = 1
+    client = app.test_client()
+    events = _sse_events(client.post("/chat/stream", json={"query": QUESTION}))
+    tokens = [data["token"] for name, data in events if name == "message"]
+    assert len(tokens) > 1 and tokens[-1] == llm.LLM_ERROR     # partial answer, then the error
+    assert mock.stats["cut"] == 1
+    with client.session_transaction() as flask_session:
+        assert sessions.store.history(flask_session["sid"], limit=10) == []
+
+    # another student asking the same question gets a fresh answer, not the broken one
+    mock.cut_rate = 0
+    response = app.test_client().post("/chat", json={"query": QUESTION}).get_json()
+    assert llm.LLM_ERROR not in response["response"] and response["response"]
+    assert mock.stats["requests"] == 2
+
+# ==========================================
+# 17. INTEGRATION TESTS: LLM FUNCTIONS
 # ==========================================
 # These hit the real Ollama endpoint to verify model behavior and formatting.
 
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+# config
+# An uploaded PDF stays in memory up to UPLOAD_SPOOL_BYTES, past that it rolls over to an
+# anonymous temp file. A batch keeps at most UPLOAD_BATCH_MEMORY_BYTES in memory in total.
+SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(16 * 1024 * 1024)))
+BATCH_MEMORY_BYTES = int(os.getenv("UPLOAD_BATCH_MEMORY_BYTES", str(256 * 1024 * 1024)))
+# limits per /upload_batch request; the byte limit counts PDFs as extracted, so a zip bomb stops there
+MAX_BATCH_FILES = int(os.getenv("UPLOAD_MAX_BATCH_FILES", "200"))
+MAX_BATCH_BYTES = int(os.getenv("UPLOAD_MAX_BATCH_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+_COPY_BLOCK = 1 << 20
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class SpooledPDF:
+    """
+    An uploaded PDF held until its ingestion job has read it: in memory when small, otherwise
+    in an anonymous temp file in `directory`. `file` is the seekable stream PyPDF2 reads.
+    path() writes it out under a name only when a tool needs one (OCR renders from a path);
+    close() releases both.
+    """
+
+    def __init__(self, directory=None, max_size=SPOOL_MAX_BYTES):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_size, dir=directory)
+        self.max_size = max_size
+        self.size = 0
+        self._directory = directory
+        self._path = None
+
+    def write_from(self, stream, limit=None):
+        """
+        Copies a stream in, raising UploadTooLarge once more than `limit` bytes arrive.
+        """
+        while True:
+            block = stream.read(_COPY_BLOCK)
+            if not block:
+                break
+            self.size += len(block)
+            if limit is not None and self.size > limit:
+                raise UploadTooLarge()
+            self.file.write(block)
+        self.file.seek(0)
+        return self
+
+    @property
+    def in_memory(self):
+        return self.size <= self.max_size
+
+    def path(self):
+        if self._path is None:
+            fd, path = tempfile.mkstemp(suffix=".pdf", dir=self._directory)
+            # the PDF reader may be part way through the stream; leave it where it was
+            position = self.file.tell()
+            with os.fdopen(fd, "wb") as out:
+                self.file.seek(0)
+                shutil.copyfileobj(self.file, out, _COPY_BLOCK)
+            self.file.seek(position)
+            self._path = path
+        return self._path
+
+    def close(self):
+        self.file.close()
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+
+class Batch:
+    """
+    Collects the PDFs of one /upload_batch request, from plain parts and from zips.
+    `files` is [(filename, SpooledPDF)] and `rejected` is [{"filename", "error"}]. The count,
+    byte and memory limits apply to the whole batch.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.files = []
+        self.rejected = []
+        self._names = set()
+        self._bytes = 0
+        self._memory = 0
+
+    def add_part(self, part):
+        """
+        Adds one multipart file: a PDF, or a zip whose PDFs are added with their folder
+        path in the name (week1/notes.pdf -> week1_notes.pdf), so same-named files in
+        different folders don't replace each other.
+        """
+        name = part.filename or ""
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(part.stream)
+            except (zipfile.BadZipFile, zipfile.LargeZipFile):
+                return self._reject(name, "Not a readable zip archive")
+            with archive:
+                for info in archive.infolist():
+                    member = info.filename
+                    if info.is_dir() or not member.lower().endswith(".pdf") or _is_junk(member):
+                        continue
+                    try:
+                        with archive.open(info) as stream:
+                            self._add(member, stream)
+                    except (zipfile.BadZipFile, RuntimeError, NotImplementedError):
+                        # a bad header, an encrypted entry or an unsupported compression method
+                        self._reject(secure_filename(member), "Could not read file from the zip")
+        elif name.lower().endswith(".pdf"):
+            self._add(name, part.stream)
+        else:
+            self._reject(name, "Invalid file type. Only PDF files (or a zip of them) are allowed.")
+
+    def _add(self, name, stream):
+        filename = secure_filename(name)
+        if not filename:
+            return self._reject(name, "Invalid file name")
+        if filename in self._names:
+            return self._reject(filename, "Duplicate file name in this batch")
+        if len(self.files) >= MAX_BATCH_FILES:
+            return self._reject(filename, f"Batch is limited to {MAX_BATCH_FILES} files")
+
+        # once the batch's memory budget is spent, later files go straight to disk
+        # (max_size=0 would mean "never roll over", hence 1)
+        upload = SpooledPDF(self.directory, max_size=max(1, min(SPOOL_MAX_BYTES, BATCH_MEMORY_BYTES - self._memory)))
+        try:
+            upload.write_from(stream, limit=MAX_BATCH_BYTES - self._bytes)
+        except UploadTooLarge:
+            upload.close()
+            return self._reject(filename, f"Batch is limited to {MAX_BATCH_BYTES // (1024 * 1024)} MB")
+        except (zipfile.BadZipFile, OSError, EOFError):
+            # a corrupt member stops at its CRC check or truncated data
+            upload.close()
+            return self._reject(filename, "Could not read file")
+        self._bytes += upload.size
+        if upload.in_memory:
+            self._memory += upload.size
+        self._names.add(filename)
+        self.files.append((filename, upload))
+
+    def _reject(self, filename, error):
+        self.rejected.append({"filename": filename, "error": error})
+
+    def close(self):
+        for _, upload in self.files:
+            upload.close()
+
+
+def _is_junk(member):
+    # Finder / Explorer metadata that zips of a course folder usually carry
+    return member.startswith("__MACOSX/") or os.path.basename(member).startswith(".")
@@ -0,0 +1,4 @@
+"""
+Production entry point, served by gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app
@@ -236,22 +236,49 @@ const ChatView: React.FC<{ hasFiles: boolean }> = ({ hasFiles }) => {
     setIsLoading(true);
 
     try {
-      const res = await fetch(`${API_URL}/chat`, {
+      const res = await fetch(`${API_URL}/chat/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         credentials: 'include', // Important for session cookies
         body: JSON.stringify({ query: userMsg }),
       });
-      const data = await res.json();
-      
-      if (res.ok) {
-        setMessages(prev => [...prev, { 
-            role: 'bot', 
-            text: data.response,
-            sources: data.sources 
-        }]);
-      } else {
-        setMessages(prev => [...prev, { role: 'bot', text: `Error: ${data.response || "Something went wrong"}` }]);
+
+      // Blocked queries and "no sources" answers come back as plain JSON
+      if (!res.ok || !res.body || !res.headers.get('Content-Type')?.includes('text/event-stream')) {
+        const data = await res.json();
+        if (res.ok) {
+          setMessages(prev => [...prev, { role: 'bot', text: data.response, sources: data.sources }]);
+        } else {
+          setMessages(prev => [...prev, { role: 'bot', text: `Error: ${data.response || "Something went wrong"}` }]);
+        }
+        return;
+      }
+
+      // Server-Sent Events: "sources" first, then one event per token, then "done"
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      setMessages(prev => [...prev, { role: 'bot', text: "" }]);
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const raw of events) {
+          const dataLine = raw.split("\n").find(line => line.startsWith("data: "));
+          if (!dataLine) continue;
+          const payload = JSON.parse(dataLine.slice(6));
+
+          if (raw.startsWith("event: sources")) {
+            setMessages(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], sources: payload.sources }]);
+          } else if (payload.token !== undefined) {
+            setIsLoading(false);
+            setMessages(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], text: prev[prev.length - 1].text + payload.token }]);
+          }
+        }
       }
     } catch (err) {
       setMessages(prev => [...prev, { role: 'bot', text: "Error connecting to the study server." }]);
@@ -263,7 +290,7 @@ const ChatView: React.FC<{ hasFiles: boolean }> = ({ hasFiles }) => {
   return (
     <div className="max-w-4xl mx-auto h-full flex flex-col">
       <div className="flex-1 overflow-y-auto space-y-6 mb-6 pr-4 custom-scrollbar">
-        {messages.map((msg, idx) => (
+        {messages.filter(msg => msg.text).map((msg, idx) => (
           <div key={idx} className={`flex gap-4 ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}>
             
             {msg.role === 'bot' && (
@@ -336,9 +363,45 @@ const FlashcardView: React.FC = () => {
   const generateFlashcards = async () => {
     setIsGenerating(true);
     try {
-      const res = await fetch(`${API_URL}/generate_flashcards`, { method: 'POST' });
-      const data = await res.json();
-      if (data.flashcards) setFlashcards(data.flashcards);
+      const res = await fetch(`${API_URL}/generate_flashcards/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        credentials: 'include',
+        body: JSON.stringify({}),
+      });
+
+      // "No documents uploaded" comes back as plain JSON
+      if (!res.ok || !res.body || !res.headers.get('Content-Type')?.includes('text/event-stream')) {
+        const data = await res.json();
+        if (data.flashcards) setFlashcards(data.flashcards);
+        return;
+      }
+
+      // Server-Sent Events: one "item" per card as soon as it is written, then "done"
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      const cards: Flashcard[] = [];
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const raw of events) {
+          const dataLine = raw.split("\n").find(line => line.startsWith("data: "));
+          if (!dataLine) continue;
+          const payload = JSON.parse(dataLine.slice(6));
+
+          if (payload.item !== undefined) {
+            // the previous set stays up until the first new card is in
+            cards.push(payload.item);
+            setFlashcards([...cards]);
+          }
+        }
+      }
     } catch (err) {
       console.error(err);
     } finally {
@@ -602,11 +665,21 @@ function App() {
           body: formData,
         });
         
-        if (res.ok) {
-            setUploadedFiles(prev => [...prev, file.name]);
-            return true;
+        if (!res.ok) return false;
+
+        // Ingestion runs in the background; poll the job until it finishes
+        const { job_id } = await res.json();
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const jobRes = await fetch(`${API_URL}/jobs/${job_id}`);
+            if (!jobRes.ok) return false;
+            const job = await jobRes.json();
+            if (job.status === 'done') {
+                setUploadedFiles(prev => [...prev, file.name]);
+                return true;
+            }
+            if (job.status === 'failed') return false;
         }
-        return false;
     } catch (e) {
         return false;
     }